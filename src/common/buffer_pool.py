@@ -0,0 +1,84 @@
+from contextlib import contextmanager
+from threading import Lock
+from typing import BinaryIO, Iterator, Optional
+from common import conf
+
+
+class BufferPool:
+    """
+    Per-process pool of preallocated bytearrays, grouped by size.
+
+    Staging fills the buffers with readinto, so a block costs no new allocation once the
+    pool is warm. At most max_idle_bytes are kept idle in total. When a release would go
+    over that, idle buffers of the sizes released longest ago are dropped first, sizes no
+    longer in use do not keep memory, and a buffer that still does not fit is left to the
+    garbage collector.
+    """
+
+    def __init__(self, max_idle_bytes: int = conf.BUFFER_POOL_MAX_IDLE_BYTES):
+        self._max_idle_bytes = max_idle_bytes
+        self._free: dict[int, list[bytearray]] = {}  # in order of the last release per size
+        self._idle_bytes = 0
+        self._mutex = Lock()
+
+    def acquire(self, size: int) -> bytearray:
+        with self._mutex:
+            free = self._free.get(size)
+            if free:
+                self._idle_bytes -= size
+                return free.pop()
+        return bytearray(size)
+
+    def release(self, buf: bytearray):
+        size = len(buf)
+        if size > self._max_idle_bytes:
+            return
+        with self._mutex:
+            free = self._free.pop(size, [])
+            self._free[size] = free  # most recently used size last
+            for other in list(self._free):
+                if self._idle_bytes + size <= self._max_idle_bytes or other == size:
+                    break
+                self._idle_bytes -= other * len(self._free.pop(other))
+            if self._idle_bytes + size <= self._max_idle_bytes:
+                free.append(buf)
+                self._idle_bytes += size
+
+    @contextmanager
+    def borrow(self, size: int) -> Iterator[bytearray]:
+        buf = self.acquire(size)
+        try:
+            yield buf
+        finally:
+            self.release(buf)
+
+    def idle_count(self, size: Optional[int] = None) -> int:
+        with self._mutex:
+            if size is not None:
+                return len(self._free.get(size, []))
+            return sum(len(free) for free in self._free.values())
+
+    def idle_bytes(self) -> int:
+        with self._mutex:
+            return self._idle_bytes
+
+
+def readinto(stream: BinaryIO, view: memoryview) -> int:
+    """Fill view from stream, streams without readinto fall back to a read and a copy"""
+    if hasattr(stream, "readinto"):
+        return stream.readinto(view) or 0
+    data = stream.read(len(view))
+    view[:len(data)] = data
+    return len(data)
+
+
+_pool: Optional[BufferPool] = None
+_pool_mutex = Lock()
+
+def get_buffer_pool() -> BufferPool:
+    """Return the buffer pool of this process, created lazily so forked workers get their own"""
+    global _pool
+    with _pool_mutex:
+        if _pool is None:
+            _pool = BufferPool()
+        return _pool
@@ -0,0 +1,59 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Callable, Hashable, Optional
+
+
+class TTLCache:
+    """
+    Thread safe in-process cache with a per entry time to live and an optional size bound.
+
+    When maxsize is given the least recently used entry is dropped first. A ttl of None
+    means entries never expire and are only dropped by the size bound or invalidation.
+    """
+
+    def __init__(self, ttl: Optional[float], maxsize: Optional[int] = None):
+        self._ttl = ttl
+        self._maxsize = maxsize
+        self._entries: OrderedDict[Hashable, tuple[Any, float]] = OrderedDict()
+        self._mutex = Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._mutex:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        expires = time.monotonic() + self._ttl if self._ttl is not None else float("inf")
+        with self._mutex:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            if self._maxsize is not None:
+                while len(self._entries) > self._maxsize:
+                    self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._mutex:
+            entry = self._entries.pop(key, None)
+        return entry[0] if entry is not None else default
+
+    def invalidate(self, predicate: Callable[[Hashable], bool]):
+        """Drop every entry whose key matches predicate"""
+        with self._mutex:
+            for key in [k for k in self._entries if predicate(k)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._mutex:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        with self._mutex:
+            return len(self._entries)
@@ -0,0 +1,54 @@
+import hashlib
+import zlib
+from typing import Any, Callable
+from common import conf
+
+# OMERO ChecksumAlgorithm values supported for uploads
+SHA1_160 = "SHA1-160"
+MD5_128 = "MD5-128"
+CRC_32 = "CRC-32"
+ADLER_32 = "Adler-32"
+
+
+class _ZlibChecksum:
+    """hashlib style wrapper around the running zlib.crc32/adler32 value"""
+
+    def __init__(self, fn: Callable[[Any, int], int], start: int):
+        self._fn = fn
+        self._value = start
+
+    def update(self, data):
+        self._value = self._fn(data, self._value)
+
+    def copy(self) -> "_ZlibChecksum":
+        return _ZlibChecksum(self._fn, self._value)
+
+    def hexdigest(self) -> str:
+        # OMERO formats the 32 bit checksums through Guava's HashCode, i.e. the little endian bytes
+        return self._value.to_bytes(4, "little").hex()
+
+
+_FACTORIES: dict[str, Callable[[], Any]] = {
+    SHA1_160: hashlib.sha1,
+    MD5_128: hashlib.md5,
+    CRC_32: lambda: _ZlibChecksum(zlib.crc32, 0),
+    ADLER_32: lambda: _ZlibChecksum(zlib.adler32, 1),
+}
+
+
+def supported_algorithms() -> list[str]:
+    return list(_FACTORIES)
+
+
+def new_checksum(algorithm: str = conf.UPLOAD_CHECKSUM_ALGORITHM) -> Any:
+    """New hash object (update/copy/hexdigest) producing the hex digest OMERO stores for algorithm"""
+    factory = _FACTORIES.get(algorithm)
+    if factory is None:
+        raise ValueError(f"Unsupported checksum algorithm {algorithm}, use one of {supported_algorithms()}")
+    return factory()
+
+
+def file_checksum(path: str, algorithm: str = conf.UPLOAD_CHECKSUM_ALGORITHM) -> str:
+    """Checksum of a local file as OMERO stores it for imported files"""
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, lambda: new_checksum(algorithm)).hexdigest()  # type: ignore[arg-type]
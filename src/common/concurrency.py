@@ -0,0 +1,88 @@
+from concurrent.futures import CancelledError, Future
+from threading import Lock
+from typing import Any, Callable, Hashable
+
+
+class SingleFlight:
+    """
+    Collapse concurrent calls for the same key into one.
+
+    The first caller for a key runs the function, callers arriving while it runs wait for
+    and share its result or exception. Once the call is done the key is free again, so
+    results are not cached here, combine with a cache for that.
+    """
+
+    def __init__(self):
+        self._mutex = Lock()
+        self._calls: dict[Hashable, Future] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._mutex:
+            future = self._calls.get(key)
+            leader = future is None
+            if future is None:
+                future = Future()
+                self._calls[key] = future
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._mutex:
+                self._calls.pop(key, None)
+
+
+def then(future: Future, fn: Callable[[Any], Any]) -> Future:
+    """Future of fn(result of future), failures of either are propagated"""
+    chained: Future = Future()
+
+    def done(f: Future):
+        try:
+            chained.set_result(fn(f.result()))
+        except BaseException as e:
+            chained.set_exception(e)
+
+    future.add_done_callback(done)
+    return chained
+
+
+def gather(futures: list[Future], wait_all: bool = False) -> Future:
+    """
+    Future of the results of all futures in order, fails with the first failure.
+
+    With wait_all a failure is only reported once every future is done, for callers that
+    must not release what the other futures still use.
+    """
+    gathered: Future = Future()
+    if not futures:
+        gathered.set_result([])
+        return gathered
+
+    remaining = [len(futures)]
+    first_error: list[BaseException] = []
+    mutex = Lock()
+
+    def done(f: Future):
+        with mutex:
+            if gathered.done():
+                return
+            error = CancelledError() if f.cancelled() else f.exception()
+            if error is not None and not first_error:
+                first_error.append(error)
+            remaining[0] -= 1
+            if first_error and (not wait_all or remaining[0] == 0):
+                gathered.set_exception(first_error[0])
+            elif remaining[0] == 0:
+                gathered.set_result([x.result() for x in futures])
+
+    for f in futures:
+        f.add_done_callback(done)
+    return gathered
@@ -35,12 +35,74 @@ LOG_LEVEL = logging.DEBUG
 FILE_IMPORT_THREADS = 8
 GENERATE_THUMBNAILS = False
 
+# Per-process pool of joined OMERO sessions, keyed by (token, host, group)
+OMERO_POOL_MAX_SIZE: int = 32
+OMERO_POOL_IDLE_TIMEOUT_SEC: int = 60 * 5
+OMERO_POOL_HEALTH_CHECK_AFTER_SEC: int = 30
+# Imports of one session token run on their own pooled connections, at most this many at a time
+OMERO_IMPORT_CONNECTIONS_PER_TOKEN: int = 4
+
+# Background keepalive of joined OMERO sessions (pooled and importing ones)
+OMERO_KEEPALIVE_ENABLED: bool = True
+OMERO_KEEPALIVE_INTERVAL_SEC: int = 60
+
+# In-process caches of OMERO annotation lookups, per group
+ANNOTATION_CACHE_TTL_SEC: int = 60 * 10
+ANNOTATION_CACHE_MAX_SIZE: int = 10000
+TAG_INDEX_CACHE_TTL_SEC: int = 60
+TAG_ID_CACHE_MAX_SIZE: int = 1024
+BATCH_CONTEXT_TTL_SEC: int = 60 * 60
+CONTAINER_CACHE_TTL_SEC: int = 60 * 10
+
+# Hash staged files before upload and skip the ones already imported into the group
+PRE_UPLOAD_DEDUPE_ENABLED: bool = True
+
+# Checksum OMERO verifies uploads with: SHA1-160, MD5-128, CRC-32 or Adler-32 (see common.checksum)
+UPLOAD_CHECKSUM_ALGORITHM: str = "SHA1-160"
+# Files imported exactly as staged (no conversion) reuse the checksum computed while staging instead of hashing on upload
+UPLOAD_REUSE_STAGED_CHECKSUM: bool = True
+
+# Pipelined RawFileStore upload: block size, async writes kept in flight and blocks queued between stages
+UPLOAD_BLOCK_SIZE: int = 1024 * 1024
+# The block size adapts per upload within these bounds, see BlockSizeController
+UPLOAD_BLOCK_SIZE_MIN: int = 256 * 1024
+UPLOAD_BLOCK_SIZE_MAX: int = 16 * 1024 * 1024
+UPLOAD_BLOCK_ADAPT_WINDOW: int = 8
+UPLOAD_TARGET_WRITE_LATENCY_SEC: float = 2.0
+UPLOAD_WRITES_IN_FLIGHT: int = 4
+UPLOAD_QUEUE_DEPTH: int = 4
+# Bytes of idle staging buffers kept per process
+BUFFER_POOL_MAX_IDLE_BYTES: int = 64 * 1024 * 1024
+# Files of one multi-file fileset uploaded concurrently, each through its own uploader
+UPLOAD_FILESET_CONCURRENCY: int = 4
+# Backoff between resumed upload attempts, doubled per retry up to the max (IMPORT_NR_OF_RETRIES attempts)
+UPLOAD_RETRY_BACKOFF_SEC: float = 1.0
+UPLOAD_RETRY_BACKOFF_MAX_SEC: float = 30.0
+
+# Server side import verification is tracked by one watcher thread, finished imports are completed by a small pool
+IMPORT_WATCH_POLL_SEC: float = 5.0
+IMPORT_FINISH_THREADS: int = 2
+
+# Progress events are sent at most every PROGRESS_MIN_INTERVAL_SEC per file and only when they moved by
+# PROGRESS_MIN_DELTA_PERCENT, the final 100% is always sent
+PROGRESS_MIN_INTERVAL_SEC: float = 1.0
+PROGRESS_MIN_DELTA_PERCENT: int = 1
+
 #configs for local running
 USE_TEST_URL = True
 DB_HANDLER = "postgres"
 
 MAX_SIZE_FULL_UPLOAD = 1024 * 1024 * 30 # 30 MB in bytes
 CHUNK_SIZE = 1024 * 1024 * 10 #1024 * 1024 is 1MB
+# Resumable browser uploads: size of the chunks the browser sends, sessions without a chunk written within the ttl are removed
+CHUNKED_UPLOAD_CHUNK_SIZE: int = 8 * 1024 * 1024
+CHUNKED_UPLOAD_TTL_SEC: int = 2 * 60 * 60
+CHUNKED_UPLOAD_PURGE_INTERVAL_SEC: int = 5 * 60
+# Disk reserved for open upload sessions: largest file and total per user
+CHUNKED_UPLOAD_MAX_FILE_SIZE: int = 64 * 1024 * 1024 * 1024
+CHUNKED_UPLOAD_MAX_USER_BYTES: int = 256 * 1024 * 1024 * 1024
+CHUNKED_UPLOAD_MAX_CONCURRENT_WRITES: int = 16  # chunk PUTs written at once per worker process, more get a 429
+CHUNKED_UPLOAD_RETRY_AFTER_SEC: int = 2
 USE_CHUNK_READ_ON_LARGE_FILES = True
 
 REDIS_URL = "redis://:redis@redis-omero-test:6379/0"
@@ -99,6 +161,13 @@ try:
     DB_HANDLER = getattr(config, "DB_HANDLER", DB_HANDLER)
     LOG_LEVEL = getattr(config, "LOG_LEVEL", LOG_LEVEL)
     USE_CHUNK_READ_ON_LARGE_FILES = getattr(config, "USE_CHUNK_READ_ON_LARGE_FILES", USE_CHUNK_READ_ON_LARGE_FILES)
+    CHUNKED_UPLOAD_CHUNK_SIZE = getattr(config, "CHUNKED_UPLOAD_CHUNK_SIZE", CHUNKED_UPLOAD_CHUNK_SIZE)
+    CHUNKED_UPLOAD_TTL_SEC = getattr(config, "CHUNKED_UPLOAD_TTL_SEC", CHUNKED_UPLOAD_TTL_SEC)
+    CHUNKED_UPLOAD_PURGE_INTERVAL_SEC = getattr(config, "CHUNKED_UPLOAD_PURGE_INTERVAL_SEC", CHUNKED_UPLOAD_PURGE_INTERVAL_SEC)
+    CHUNKED_UPLOAD_MAX_FILE_SIZE = getattr(config, "CHUNKED_UPLOAD_MAX_FILE_SIZE", CHUNKED_UPLOAD_MAX_FILE_SIZE)
+    CHUNKED_UPLOAD_MAX_USER_BYTES = getattr(config, "CHUNKED_UPLOAD_MAX_USER_BYTES", CHUNKED_UPLOAD_MAX_USER_BYTES)
+    CHUNKED_UPLOAD_MAX_CONCURRENT_WRITES = getattr(config, "CHUNKED_UPLOAD_MAX_CONCURRENT_WRITES", CHUNKED_UPLOAD_MAX_CONCURRENT_WRITES)
+    CHUNKED_UPLOAD_RETRY_AFTER_SEC = getattr(config, "CHUNKED_UPLOAD_RETRY_AFTER_SEC", CHUNKED_UPLOAD_RETRY_AFTER_SEC)
     REDIS_URL = getattr(config, "REDIS_URL", REDIS_URL)
     USE_FAKE_REDIS = getattr(config, "USE_FAKE_REDIS", USE_FAKE_REDIS)
 
@@ -111,6 +180,36 @@ try:
     CZI_PYRAMIDIZER_MODE = getattr(config, "CZI_PYRAMIDIZER_MODE", CZI_PYRAMIDIZER_MODE)
 
     GENERATE_THUMBNAILS = getattr(config, "GENERATE_THUMBNAILS", GENERATE_THUMBNAILS)
+    OMERO_POOL_MAX_SIZE = getattr(config, "OMERO_POOL_MAX_SIZE", OMERO_POOL_MAX_SIZE)
+    OMERO_POOL_IDLE_TIMEOUT_SEC = getattr(config, "OMERO_POOL_IDLE_TIMEOUT_SEC", OMERO_POOL_IDLE_TIMEOUT_SEC)
+    OMERO_POOL_HEALTH_CHECK_AFTER_SEC = getattr(config, "OMERO_POOL_HEALTH_CHECK_AFTER_SEC", OMERO_POOL_HEALTH_CHECK_AFTER_SEC)
+    OMERO_IMPORT_CONNECTIONS_PER_TOKEN = getattr(config, "OMERO_IMPORT_CONNECTIONS_PER_TOKEN", OMERO_IMPORT_CONNECTIONS_PER_TOKEN)
+    OMERO_KEEPALIVE_ENABLED = getattr(config, "OMERO_KEEPALIVE_ENABLED", OMERO_KEEPALIVE_ENABLED)
+    OMERO_KEEPALIVE_INTERVAL_SEC = getattr(config, "OMERO_KEEPALIVE_INTERVAL_SEC", OMERO_KEEPALIVE_INTERVAL_SEC)
+    ANNOTATION_CACHE_TTL_SEC = getattr(config, "ANNOTATION_CACHE_TTL_SEC", ANNOTATION_CACHE_TTL_SEC)
+    ANNOTATION_CACHE_MAX_SIZE = getattr(config, "ANNOTATION_CACHE_MAX_SIZE", ANNOTATION_CACHE_MAX_SIZE)
+    TAG_INDEX_CACHE_TTL_SEC = getattr(config, "TAG_INDEX_CACHE_TTL_SEC", TAG_INDEX_CACHE_TTL_SEC)
+    TAG_ID_CACHE_MAX_SIZE = getattr(config, "TAG_ID_CACHE_MAX_SIZE", TAG_ID_CACHE_MAX_SIZE)
+    BATCH_CONTEXT_TTL_SEC = getattr(config, "BATCH_CONTEXT_TTL_SEC", BATCH_CONTEXT_TTL_SEC)
+    CONTAINER_CACHE_TTL_SEC = getattr(config, "CONTAINER_CACHE_TTL_SEC", CONTAINER_CACHE_TTL_SEC)
+    PRE_UPLOAD_DEDUPE_ENABLED = getattr(config, "PRE_UPLOAD_DEDUPE_ENABLED", PRE_UPLOAD_DEDUPE_ENABLED)
+    UPLOAD_CHECKSUM_ALGORITHM = getattr(config, "UPLOAD_CHECKSUM_ALGORITHM", UPLOAD_CHECKSUM_ALGORITHM)
+    UPLOAD_REUSE_STAGED_CHECKSUM = getattr(config, "UPLOAD_REUSE_STAGED_CHECKSUM", UPLOAD_REUSE_STAGED_CHECKSUM)
+    UPLOAD_BLOCK_SIZE = getattr(config, "UPLOAD_BLOCK_SIZE", UPLOAD_BLOCK_SIZE)
+    UPLOAD_BLOCK_SIZE_MIN = getattr(config, "UPLOAD_BLOCK_SIZE_MIN", UPLOAD_BLOCK_SIZE_MIN)
+    UPLOAD_BLOCK_SIZE_MAX = getattr(config, "UPLOAD_BLOCK_SIZE_MAX", UPLOAD_BLOCK_SIZE_MAX)
+    UPLOAD_BLOCK_ADAPT_WINDOW = getattr(config, "UPLOAD_BLOCK_ADAPT_WINDOW", UPLOAD_BLOCK_ADAPT_WINDOW)
+    UPLOAD_TARGET_WRITE_LATENCY_SEC = getattr(config, "UPLOAD_TARGET_WRITE_LATENCY_SEC", UPLOAD_TARGET_WRITE_LATENCY_SEC)
+    UPLOAD_WRITES_IN_FLIGHT = getattr(config, "UPLOAD_WRITES_IN_FLIGHT", UPLOAD_WRITES_IN_FLIGHT)
+    UPLOAD_QUEUE_DEPTH = getattr(config, "UPLOAD_QUEUE_DEPTH", UPLOAD_QUEUE_DEPTH)
+    BUFFER_POOL_MAX_IDLE_BYTES = getattr(config, "BUFFER_POOL_MAX_IDLE_BYTES", BUFFER_POOL_MAX_IDLE_BYTES)
+    UPLOAD_FILESET_CONCURRENCY = getattr(config, "UPLOAD_FILESET_CONCURRENCY", UPLOAD_FILESET_CONCURRENCY)
+    UPLOAD_RETRY_BACKOFF_SEC = getattr(config, "UPLOAD_RETRY_BACKOFF_SEC", UPLOAD_RETRY_BACKOFF_SEC)
+    UPLOAD_RETRY_BACKOFF_MAX_SEC = getattr(config, "UPLOAD_RETRY_BACKOFF_MAX_SEC", UPLOAD_RETRY_BACKOFF_MAX_SEC)
+    IMPORT_WATCH_POLL_SEC = getattr(config, "IMPORT_WATCH_POLL_SEC", IMPORT_WATCH_POLL_SEC)
+    IMPORT_FINISH_THREADS = getattr(config, "IMPORT_FINISH_THREADS", IMPORT_FINISH_THREADS)
+    PROGRESS_MIN_INTERVAL_SEC = getattr(config, "PROGRESS_MIN_INTERVAL_SEC", PROGRESS_MIN_INTERVAL_SEC)
+    PROGRESS_MIN_DELTA_PERCENT = getattr(config, "PROGRESS_MIN_DELTA_PERCENT", PROGRESS_MIN_DELTA_PERCENT)
     USER_VARIABLES = getattr(config, "USER_VARIABLES", USER_VARIABLES)
     USE_BIOIO = getattr(config, "USE_BIOIO", USE_BIOIO)
     MICROSCOPE_ID_TO_NAME = getattr(config, "MICROSCOPE_ID_TO_NAME", MICROSCOPE_ID_TO_NAME)
@@ -172,5 +271,6 @@ APP_VERSION = BUILD + "-" + SHA
 OMERO_SESSION_TOKEN_KEY = "omero_token"
 OMERO_SESSION_HOST_KEY  = "omero_host"
 OMERO_SESSION_PORT_KEY  = "omero_port"
+OMERO_SESSION_GROUP_KEY = "omero_group"
 OMERO_G_CONNECTION_KEY  = "connection"
 OMERO_G_IMPORTER_KEY    = "importer"
\ No newline at end of file
@@ -0,0 +1,87 @@
+import bisect
+from dataclasses import dataclass
+from datetime import datetime
+from threading import Lock
+from typing import Optional
+from common import conf
+from common import logger
+from common.omero_connection import OmeroConnection
+from common.omero_query import OmeroQuery
+
+ACQUISITION_DATE_KEY = "Acquisition date"
+
+
+@dataclass(frozen=True)
+class IndexedImage:
+    image_id: int
+    name: str
+    acquisition_date: Optional[datetime]  # Image.acquisitionDate
+    acquisition_date_value: Optional[str]  # first 'Acquisition date' map annotation value
+
+    def acquired_at(self, compare_date: datetime, fmt_str: str = "%H-%M-%S") -> bool:
+        """True if the image was acquired at compare_date, compared in fmt_str resolution"""
+        acq_time = self.acquisition_date
+        if acq_time is None and self.acquisition_date_value:
+            try:
+                acq_time = datetime.strptime(self.acquisition_date_value, conf.DATE_TIME_FMT)
+            except ValueError:
+                logger.warning(f"Unparsable acquisition date '{self.acquisition_date_value}' on image id {self.image_id}")
+        if acq_time is None:
+            logger.warning(f"No acquisition date stored in image id {self.image_id}")
+            return False
+
+        return acq_time.strftime(fmt_str) == compare_date.strftime(fmt_str)
+
+
+class DatasetImageIndex:
+    """
+    Name index over the images of one dataset, used for duplicate detection.
+
+    Loaded with two projections (image rows and their 'Acquisition date' map values)
+    instead of walking the dataset and loading every candidate image, and kept up
+    to date by the importer for the images it adds itself.
+    """
+
+    def __init__(self, dataset_id: int, images: list[IndexedImage]):
+        self.dataset_id = dataset_id
+        self._mutex = Lock()
+        self._names: list[tuple[str, int]] = sorted((i.name, i.image_id) for i in images)
+        self._images: dict[int, IndexedImage] = {i.image_id: i for i in images}
+
+    @classmethod
+    def load(cls, conn: OmeroConnection, dataset_id: int) -> "DatasetImageIndex":
+        query = OmeroQuery(conn)
+        values: dict[int, str] = {}
+        for image_id, value in query.dataset_image_map_values(dataset_id, ACQUISITION_DATE_KEY):
+            values.setdefault(image_id, value)
+
+        images = [
+            IndexedImage(image_id, name,
+                         datetime.fromtimestamp(acq_ms / 1000) if acq_ms is not None else None,
+                         values.get(image_id))
+            for image_id, name, acq_ms in query.dataset_images(dataset_id)
+        ]
+        logger.debug(f"Indexed {len(images)} images of dataset {dataset_id}")
+        return cls(dataset_id, images)
+
+    def find_by_prefix(self, prefix: str) -> Optional[IndexedImage]:
+        """The oldest image whose name starts with prefix, multi series files get a ' [series]' suffix"""
+        with self._mutex:
+            start = bisect.bisect_left(self._names, (prefix,))
+            image_id = None
+            for name, iid in self._names[start:]:
+                if not name.startswith(prefix):
+                    break
+                image_id = iid if image_id is None else min(image_id, iid)
+            return self._images[image_id] if image_id is not None else None
+
+    def add(self, image: IndexedImage):
+        with self._mutex:
+            if image.image_id in self._images:
+                return
+            bisect.insort(self._names, (image.name, image.image_id))
+            self._images[image.image_id] = image
+
+    def __len__(self) -> int:
+        with self._mutex:
+            return len(self._images)
@@ -1,5 +1,9 @@
 import os
-from typing import Optional
+from typing import Optional, TYPE_CHECKING
+from common.import_timings import ImportTimings
+
+if TYPE_CHECKING:
+    from omerofrontend.upload_pipeline import UploadStats
 
 class FileData:
     
@@ -7,13 +11,16 @@ class FileData:
     
     def __init__(self,fileBaseNames):
         self.originalFileNames = []
-        self._upload_paths: list[str] = []
+        self._companion_paths: list[str] = [] # uploaded in the same fileset as the main upload file
         self.tempPaths: list[str] = []
         self.basePath: str = ""
         self.convertedFileName: Optional[str] = None
         self.fileSizes: list[int] = []
         self.annotations: Optional[dict[str,str]] = None
         self.username: Optional[str] = None
+        self._file_hashes: dict[str, str] = {} # path -> hex digest in conf.UPLOAD_CHECKSUM_ALGORITHM
+        self._upload_stats: list["UploadStats"] = [] # one per file sent to OMERO
+        self._import_timings = ImportTimings()
         for f in fileBaseNames:
             basename = os.path.basename(os.path.normpath(f))
             self.originalFileNames.append(basename)
@@ -90,6 +97,13 @@ class FileData:
 
         return self.getMainFileTempPath()
 
+    def setCompanionFilePaths(self, paths: list[str]):
+        self._companion_paths = list(paths)
+
+    def getUploadFilePaths(self) -> list[str]:
+        """All files of the fileset to upload, the main upload file first"""
+        return [self.getUploadFilePath()] + self._companion_paths
+
     def hasConvertedFileName(self):
         return self.convertedFileName is not None
     
@@ -111,7 +125,26 @@ class FileData:
             pathToRename = self.basePath + "/" + self.getConvertedFileName()
             self.setConvertedFileName(newName)
 
-        os.rename(pathToRename, self.basePath + "/" + newName) 
+        newPath = self.basePath + "/" + newName
+        os.rename(pathToRename, newPath)
+        file_hash = self._file_hashes.pop(os.path.normpath(pathToRename), None)
+        if file_hash is not None:
+            self.setFileHash(newPath, file_hash) 
+
+    def setFileHash(self, path: str, file_hash: str):
+        self._file_hashes[os.path.normpath(path)] = file_hash
+
+    def getFileHash(self, path: str) -> Optional[str]:
+        return self._file_hashes.get(os.path.normpath(path))
+
+    def addUploadStats(self, stats: "UploadStats"):
+        self._upload_stats.append(stats)
+
+    def getUploadStats(self) -> list["UploadStats"]:
+        return self._upload_stats
+
+    def getImportTimings(self) -> ImportTimings:
+        return self._import_timings
 
     def setFileSizes(self, sizes):
         self.fileSizes = sizes
@@ -35,6 +35,7 @@ from ome_types.model import Map
 from ome_types.model.simple_types import PixelType, UnitsLength
 from common import conf
 from common import czi_pyramidizer
+from common import import_timings
 from common import logger
 from common.file_data import FileData
 from omerofrontend.exceptions import MetaDataError
@@ -1460,7 +1461,8 @@ def _handle_czi_with_pyramidizer(fileData: FileData, img_path: str, key_pair: di
     destination_path = czi_pyramidizer.default_pyramidized_path(img_path)
 
     try:
-        check_result = czi_pyramidizer.check_needs_pyramid(img_path)
+        with fileData.getImportTimings().measure(import_timings.PYRAMIDIZE, source_size):
+            check_result = czi_pyramidizer.check_needs_pyramid(img_path)
         logger.info(
             "CZI pyramid check done "
             f"czi_pyramid_check_exit_code={check_result.run_result.exit_code} "
@@ -1470,7 +1472,8 @@ def _handle_czi_with_pyramidizer(fileData: FileData, img_path: str, key_pair: di
         if not check_result.needs_pyramid:
             return [img_path]
 
-        build_result = czi_pyramidizer.build_pyramid(img_path, destination_path)
+        with fileData.getImportTimings().measure(import_timings.PYRAMIDIZE):
+            build_result = czi_pyramidizer.build_pyramid(img_path, destination_path)
         logger.info(
             "CZI pyramid build done "
             f"czi_pyramid_build_exit_code={build_result.run_result.exit_code} "
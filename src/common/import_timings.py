@@ -0,0 +1,58 @@
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from threading import Lock
+from typing import Iterator
+
+# Phases of one import, in the order they happen
+STAGING = "staging"          # request body to the temp file
+QUEUE_WAIT = "queue_wait"    # waiting for a free import thread
+CONVERSION = "conversion"    # file_format_splitter, includes pyramidize
+PYRAMIDIZE = "pyramidize"    # CZI pyramid check and build
+DEDUPE = "dedupe"            # name and content duplicate checks
+ANNOTATIONS = "annotations"  # map/tag annotation lookups and attachments
+TRANSFER = "transfer"        # bytes to the OMERO RawFileStores
+VERIFY = "verify"            # verifyUpload until OMERO reports the import finished
+
+
+@dataclass
+class PhaseTiming:
+    seconds: float = 0.0
+    bytes: int = 0
+    count: int = 0
+
+
+class ImportTimings:
+    """Wall time and bytes per import phase, phases entered more than once are summed"""
+
+    def __init__(self):
+        self._phases: dict[str, PhaseTiming] = {}
+        self._mutex = Lock()
+
+    def add(self, phase: str, seconds: float, nbytes: int = 0):
+        with self._mutex:
+            timing = self._phases.setdefault(phase, PhaseTiming())
+            timing.seconds += seconds
+            timing.bytes += nbytes
+            timing.count += 1
+
+    @contextmanager
+    def measure(self, phase: str, nbytes: int = 0) -> Iterator[None]:
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(phase, time.monotonic() - start, nbytes)
+
+    def phases(self) -> dict[str, PhaseTiming]:
+        with self._mutex:
+            return {name: PhaseTiming(t.seconds, t.bytes, t.count) for name, t in self._phases.items()}
+
+    def log_line(self) -> str:
+        """All phases as key=value pairs, on one line for log parsing"""
+        parts = []
+        for name, t in self.phases().items():
+            parts.append(f"{name}_s={t.seconds:.3f}")
+            if t.bytes:
+                parts.append(f"{name}_bytes={t.bytes}")
+        return " ".join(parts)
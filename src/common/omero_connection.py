@@ -1,4 +1,6 @@
+import time
 from threading import Lock
+from typing import Optional
 import omero
 import omero.rtypes
 from omero.gateway import BlitzGateway, CommentAnnotationWrapper, DatasetWrapper, ImageWrapper
@@ -10,6 +12,10 @@ class OmeroConnection:
         self.omero_token = token
         self.hostname = hostname
         self.port = port
+        self.group: Optional[str] = None
+        self.last_seen: float = 0.0  # time.monotonic() of the last successful keepalive
+        self.dead: bool = False
+        self.closed: bool = False
         self.conn: BlitzGateway
         
         self._mutex = Lock()
@@ -21,7 +27,38 @@ class OmeroConnection:
     
     def kill_session(self):
         self._close_omero_connection(True)
+
+    def close(self):
+        """Detach from the session without killing it, other joins stay valid"""
+        self._close_omero_connection()
+
+    def is_alive(self) -> bool:
+        """Ping the session and record the outcome in last_seen/dead"""
+        with self._mutex:
+            try:
+                alive = bool(self.conn.keepAlive())
+            except Exception as e:
+                logger.warning(f"Keepalive failed for OMERO session with token: {self.omero_token}: {str(e)}")
+                alive = False
+
+        if alive:
+            self.last_seen = time.monotonic()
+        self.dead = not alive
+        return alive
         
+    def reconnect(self):
+        """Rejoin the session on a new client, e.g. after the connection to the router was lost"""
+        with self._mutex:
+            try:
+                self.conn.close(hard=False)
+            except Exception as e:
+                logger.debug(f"Ignoring error while closing lost OMERO connection: {str(e)}")
+            self._connect_to_omero(self.hostname, self.port, self.omero_token)
+            if self.group:
+                self.conn.setGroupNameForSession(self.group)
+            self.dead = False
+            self.closed = False
+
     def get_omero_connection(self):
         return self.conn
     
@@ -35,9 +72,11 @@ class OmeroConnection:
         if not is_connected:
             logger.warning(f"Failed to connect to OMERO with token: {token}")
             raise ConnectionError("Failed to connect to OMERO")
+        self.last_seen = time.monotonic()
 
     def _close_omero_connection(self,hardClose=False):
         logger.info(f"Closing connection to OMERO with token: {self.omero_token}") if self.omero_token is not None else logger.info("Closing connection to OMERO without token")
+        self.closed = True
         if self.conn:
             self.conn.close(hard=hardClose)
 
@@ -59,6 +98,11 @@ class OmeroConnection:
             user = self.conn.getUser()
         return user.getFullName() if user else "Unknown User"
 
+    def get_group_id(self) -> int:
+        """Id of the group the session currently works in"""
+        with self._mutex:
+            return self.conn.getEventContext().groupId
+
     def get_user_groups(self):
         groups = []
         with self._mutex:
@@ -69,6 +113,7 @@ class OmeroConnection:
     def set_group_name_for_session(self, group):
         with self._mutex:
             self.conn.setGroupNameForSession(group)
+            self.group = group
     
     def get_default_omero_group(self) -> str:
         with self._mutex:
@@ -121,6 +166,12 @@ class OmeroConnection:
                 case _:
                     raise ValueError("Invalid filter type in OmeroConnection._get_object")        
 
+    def projection(self, query: str, params=None) -> list[list]:
+        """Run an HQL projection in the current group and return the rows as plain python values"""
+        with self._mutex:
+            rows = self.conn.getQueryService().projection(query, params, self.conn.SERVICE_OPTS)
+        return [[omero.rtypes.unwrap(v) for v in row] for row in rows]
+
     def create_dataset(self, project_id: int, dataset_name: str):
         with self._mutex:
             dataset = omero.model.DatasetI() # pyright: ignore[reportAttributeAccessIssue]
@@ -160,6 +211,28 @@ class OmeroConnection:
         img.linkAnnotation(file_ann)
         return True
 
+    def create_map_annotation(self, key: str, value: str, ns: Optional[str] = None) -> int:
+        with self._mutex:
+            map_ann = omero.model.MapAnnotationI() # pyright: ignore[reportAttributeAccessIssue]
+            map_ann.setMapValue([omero.model.NamedValue(key, value)]) # pyright: ignore[reportAttributeAccessIssue]
+            if ns is not None:
+                map_ann.setNs(omero.rtypes.rstring(ns))
+            map_ann = self.conn.getUpdateService().saveAndReturnObject(map_ann, self.conn.SERVICE_OPTS)
+            map_ann_id = map_ann.getId().getValue()
+            logger.info(f"Created map annotation {key}: {value} with ID {map_ann_id}")
+
+        return map_ann_id
+
+    def create_comment_annotation(self, comment: str) -> int:
+        with self._mutex:
+            comment_ann = omero.model.CommentAnnotationI() # pyright: ignore[reportAttributeAccessIssue]
+            comment_ann.setTextValue(omero.rtypes.rstring(comment))
+            comment_ann = self.conn.getUpdateService().saveAndReturnObject(comment_ann, self.conn.SERVICE_OPTS)
+            comment_id = comment_ann.getId().getValue()
+            logger.info(f"Created comment annotation with ID {comment_id}")
+
+        return comment_id
+
     def create_tag_annotation(self, tag_value):
         with self._mutex:
             logger.info(f"Creating tag {tag_value}")
@@ -167,6 +240,8 @@ class OmeroConnection:
             tag_ann.setValue(tag_value)
             tag_ann.save()
 
+        return tag_ann
+
     def set_annotation_on_image(self, image, annotation):
         with self._mutex:
             try:
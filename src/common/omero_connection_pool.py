@@ -0,0 +1,197 @@
+import time
+from threading import Condition, Lock
+from typing import Callable, Optional
+from common import conf
+from common import logger
+from common.omero_connection import OmeroConnection
+from common.omero_keepalive import register_keepalive
+
+PoolKey = tuple[str, str, Optional[str]]  # (session token, host, group)
+ConnectionFactory = Callable[[str, str, str], OmeroConnection]
+
+
+class OmeroConnectionPool:
+    """
+    Per-process pool of joined OMERO sessions.
+
+    Idle connections are keyed by (session token, host, group) and handed out to
+    one borrower at a time. Connections idle for longer than the idle timeout or
+    marked dead by the keepalive are closed, the pool never keeps more than max_size
+    idle connections and a connection that has not been seen alive for a while is
+    health checked before reuse. Closing a pooled connection only detaches from the
+    session, it does not kill it.
+
+    Borrowed connections are counted per session token, acquire with max_per_token
+    waits until the token has fewer than that many connections out. Imports use this
+    to run on their own joined sessions without opening an unbounded number of them.
+    """
+
+    def __init__(self,
+                 max_size: int = conf.OMERO_POOL_MAX_SIZE,
+                 idle_timeout: float = conf.OMERO_POOL_IDLE_TIMEOUT_SEC,
+                 health_check_after: float = conf.OMERO_POOL_HEALTH_CHECK_AFTER_SEC,
+                 connection_factory: ConnectionFactory = OmeroConnection):
+        self._max_size = max_size
+        self._idle_timeout = idle_timeout
+        self._health_check_after = health_check_after
+        self._connection_factory = connection_factory
+        self._idle: dict[PoolKey, list[tuple[OmeroConnection, float]]] = {}
+        self._leased: dict[str, int] = {}  # borrowed connections per session token
+        self._borrowed: dict[int, str] = {}  # id() of borrowed connection -> token
+        self._mutex = Lock()
+        self._cond = Condition(self._mutex)
+
+    @staticmethod
+    def _key_for(conn: OmeroConnection) -> PoolKey:
+        return (conn.omero_token, conn.hostname, conn.group)
+
+    def acquire(self, host: str, port: str, token: str, group: Optional[str] = None,
+                max_per_token: Optional[int] = None) -> OmeroConnection:
+        with self._cond:
+            while max_per_token is not None and 0 < max_per_token <= self._leased.get(token, 0):
+                self._cond.wait()
+            self._leased[token] = self._leased.get(token, 0) + 1
+
+        try:
+            conn = self._get_or_connect(host, port, token, group)
+        except BaseException:
+            with self._cond:
+                self._unlease_locked(token)
+            raise
+
+        with self._cond:
+            self._borrowed[id(conn)] = token
+        return conn
+
+    def _get_or_connect(self, host: str, port: str, token: str, group: Optional[str]) -> OmeroConnection:
+        key: PoolKey = (token, host, group)
+        while True:
+            with self._mutex:
+                stale = self._evict_idle_locked(time.monotonic())
+                entry = self._pop_idle_locked(key)
+            self._close_all(stale)
+
+            if entry is None:
+                break
+
+            conn, released_at = entry
+            last_seen = max(released_at, conn.last_seen)
+            if not conn.dead and (time.monotonic() - last_seen < self._health_check_after or conn.is_alive()):
+                logger.debug(f"Reusing pooled OMERO connection for host: {host}, group: {group}")
+                return conn
+
+            logger.info(f"Pooled OMERO connection with token: {token} failed health check, closing it")
+            self._close_all([conn])
+
+        conn = self._connection_factory(host, port, token)
+        if group:
+            conn.set_group_name_for_session(group)
+        register_keepalive(conn)
+        return conn
+
+    def release(self, conn: OmeroConnection):
+        now = time.monotonic()
+        with self._mutex:
+            self._return_locked(conn)
+            self._idle.setdefault(self._key_for(conn), []).append((conn, now))
+            to_close = self._evict_idle_locked(now) + self._trim_locked()
+        self._close_all(to_close)
+
+    def discard(self, conn: OmeroConnection):
+        """Close a borrowed connection instead of returning it to the pool"""
+        with self._mutex:
+            self._return_locked(conn)
+        self._close_all([conn])
+
+    def discard_token(self, token: str):
+        """Drop every idle connection joined to the given session, e.g. on logout"""
+        with self._mutex:
+            keys = [k for k in self._idle if k[0] == token]
+            to_close = [c for k in keys for c, _ in self._idle.pop(k)]
+        self._close_all(to_close)
+
+    def clear(self):
+        with self._mutex:
+            to_close = [c for entries in self._idle.values() for c, _ in entries]
+            self._idle.clear()
+        self._close_all(to_close)
+
+    def idle_count(self) -> int:
+        with self._mutex:
+            return sum(len(entries) for entries in self._idle.values())
+
+    def leased_count(self, token: str) -> int:
+        with self._mutex:
+            return self._leased.get(token, 0)
+
+    def _return_locked(self, conn: OmeroConnection):
+        token = self._borrowed.pop(id(conn), None)
+        if token is not None:
+            self._unlease_locked(token)
+
+    def _unlease_locked(self, token: str):
+        count = self._leased.get(token, 0) - 1
+        if count > 0:
+            self._leased[token] = count
+        else:
+            self._leased.pop(token, None)
+        self._cond.notify_all()
+
+    def _pop_idle_locked(self, key: PoolKey) -> Optional[tuple[OmeroConnection, float]]:
+        entries = self._idle.get(key)
+        if not entries:
+            return None
+        entry = entries.pop()  # most recently released first
+        if not entries:
+            del self._idle[key]
+        return entry
+
+    def _evict_idle_locked(self, now: float) -> list[OmeroConnection]:
+        evicted = []
+        for key in list(self._idle):
+            keep = []
+            for conn, released_at in self._idle[key]:
+                if conn.dead or now - released_at > self._idle_timeout:
+                    evicted.append(conn)
+                else:
+                    keep.append((conn, released_at))
+            if keep:
+                self._idle[key] = keep
+            else:
+                del self._idle[key]
+        return evicted
+
+    def _trim_locked(self) -> list[OmeroConnection]:
+        entries = [(released_at, key, conn) for key, lst in self._idle.items() for conn, released_at in lst]
+        overflow = len(entries) - self._max_size
+        if overflow <= 0:
+            return []
+
+        entries.sort(key=lambda e: e[0])
+        trimmed = []
+        for _, key, conn in entries[:overflow]:
+            self._idle[key] = [e for e in self._idle[key] if e[0] is not conn]
+            if not self._idle[key]:
+                del self._idle[key]
+            trimmed.append(conn)
+        return trimmed
+
+    @staticmethod
+    def _close_all(conns: list[OmeroConnection]):
+        for conn in conns:
+            try:
+                conn.close()
+            except Exception as e:
+                logger.warning(f"Failed to close pooled OMERO connection: {str(e)}")
+
+
+_pool: Optional[OmeroConnectionPool] = None
+_pool_mutex = Lock()
+
+def get_connection_pool() -> OmeroConnectionPool:
+    """Return the pool of this process, created lazily so forked workers get their own"""
+    global _pool
+    with _pool_mutex:
+        if _pool is None:
+            _pool = OmeroConnectionPool()
+        return _pool
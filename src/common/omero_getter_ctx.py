@@ -1,6 +1,11 @@
 import traceback
+import hashlib
+import json
 from datetime import datetime
 from common import omero_connection
+from common.omero_query import OmeroQuery
+from common.caching import TTLCache
+from common.concurrency import SingleFlight
 from common import logger
 from common import conf
 from omero.gateway import DatasetWrapper, MapAnnotationWrapper, CommentAnnotationWrapper, TagAnnotationWrapper
@@ -10,8 +15,23 @@ class OmeroGetterCtx:
     """
     Context manager for getting objects from omero
     """
+    # (user id, group id, namespace, key, value) -> map annotation id, shared by the imports of one user
+    _map_annotation_ids = TTLCache(conf.ANNOTATION_CACHE_TTL_SEC, conf.ANNOTATION_CACHE_MAX_SIZE)
+    # (user id, group id, keys) -> (tag index, etag), per user since private groups show each member only their own tags
+    _tag_indexes = TTLCache(conf.TAG_INDEX_CACHE_TTL_SEC)
+    # (user id, group id, tag text) -> tag id, bounded since only a handful of tags are hot.
+    # Per user, in private and read-only groups other users can not link a tag they did not create
+    _tag_ids = TTLCache(conf.ANNOTATION_CACHE_TTL_SEC, conf.TAG_ID_CACHE_MAX_SIZE)
+    # (user id, group id, project name) -> project id
+    _project_ids = TTLCache(conf.CONTAINER_CACHE_TTL_SEC)
+    # (group id, project id, dataset name) -> dataset id, the project already pins the user
+    _dataset_ids = TTLCache(conf.CONTAINER_CACHE_TTL_SEC)
+    # concurrent imports wait for one in-flight lookup/creation instead of creating duplicates
+    _container_flights = SingleFlight()
+
     def __init__(self, omero_connection : omero_connection.OmeroConnection):
         self.conn = omero_connection
+        self.query = OmeroQuery(omero_connection)
 
     def __enter__(self):
         return self
@@ -34,65 +54,62 @@ class OmeroGetterCtx:
         return dataset.getName()
     
     def get_or_create_dataset(self, project_id, dataset_name) -> int:
-        
-        project = self.conn._get_object("Project", project_id)
-        if not project:
-            raise OmeroObjectNotFoundError(f"Project with ID {project_id} not found")
+        cache_key = (self.conn.get_group_id(), project_id, dataset_name)
+        dataset_id = self._dataset_ids.get(cache_key)
+        if dataset_id is not None:
+            return dataset_id
 
-        data = [d for d in project.listChildren() if d.getName() == dataset_name]
+        def lookup_or_create() -> int:
+            dataset_id = self._dataset_ids.get(cache_key)  # filled by a flight that just finished?
+            if dataset_id is None:
+                dataset_id = self._lookup_or_create_dataset(project_id, dataset_name)
+                self._dataset_ids.set(cache_key, dataset_id)
+            return dataset_id
 
-        if len(data) > 0:
-            dataset_id = data[0].getId()
+        return self._container_flights.do(("dataset",) + cache_key, lookup_or_create)
+
+    def _lookup_or_create_dataset(self, project_id, dataset_name) -> int:
+        dataset_ids = self.query.dataset_ids_by_name(project_id, dataset_name)
+        if len(dataset_ids) > 0:
             logger.debug(f"Dataset '{dataset_name}' already exists in project. Using existing dataset.")
-            return dataset_id
+            return dataset_ids[0]
+
+        if not self.query.project_exists(project_id):
+            raise OmeroObjectNotFoundError(f"Project with ID {project_id} not found")
 
         dataset_id = self.conn.create_dataset(project_id, dataset_name)            
         return dataset_id
 
-    def get_user_project_if_it_exists(self, project_name, user_id):
-        projects = self.conn.get_user_projects(user_id)
-        for p in projects:
-            if p.getName() == project_name:
-                return p
-        
-        return None
+    def get_user_project_if_it_exists(self, project_name, user_id) -> int | None:
+        project_ids = self.query.project_ids_by_name(project_name, user_id)
+        return project_ids[0] if project_ids else None
 
     def get_or_create_project(self, project_name, user_id) -> int:
-        #logger.debug(f"Setting or grabbing the Project {}")
-        # Try to get the project
-        project = self.get_user_project_if_it_exists(project_name, user_id)
-        if project:
-            return project.getId()
-            
-        else:
-            id = self.conn.create_project(project_name)
-            return id
-        
+        cache_key = (user_id, self.conn.get_group_id(), project_name)
+        project_id = self._project_ids.get(cache_key)
+        if project_id is not None:
+            return project_id
 
-    def check_duplicate_file(self, filename: str, datasetId: int):
-        dataset = self.conn.get_dataset(datasetId)
-        if not dataset:
-            logger.warning(f"Dataset with ID {datasetId} not found")
-            return False, None
-        
-        for child in dataset.listChildren():
-            if child.getName().startswith(filename):
-                return True, child.getId()
+        def lookup_or_create() -> int:
+            project_id = self._project_ids.get(cache_key)
+            if project_id is None:
+                project_id = self.get_user_project_if_it_exists(project_name, user_id)
+                if project_id is None:
+                    project_id = self.conn.create_project(project_name)
+                self._project_ids.set(cache_key, project_id)
+            return project_id
+
+        return self._container_flights.do(("project",) + cache_key, lookup_or_create)
 
-        return False, None
+    def get_imported_file_id(self, file_hash: str, size: int, algorithm: str = conf.UPLOAD_CHECKSUM_ALGORITHM) -> int | None:
+        """Id of an already imported file in the current group with the same content, or None"""
+        file_ids = self.query.imported_file_ids_by_hash(file_hash, size, algorithm)
+        return file_ids[0] if file_ids else None
 
     #return the first value of the given key or None
     def get_map_annotation_value(self, imageId, key):
-        value = None
-        image = self.conn.get_image(imageId)
-        map_annotations = [ann for ann in image.listAnnotations() if isinstance(ann, MapAnnotationWrapper)] # pyright: ignore[reportAttributeAccessIssue, reportOptionalMemberAccess]
-        for map_ann in map_annotations:
-            k_list = [x for x in map_ann.getValue() if x[0] == key]
-            if len(k_list):
-                value = k_list[0][1]
-                break
-            
-        return value
+        values = self.query.image_map_values(imageId, key)
+        return values[0] if values else None
 
     def compare_image_acquisition_time(self,imageId, compareDate, fmtStr="%H-%M-%S") -> bool:
         image = self.conn.get_image(imageId)
@@ -112,22 +129,41 @@ class OmeroGetterCtx:
         acq_time = acq_time_obj.strftime(fmtStr)        
         return check_time == acq_time
     
-    def get_tags_by_key(self, key):
+    def get_tag_index(self, keys: list[str]) -> tuple[dict[str, list[str]], str]:
         """
-        Fetch all tag values associated with a specific key.
-        
+        Fetch the values of all tags named "<key> <value>" for the given keys.
+
+        The index is built in one pass over the tags the user can see in the current group
+        and cached per user and group until it expires or new tags are created.
+
         Args:
-            key: The key for which to fetch tag values.
-        
+            keys: The keys to index.
+
         Returns:
-            List of tag values.
+            Tuple of the key -> values index and an etag for it.
         """
-        tags = []
-        for tag in self.conn._get_objects("TagAnnotation"): #grab all tag
-            tags.append(tag.getValue())
-        tags = [x.replace(key,'') for x in tags if x.startswith(key+' ')] #filter it
+        cache_key = (self.conn.get_user_id(), self.conn.get_group_id(), tuple(keys))
+        cached = self._tag_indexes.get(cache_key)
+        if cached is not None:
+            return cached
 
-        return tags
+        index: dict[str, list[str]] = {k: [] for k in keys}
+        prefixes = [(k, k + ' ') for k in keys]
+        for text in self.query.tag_texts():
+            for key, prefix in prefixes:
+                if text.startswith(prefix):
+                    index[key].append(text[len(key):])
+        for values in index.values():
+            values.sort()
+
+        etag = hashlib.sha1(json.dumps(index, sort_keys=True).encode()).hexdigest()
+        self._tag_indexes.set(cache_key, (index, etag))
+        return index, etag
+
+    def invalidate_tag_index(self):
+        group_id = self.conn.get_group_id()
+        # the new tag may be visible to the other members too, drop the index of every user of the group
+        self._tag_indexes.invalidate(lambda k: k[1] == group_id)  # pyright: ignore[reportIndexIssue]
 
 
     def get_tag_annotations(self,tag_value):
@@ -142,9 +178,37 @@ class OmeroGetterCtx:
                 
         return the_tag
 
-    def get_tag_annotation_id(self, tag_value) -> list[int] | None:
-        tag = self.get_tag_annotation(tag_value)
-        return tag.getId() if tag else None
+    def get_tag_annotation_id(self, tag_value) -> int | None:
+        cache_key = self._tag_cache_key(tag_value)
+        tag_id = self._tag_ids.get(cache_key)
+        if tag_id is not None:
+            return tag_id
+
+        tag_ids = self.query.tag_ids_by_text(tag_value, self.conn.get_user_id())  # only the owner can link it
+        if not tag_ids:
+            return None
+        self._tag_ids.set(cache_key, tag_ids[0])
+        return tag_ids[0]
+
+    def get_or_create_tag_annotation_id(self, tag_value) -> int:
+        tag_id = self.get_tag_annotation_id(tag_value)
+        if tag_id is not None:
+            return tag_id
+
+        cache_key = self._tag_cache_key(tag_value)
+
+        def lookup_or_create() -> int:
+            tag_id = self.get_tag_annotation_id(tag_value)  # created by a flight that just finished?
+            if tag_id is None:
+                tag_id = self.conn.create_tag_annotation(tag_value).getId()
+                self._tag_ids.set(cache_key, tag_id)
+                self.invalidate_tag_index()
+            return tag_id
+
+        return self._container_flights.do(("tag",) + cache_key, lookup_or_create)
+
+    def _tag_cache_key(self, tag_value) -> tuple:
+        return (self.conn.get_user_id(), self.conn.get_group_id(), tag_value)
 
     def get_comment_annotations(self):
         return self.conn._get_objects("CommentAnnotation")
@@ -174,23 +238,37 @@ class OmeroGetterCtx:
             #ServerEventManager.send_error_event("N/A",f"Failed to get map annotations: {str(e)}")
         return None
 
-    #TODO: this is intrusive...need fix
-    def get_map_annotation(self, name, value):
-        map_ann = self.get_map_annotations()
-        if map_ann is None:
+    def get_map_annotation_id(self, name, value, ns=None) -> int | None:
+        cache_key = self._map_annotation_cache_key(name, value, ns)
+        ann_id = self._map_annotation_ids.get(cache_key)
+        if ann_id is not None:
+            return ann_id
+
+        # in private and read-only groups only the owner can link the annotation
+        ids = self.query.map_annotation_ids(name, value, self.conn.get_user_id(), ns)
+        if not ids:
             return None
-        
-        res = None
-        for map in map_ann: 
-            if not isinstance(map, MapAnnotationWrapper): # pyright: ignore[reportAttributeAccessIssue]
-                #logger.warning(f"Annotation {map_ann.getId()} is not a MapAnnotationWrapper")
-                continue
-            n, v = map.getValue()[0]
-            if n == name and v == value:
-                res = map
-                break
+        self._map_annotation_ids.set(cache_key, ids[0])
+        return ids[0]
+
+    def get_or_create_map_annotation_id(self, name, value, ns=None) -> int:
+        ann_id = self.get_map_annotation_id(name, value, ns)
+        if ann_id is not None:
+            return ann_id
+
+        cache_key = self._map_annotation_cache_key(name, value, ns)
+
+        def lookup_or_create() -> int:
+            ann_id = self.get_map_annotation_id(name, value, ns)  # created by a flight that just finished?
+            if ann_id is None:
+                ann_id = self.conn.create_map_annotation(name, value, ns)
+                self._map_annotation_ids.set(cache_key, ann_id)
+            return ann_id
+
+        return self._container_flights.do(("map_annotation",) + cache_key, lookup_or_create)
 
-        return res
+    def _map_annotation_cache_key(self, name, value, ns) -> tuple:
+        return (self.conn.get_user_id(), self.conn.get_group_id(), ns, name, value)
 
     def get_image_map_annotations(self, imageId):
         """
@@ -0,0 +1,92 @@
+import time
+import weakref
+from threading import Event, Lock, Thread
+from typing import Optional, TYPE_CHECKING
+from common import conf
+from common import logger
+
+if TYPE_CHECKING:
+    from common.omero_connection import OmeroConnection
+
+
+class OmeroKeepAlive:
+    """
+    Background scheduler that pings every registered OmeroConnection on a fixed interval.
+
+    Each ping records last_seen on the connection or marks it dead, so the pool can
+    drop expired sessions before handing them out and long imports keep their session
+    from timing out while the server is busy. Connections are held weakly and closed
+    connections are dropped, a registration never keeps a connection alive by itself.
+    """
+
+    def __init__(self, interval: float = conf.OMERO_KEEPALIVE_INTERVAL_SEC):
+        self._interval = interval
+        self._conns: "weakref.WeakSet[OmeroConnection]" = weakref.WeakSet()
+        self._mutex = Lock()
+        self._stop = Event()
+        self._thread: Optional[Thread] = None
+
+    def register(self, conn: "OmeroConnection"):
+        with self._mutex:
+            self._conns.add(conn)
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = Thread(target=self._run, name="omero-keepalive", daemon=True)
+                self._thread.start()
+
+    def unregister(self, conn: "OmeroConnection"):
+        with self._mutex:
+            self._conns.discard(conn)
+
+    def stop(self):
+        self._stop.set()
+        with self._mutex:
+            thread = self._thread
+            self._thread = None
+        if thread is not None:
+            thread.join(timeout=self._interval)
+
+    def ping_all(self) -> int:
+        """Run one keepalive round, returns the number of dead sessions found"""
+        with self._mutex:
+            conns = [c for c in self._conns if not c.closed]
+            for c in list(self._conns):
+                if c.closed:
+                    self._conns.discard(c)
+
+        nr_dead = 0
+        for conn in conns:
+            if conn.closed:  # closed while we were pinging the others
+                continue
+            if not conn.is_alive():
+                nr_dead += 1
+                logger.warning(f"OMERO session with token: {conn.omero_token} did not answer keepalive")
+                with self._mutex:
+                    self._conns.discard(conn)
+
+        return nr_dead
+
+    def _run(self):
+        logger.debug(f"OMERO keepalive started with interval {self._interval} s")
+        while not self._stop.wait(self._interval):
+            start = time.monotonic()
+            try:
+                self.ping_all()
+            except Exception as e:
+                logger.error(f"Error in OMERO keepalive round: {str(e)}")
+            logger.debug(f"OMERO keepalive round took {time.monotonic() - start:.3f} s")
+
+
+_keepalive: Optional[OmeroKeepAlive] = None
+_keepalive_mutex = Lock()
+
+def register_keepalive(conn: "OmeroConnection"):
+    """Register a connection with the keepalive of this process, if enabled"""
+    global _keepalive
+    if not conf.OMERO_KEEPALIVE_ENABLED:
+        return
+    with _keepalive_mutex:
+        if _keepalive is None:
+            _keepalive = OmeroKeepAlive()
+        ka = _keepalive
+    ka.register(conn)
@@ -0,0 +1,120 @@
+from typing import Any, Optional
+import omero
+import omero.sys
+from omero.rtypes import rlong, rstring, rbool
+from common.omero_connection import OmeroConnection
+
+
+class OmeroQuery:
+    """
+    Parameterised HQL projections for the lookups done during an import.
+
+    The queries return plain ids, names and values instead of gateway wrappers, so
+    finding a dataset or an annotation costs one round trip regardless of how many
+    objects the group holds. All queries run in the current group of the connection.
+    """
+
+    def __init__(self, omero_connection: OmeroConnection):
+        self.conn = omero_connection
+
+    @staticmethod
+    def _params(**kwargs: Any) -> omero.sys.ParametersI:  # type: ignore
+        params = omero.sys.ParametersI()  # type: ignore
+        for name, value in kwargs.items():
+            match value:
+                case bool():
+                    params.add(name, rbool(value))
+                case int():
+                    params.add(name, rlong(value))
+                case str():
+                    params.add(name, rstring(value))
+                case _:
+                    raise ValueError(f"Unsupported HQL parameter type {type(value)} for {name}")
+        return params
+
+    def projection(self, hql: str, **kwargs: Any) -> list[list]:
+        return self.conn.projection(hql, self._params(**kwargs))
+
+    def project_ids_by_name(self, project_name: str, owner_id: int) -> list[int]:
+        rows = self.projection(
+            "select p.id from Project p "
+            "where p.name = :name and p.details.owner.id = :owner "
+            "order by p.id",
+            name=project_name, owner=owner_id)
+        return [r[0] for r in rows]
+
+    def project_exists(self, project_id: int) -> bool:
+        rows = self.projection("select p.id from Project p where p.id = :pid", pid=project_id)
+        return len(rows) > 0
+
+    def dataset_ids_by_name(self, project_id: int, dataset_name: str) -> list[int]:
+        rows = self.projection(
+            "select l.child.id from ProjectDatasetLink l "
+            "where l.parent.id = :pid and l.child.name = :name "
+            "order by l.child.id",
+            pid=project_id, name=dataset_name)
+        return [r[0] for r in rows]
+
+    def dataset_images(self, dataset_id: int) -> list[tuple[int, str, Optional[int]]]:
+        """(id, name, acquisition date in ms since epoch or None) of every image in the dataset"""
+        rows = self.projection(
+            "select i.id, i.name, i.acquisitionDate from DatasetImageLink l join l.child i "
+            "where l.parent.id = :did "
+            "order by i.id",
+            did=dataset_id)
+        return [(r[0], r[1], r[2]) for r in rows]
+
+    def dataset_image_map_values(self, dataset_id: int, key: str) -> list[tuple[int, str]]:
+        """(image id, value) for every value stored under key on the images of the dataset"""
+        rows = self.projection(
+            "select l.parent.id, mv.value from MapAnnotation a join a.mapValue mv, "
+            "ImageAnnotationLink l, DatasetImageLink dl "
+            "where l.child.id = a.id and dl.child.id = l.parent.id and dl.parent.id = :did and mv.name = :key "
+            "order by a.id",
+            did=dataset_id, key=key)
+        return [(r[0], r[1]) for r in rows]
+
+    def map_annotation_ids(self, key: str, value: str, owner_id: int, ns: Optional[str] = None) -> list[int]:
+        """Ids of the map annotations of the owner whose first pair is (key, value)"""
+        ns_clause = "a.ns = :ns" if ns is not None else "a.ns is null"
+        kwargs: dict[str, Any] = {"key": key, "value": value, "owner": owner_id}
+        if ns is not None:
+            kwargs["ns"] = ns
+        rows = self.projection(
+            "select a.id from MapAnnotation a join a.mapValue mv "
+            f"where index(mv) = 0 and mv.name = :key and mv.value = :value and {ns_clause} "
+            "and a.details.owner.id = :owner "
+            "order by a.id",
+            **kwargs)
+        return [r[0] for r in rows]
+
+    def image_map_values(self, image_id: int, key: str) -> list[str]:
+        """Values stored under key in the map annotations linked to the image"""
+        rows = self.projection(
+            "select mv.value from MapAnnotation a join a.mapValue mv, ImageAnnotationLink l "
+            "where l.child.id = a.id and l.parent.id = :iid and mv.name = :key "
+            "order by a.id",
+            iid=image_id, key=key)
+        return [r[0] for r in rows]
+
+    def imported_file_ids_by_hash(self, file_hash: str, size: int, hasher: str) -> list[int]:
+        """Ids of the original files of imported filesets with the given checksum and size"""
+        rows = self.projection(
+            "select f.id from FilesetEntry fe join fe.originalFile f join f.hasher h "
+            "where f.hash = :hash and f.size = :size and h.value = :hasher "
+            "order by f.id",
+            hash=file_hash, size=size, hasher=hasher)
+        return [r[0] for r in rows]
+
+    def tag_ids_by_text(self, text: str, owner_id: int) -> list[int]:
+        rows = self.projection(
+            "select a.id from TagAnnotation a "
+            "where a.textValue = :text and a.details.owner.id = :owner "
+            "order by a.id",
+            text=text, owner=owner_id)
+        return [r[0] for r in rows]
+
+    def tag_texts(self) -> list[str]:
+        """Text of every distinct tag the user can see in the group"""
+        rows = self.projection("select distinct a.textValue from TagAnnotation a where a.textValue is not null")
+        return [r[0] for r in rows]
@@ -3,6 +3,7 @@ import mistune
 import os
 import json
 import datetime
+import time
 from flask import Flask, render_template, request, redirect, url_for, session, jsonify,g, send_from_directory
 from flask_cors import CORS
 from werkzeug import Request
@@ -11,9 +12,13 @@ from common import conf
 from common import logger
 from omerofrontend.middle_ware import MiddleWare
 from common import omero_connection
+from common.omero_connection_pool import get_connection_pool
 from omerofrontend.connection_blueprint import conn_bp, connect_to_omero
 from omerofrontend.sse_blueprint import sse_bp
 from omerofrontend.server_event_manager import ServerEventManager
+from omerofrontend.staging_request import StagingRequest
+from omerofrontend.chunked_upload import ChunkedUploadStore
+from omerofrontend.exceptions import ImageNotSupported, OutOfDiskError, UploadSessionError
 
 #processed_files = {} # In-memory storage for processed files (for the session)
 
@@ -21,6 +26,7 @@ def create_app(test_config=None):
     
     Request.max_form_parts = 5000
     app = Flask(conf.APP_NAME)
+    app.request_class = StagingRequest
     app.secret_key = conf.SECRET_KEY
     CORS(app)
 
@@ -45,6 +51,7 @@ def create_app(test_config=None):
     ServerEventManager.assert_redis_up()
     db.initialize_database()
     middle_ware = MiddleWare(db)
+    chunked_uploads = ChunkedUploadStore()
 
     def my_render_template(*args, **kwargs):
         
@@ -94,6 +101,7 @@ def create_app(test_config=None):
                 session[conf.OMERO_SESSION_TOKEN_KEY] = session_token
                 session[conf.OMERO_SESSION_HOST_KEY] = conf.OMERO_HOST
                 session[conf.OMERO_SESSION_PORT_KEY] = conf.OMERO_PORT
+                session.pop(conf.OMERO_SESSION_GROUP_KEY, None)
 
                 return redirect(url_for('upload'))
     
@@ -117,6 +125,94 @@ def create_app(test_config=None):
             "status": 500
             }), 500
 
+    def batch_tag_from_pairs(key_value_pairs) -> dict:
+        # Assuming you want to handle key-value pairs (this is a placeholder logic)
+        batch_tag = {}
+        for pair in key_value_pairs:
+            key = pair.get("key")
+            value = pair.get("value", "None")  # Default to "None" if no value is provided
+            logger.debug(f"adding key-value {key} {value}")
+            batch_tag[key] = value.strip()
+        return batch_tag
+
+    def chunked_upload_error(e: Exception):
+        if isinstance(e, UploadSessionError):
+            if e.status == 429:
+                return jsonify({"error": str(e)}), 429, {"Retry-After": str(conf.CHUNKED_UPLOAD_RETRY_AFTER_SEC)}
+            return jsonify({"error": str(e)}), e.status
+        if isinstance(e, ImageNotSupported):
+            return jsonify({"error": str(e)}), 415
+        logger.error(f"Out of disk error in chunked upload: {str(e)}")
+        return jsonify({"status": "Out of disk error while storing temp file"}), 507
+
+    # Resumable upload protocol: create a session, PUT numbered chunks, GET what is missing, finalize to import
+    @conn_bp.route('/uploads', methods=['POST'])
+    def create_upload():
+        if not hasLoggedIn(session):
+            return jsonify({"error": "Not logged in"}), 401
+        data = request.get_json(silent=True) or {}
+        key_value_pairs = data.get('keyValuePairs')
+        if key_value_pairs is None:
+            return jsonify({"error": "No keyValuePairs found in the request"}), 400
+
+        conn = getattr(g,conf.OMERO_G_CONNECTION_KEY)
+        username = conn.get_logged_in_user_full_name()
+        try:
+            created = chunked_uploads.create(data.get('files') or [], username, session.get(conf.OMERO_SESSION_TOKEN_KEY), key_value_pairs)
+        except (UploadSessionError, ImageNotSupported, OutOfDiskError) as e:
+            return chunked_upload_error(e)
+        return jsonify(created), 201
+
+    @app.route('/uploads/<upload_id>/files/<int:file_index>/chunks/<int:chunk_index>', methods=['PUT'])
+    def put_upload_chunk(upload_id, file_index, chunk_index):
+        # no OMERO round trip per chunk, the session token is checked against the upload
+        if not hasLoggedIn(session):
+            return jsonify({"error": "Not logged in"}), 401
+        try:
+            received = chunked_uploads.write_chunk(upload_id, session.get(conf.OMERO_SESSION_TOKEN_KEY), file_index, chunk_index,
+                                                   request.stream, request.content_length)
+        except (UploadSessionError, OutOfDiskError) as e:
+            return chunked_upload_error(e)
+        return jsonify({"received": received}), 200
+
+    @app.route('/uploads/<upload_id>', methods=['GET'])
+    def get_upload_status(upload_id):
+        if not hasLoggedIn(session):
+            return jsonify({"error": "Not logged in"}), 401
+        try:
+            return jsonify(chunked_uploads.status(upload_id, session.get(conf.OMERO_SESSION_TOKEN_KEY))), 200
+        except UploadSessionError as e:
+            return chunked_upload_error(e)
+
+    @app.route('/uploads/<upload_id>', methods=['DELETE'])
+    def abort_upload(upload_id):
+        if not hasLoggedIn(session):
+            return jsonify({"error": "Not logged in"}), 401
+        try:
+            chunked_uploads.abort(upload_id, session.get(conf.OMERO_SESSION_TOKEN_KEY))
+        except UploadSessionError as e:
+            return chunked_upload_error(e)
+        return jsonify({"status": "ok"}), 200
+
+    @conn_bp.route('/uploads/<upload_id>/finalize', methods=['POST'])
+    def finalize_upload(upload_id):
+        if not hasLoggedIn(session):
+            return jsonify({"error": "Not logged in"}), 401
+        token = session.get(conf.OMERO_SESSION_TOKEN_KEY)
+        try:
+            fileData, key_value_pairs, created = chunked_uploads.finalize(upload_id, token)
+        except (UploadSessionError, OutOfDiskError) as e:
+            return chunked_upload_error(e)
+
+        conn = getattr(g,conf.OMERO_G_CONNECTION_KEY)
+        groupname = conn.get_default_omero_group()
+        username = conn.get_logged_in_user_full_name()
+        res, status = middle_ware.import_staged_files(fileData, batch_tag_from_pairs(key_value_pairs), username, groupname, token,
+                                                      time.time() - created)
+        if res:
+            return jsonify({"status":"ok"}), 202
+        return jsonify({"status":status}), 500
+
     @conn_bp.route('/import_images', methods=['POST'])
     def import_images():
 
@@ -125,6 +221,9 @@ def create_app(test_config=None):
             return jsonify({"error": "Not logged in"}), 401
                 
         conn = getattr(g,conf.OMERO_G_CONNECTION_KEY)
+        username = conn.get_logged_in_user_full_name()
+        # must be set before the form is parsed, the file parts are then streamed to staging
+        request.staging_username = username # type: ignore #ignore: pyright[reportAttributeAccessIssue]
 
         logger.debug(f"Files: {len(request.files)}, Fields: {len(request.form)}")
         # Retrieve the key-value pairs from the form data
@@ -136,20 +235,12 @@ def create_app(test_config=None):
             return jsonify({"error": "No keyValuePairs found in the request"}), 400
 
         logger.debug(f"Received key-value pairs: {key_value_pairs}")
-
-        # Assuming you want to handle key-value pairs (this is a placeholder logic)
-        batch_tag = {}
-        for pair in key_value_pairs:
-            key = pair.get("key")
-            value = pair.get("value", "None")  # Default to "None" if no value is provided
-            logger.debug(f"adding key-value {key} {value}")
-            batch_tag[key] = value.strip()
+        batch_tag = batch_tag_from_pairs(key_value_pairs)
 
         logger.debug("receiving files")
         files = request.files.getlist('files')
         token = session.get(conf.OMERO_SESSION_TOKEN_KEY)
         groupname = conn.get_default_omero_group()
-        username = conn.get_logged_in_user_full_name()
         res, status = middle_ware.import_files(files,batch_tag,username,groupname,token)
 
         if res:
@@ -214,7 +305,9 @@ def create_app(test_config=None):
         conn: omero_connection.OmeroConnection = getattr(g,conf.OMERO_G_CONNECTION_KEY)
         username = conn.get_logged_in_user_full_name()
         middle_ware.remove_user_upload_dir(username)
+        get_connection_pool().discard_token(conn.omero_token)
         conn.kill_session()
+        setattr(g, conf.OMERO_G_CONNECTION_KEY, None)
         return my_render_template("logged_out.html")
    
     @app.route('/build_info', methods=['GET'])
@@ -0,0 +1,64 @@
+from threading import Lock
+from typing import Optional
+import omero
+import omero.model
+from common import logger
+from common.omero_connection import OmeroConnection
+from common.dataset_image_index import DatasetImageIndex
+from common.omero_getter_ctx import OmeroGetterCtx
+
+COMMENT_KEY = "Comment"
+
+
+class BatchContext:
+    """
+    State shared by all files of one upload batch, i.e. one session, group and set of keyValuePairs.
+
+    The batch level annotations (a map annotation and a "<key> <value>" tag per pair, a comment
+    for the Comment pair) are resolved or created once, by the first import of the batch, and
+    every later file links the same annotations by id. Likewise the name index of each target
+    dataset is loaded once and reused for the duplicate check of every file in the batch.
+    """
+
+    def __init__(self, tags: dict[str, str]):
+        self.tags: dict[str, str] = dict(tags)
+        self._mutex = Lock()
+        self._annotation_refs: Optional[list[tuple[str, int]]] = None  # (model class name, id)
+        self._index_mutex = Lock()
+        self._dataset_indexes: dict[int, DatasetImageIndex] = {}
+
+    def get_annotations(self, conn: OmeroConnection) -> list:
+        """Unloaded references to the batch annotations, for ImportSettings.userSpecifiedAnnotationList"""
+        with self._mutex:
+            if self._annotation_refs is None:
+                self._annotation_refs = self._resolve_annotations(conn)
+            refs = list(self._annotation_refs)
+
+        return [getattr(omero.model, cls)(ann_id, False) for cls, ann_id in refs]
+
+    def get_dataset_index(self, conn: OmeroConnection, dataset_id: int) -> DatasetImageIndex:
+        with self._index_mutex:
+            index = self._dataset_indexes.get(dataset_id)
+            if index is None:
+                index = DatasetImageIndex.load(conn, dataset_id)
+                self._dataset_indexes[dataset_id] = index
+            return index
+
+    def is_batch_pair(self, key: str, value) -> bool:
+        return key in self.tags and self.tags[key] == value
+
+    def _resolve_annotations(self, conn: OmeroConnection) -> list[tuple[str, int]]:
+        refs: list[tuple[str, int]] = []
+        with OmeroGetterCtx(conn) as ogc:
+            for k, v in self.tags.items():
+                v = str(v)
+                if k == COMMENT_KEY:
+                    refs.append(("CommentAnnotationI", conn.create_comment_annotation(v)))
+                else:
+                    refs.append(("MapAnnotationI", ogc.get_or_create_map_annotation_id(k, v)))
+
+            for k, v in self.tags.items():
+                refs.append(("TagAnnotationI", ogc.get_or_create_tag_annotation_id(f"{k} {v}")))
+
+        logger.debug(f"Resolved {len(refs)} batch annotations for {self.tags}")
+        return refs
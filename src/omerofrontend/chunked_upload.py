@@ -0,0 +1,332 @@
+import fcntl
+import json
+import os
+import time
+import uuid
+from threading import BoundedSemaphore, Lock
+from contextlib import contextmanager
+from typing import Any, BinaryIO, Iterator, Optional
+from common import conf
+from common import image_funcs
+from common import logger
+from common.buffer_pool import get_buffer_pool, readinto
+from common.file_data import FileData
+from omerofrontend.exceptions import ImageNotSupported, OutOfDiskError, UploadSessionError
+from omerofrontend.temp_file_handler import TempFileHandler
+
+
+class ChunkedUploadStore:
+    """
+    Server side of the resumable browser upload protocol.
+
+    An upload session stages the files of one import. Create it with the file names and
+    sizes, PUT the numbered chunks of each file in any order and as often as needed, ask
+    which chunks are missing after an interruption, and finalize it to get the FileData
+    of the staged files. Every file is preallocated under a part name at session creation
+    and chunks are written with positional writes, so chunks may arrive out of order and
+    in parallel.
+
+    The session state is a JSON manifest on disk, updated under a file lock, so any
+    worker process can serve any request of a session. Sessions are bound to the OMERO
+    session token that created them. Files above max_file_size and sessions that would
+    reserve more than max_user_bytes for one user are refused, and sessions without a
+    chunk written for ttl seconds are removed with their part files.
+
+    At most max_concurrent_writes chunks are written at once, further chunk requests are
+    refused with status 429 so the clients narrow their transfer window.
+    """
+
+    def __init__(self,
+                 chunk_size: int = conf.CHUNKED_UPLOAD_CHUNK_SIZE,
+                 ttl: float = conf.CHUNKED_UPLOAD_TTL_SEC,
+                 temp_file_handler: Optional[TempFileHandler] = None,
+                 max_concurrent_writes: int = conf.CHUNKED_UPLOAD_MAX_CONCURRENT_WRITES,
+                 max_file_size: int = conf.CHUNKED_UPLOAD_MAX_FILE_SIZE,
+                 max_user_bytes: int = conf.CHUNKED_UPLOAD_MAX_USER_BYTES,
+                 purge_interval: float = conf.CHUNKED_UPLOAD_PURGE_INTERVAL_SEC):
+        self._chunk_size = chunk_size
+        self._ttl = ttl
+        self._max_file_size = max_file_size
+        self._max_user_bytes = max_user_bytes
+        self._purge_interval = purge_interval
+        self._next_purge = 0.0
+        self._purge_mutex = Lock()
+        self._write_slots = BoundedSemaphore(max_concurrent_writes)
+        self._tfh = temp_file_handler if temp_file_handler is not None else TempFileHandler()
+
+    @staticmethod
+    def _sessions_dir() -> str:
+        return os.path.join(conf.UPLOAD_FOLDER, ".chunked")
+
+    def _manifest_path(self, upload_id: str) -> str:
+        if not upload_id or not all(c in "0123456789abcdef" for c in upload_id):
+            raise UploadSessionError(message="Unknown upload", status=404)
+        return os.path.join(self._sessions_dir(), f"{upload_id}.json")
+
+    def create(self, files: list[dict[str, Any]], username: str, token: str, key_value_pairs: Any) -> dict[str, Any]:
+        """Start a session for files ([{name, size}]), returns its id and chunk size"""
+        if not files:
+            raise UploadSessionError(message="No files in upload")
+        for f in files:
+            name = f.get("name")
+            size = f.get("size")
+            if not isinstance(name, str) or not name:
+                raise UploadSessionError(message=f"Got file without filename! {f}")
+            if not isinstance(size, int) or size < 0:
+                raise UploadSessionError(name, "Invalid file size")
+            if size > self._max_file_size:
+                raise UploadSessionError(name, f"File is larger than the {self._max_file_size} bytes allowed", status=413)
+            if not image_funcs.is_supported_format(name):
+                raise ImageNotSupported(name)
+
+        self.purge_expired()
+        os.makedirs(self._sessions_dir(), exist_ok=True)
+        upload_id = uuid.uuid4().hex
+        with self._flock(os.path.join(self._sessions_dir(), ".quota.lock")):  # no two sessions pass the quota together
+            reserved = self._reserved_bytes(username)
+            if reserved + sum(f["size"] for f in files) > self._max_user_bytes:
+                raise UploadSessionError(files[0]["name"], f"Open uploads already reserve {reserved} bytes, "
+                                         "finish or cancel them first", status=507)
+            entries = self._reserve(upload_id, files, username, token, key_value_pairs)
+        logger.info(f"Created chunked upload {upload_id} for {[e['name'] for e in entries]}")
+        return {"upload_id": upload_id, "chunk_size": self._chunk_size}
+
+    def _reserve(self, upload_id: str, files: list[dict[str, Any]], username: str, token: str,
+                 key_value_pairs: Any) -> list[dict[str, Any]]:
+        """Preallocate the part files and write the manifest of a new session"""
+        entries: list[dict[str, Any]] = []
+        try:
+            for f in files:
+                final_path, part_path = self._tfh.preallocate_part_file(f["name"], username, upload_id, f["size"])
+                entries.append({
+                    "name": f["name"],
+                    "size": f["size"],
+                    "path": final_path,
+                    "part_path": part_path,
+                    "chunks": self._chunk_count(f["size"]),
+                    "received": [],
+                })
+        except OutOfDiskError:
+            for e in entries:
+                self._tfh.remove_staged_file(e["part_path"], username)
+            raise
+
+        now = time.time()
+        manifest = {
+            "upload_id": upload_id,
+            "token": token,
+            "username": username,
+            "created": now,
+            "updated": now,
+            "chunk_size": self._chunk_size,
+            "key_value_pairs": key_value_pairs,
+            "files": entries,
+        }
+        with self._locked(upload_id):
+            self._write_manifest(upload_id, manifest)
+        return entries
+
+    def _reserved_bytes(self, username: str) -> int:
+        """Bytes preallocated for the open sessions of username"""
+        reserved = 0
+        for manifest in self._manifests():
+            if manifest.get("username") == username:
+                reserved += sum(e.get("size", 0) for e in manifest.get("files", []))
+        return reserved
+
+    def write_chunk(self, upload_id: str, token: str, file_index: int, chunk_index: int,
+                    stream: BinaryIO, content_length: Optional[int]) -> int:
+        """Write one chunk read from stream, returns the number of chunks received for the file"""
+        self._purge_if_due()
+        manifest = self._read_manifest(upload_id, token)
+        entry = self._file_entry(manifest, file_index)
+        chunk_size = manifest["chunk_size"]
+        if not 0 <= chunk_index < entry["chunks"]:
+            raise UploadSessionError(entry["name"], f"Invalid chunk index {chunk_index}")
+        offset = chunk_index * chunk_size
+        expected = min(chunk_size, entry["size"] - offset)
+        if content_length is not None and content_length != expected:
+            raise UploadSessionError(entry["name"], f"Chunk {chunk_index} must be {expected} bytes, got {content_length}")
+
+        if not self._write_slots.acquire(blocking=False):
+            raise UploadSessionError(entry["name"], "Too many chunk uploads, retry later", status=429)
+        try:
+            written = self._write_at(entry, offset, expected, chunk_size, stream)
+        finally:
+            self._write_slots.release()
+        if written != expected:
+            raise UploadSessionError(entry["name"], f"Chunk {chunk_index} incomplete, got {written} of {expected} bytes")
+
+        with self._locked(upload_id):
+            manifest = self._read_manifest(upload_id, token)
+            entry = self._file_entry(manifest, file_index)
+            received = set(entry["received"])
+            received.add(chunk_index)
+            entry["received"] = sorted(received)
+            manifest["updated"] = time.time()
+            self._write_manifest(upload_id, manifest)
+        return len(received)
+
+    def status(self, upload_id: str, token: str) -> dict[str, Any]:
+        """Chunks still missing per file, what a resuming client has to send"""
+        self._purge_if_due()
+        manifest = self._read_manifest(upload_id, token)
+        return {
+            "upload_id": upload_id,
+            "chunk_size": manifest["chunk_size"],
+            "files": [{"name": e["name"], "size": e["size"], "chunks": e["chunks"], "missing": self._missing(e)}
+                      for e in manifest["files"]],
+        }
+
+    def finalize(self, upload_id: str, token: str) -> tuple[FileData, Any, float]:
+        """Move the complete files into place, returns their FileData, the key value pairs and the session start"""
+        with self._locked(upload_id):
+            manifest = self._read_manifest(upload_id, token)
+            incomplete = [e["name"] for e in manifest["files"] if self._missing(e)]
+            if incomplete:
+                raise UploadSessionError(incomplete[0], f"Missing chunks in {incomplete}", status=409)
+            username = manifest["username"]
+            for e in manifest["files"]:
+                self._tfh.commit_part_file(e["name"], e["part_path"], e["path"])
+            os.remove(self._manifest_path(upload_id))
+
+        entries = manifest["files"]
+        fileData = self._tfh.create_file_data([e["name"] for e in entries], [e["path"] for e in entries],
+                                              [e["size"] for e in entries], username)
+        logger.info(f"Finalized chunked upload {upload_id}")
+        return fileData, manifest["key_value_pairs"], manifest["created"]
+
+    def abort(self, upload_id: str, token: str):
+        with self._locked(upload_id):
+            manifest = self._read_manifest(upload_id, token)
+            self._discard(upload_id, manifest)
+
+    def purge_expired(self):
+        """Remove sessions without a chunk written for longer than the ttl together with their part files"""
+        self._next_purge = time.monotonic() + self._purge_interval
+        now = time.time()
+        for manifest in self._manifests():
+            upload_id = manifest.get("upload_id", "")
+            if now - manifest.get("updated", manifest.get("created", 0)) <= self._ttl:
+                continue
+            try:
+                with self._locked(upload_id):
+                    with open(self._manifest_path(upload_id)) as f:
+                        manifest = json.load(f)  # a chunk may have arrived meanwhile
+                    if now - manifest.get("updated", manifest.get("created", 0)) > self._ttl:
+                        logger.info(f"Removing expired chunked upload {upload_id}")
+                        self._discard(upload_id, manifest)
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError, UploadSessionError) as e:
+                logger.warning(f"Unable to check chunked upload {upload_id}: {str(e)}")
+
+    def _purge_if_due(self):
+        """Purge every purge_interval seconds, also while no new sessions are created"""
+        if time.monotonic() < self._next_purge or not self._purge_mutex.acquire(blocking=False):
+            return
+        try:
+            self.purge_expired()
+        finally:
+            self._purge_mutex.release()
+
+    def _manifests(self) -> Iterator[dict[str, Any]]:
+        sessions_dir = self._sessions_dir()
+        if not os.path.isdir(sessions_dir):
+            return
+        for name in os.listdir(sessions_dir):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(sessions_dir, name)) as f:
+                    yield json.load(f)
+            except FileNotFoundError:
+                pass  # finalized or removed meanwhile
+            except (OSError, ValueError) as e:
+                logger.warning(f"Unable to read chunked upload manifest {name}: {str(e)}")
+
+    @staticmethod
+    def _write_at(entry: dict[str, Any], offset: int, expected: int, chunk_size: int, stream: BinaryIO) -> int:
+        try:
+            fd = os.open(entry["part_path"], os.O_WRONLY)
+        except FileNotFoundError:
+            raise UploadSessionError(entry["name"], "Upload no longer exists", status=404)
+        try:
+            written = 0
+            with get_buffer_pool().borrow(min(chunk_size, conf.CHUNK_SIZE)) as buf:
+                view = memoryview(buf)
+                while written < expected:
+                    n = readinto(stream, view[:min(len(view), expected - written)])
+                    if not n:
+                        break
+                    os.pwrite(fd, view[:n], offset + written)
+                    written += n
+        except OSError as e:
+            raise OutOfDiskError(entry["name"], entry["part_path"], f"Out Of Disk on temp storage! {str(e)}")
+        finally:
+            os.close(fd)
+        return written
+
+    def _chunk_count(self, size: int) -> int:
+        return max(1, -(-size // self._chunk_size))  # an empty file is one empty chunk
+
+    @staticmethod
+    def _missing(entry: dict[str, Any]) -> list[int]:
+        received = set(entry["received"])
+        return [i for i in range(entry["chunks"]) if i not in received]
+
+    @staticmethod
+    def _file_entry(manifest: dict[str, Any], file_index: int) -> dict[str, Any]:
+        files = manifest["files"]
+        if not 0 <= file_index < len(files):
+            raise UploadSessionError(message=f"Invalid file index {file_index}", status=404)
+        return files[file_index]
+
+    def _read_manifest(self, upload_id: str, token: str) -> dict[str, Any]:
+        try:
+            with open(self._manifest_path(upload_id)) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            raise UploadSessionError(message="Unknown upload", status=404)
+        if manifest.get("token") != token:
+            raise UploadSessionError(message="Upload belongs to another session", status=403)
+        return manifest
+
+    def _write_manifest(self, upload_id: str, manifest: dict[str, Any]):
+        path = self._manifest_path(upload_id)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp, path)
+
+    def _discard(self, upload_id: str, manifest: dict[str, Any]):
+        for e in manifest.get("files", []):
+            if e.get("part_path"):
+                self._tfh.remove_staged_file(e["part_path"], manifest.get("username", ""))
+        self._remove(self._manifest_path(upload_id))
+
+    @staticmethod
+    def _remove(path: Optional[str]):
+        try:
+            if path:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _locked(self, upload_id: str):
+        """Exclusive across threads and worker processes for one session"""
+        return self._flock(self._manifest_path(upload_id)[:-len(".json")] + ".lock", remove_with=self._manifest_path(upload_id))
+
+    @contextmanager
+    def _flock(self, lock_path: str, remove_with: Optional[str] = None) -> Iterator[None]:
+        """Exclusive lock on lock_path, the lock file is removed afterwards if remove_with no longer exists"""
+        os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+        fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+            if remove_with is not None and not os.path.exists(remove_with):
+                self._remove(lock_path)  # the session is gone
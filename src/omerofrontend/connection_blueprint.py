@@ -1,6 +1,7 @@
 import traceback
 from flask import request, session, jsonify, Blueprint,g
 from common.omero_connection import OmeroConnection
+from common.omero_connection_pool import get_connection_pool
 from common import conf
 from common import logger
 from common.omero_getter_ctx import OmeroGetterCtx
@@ -13,6 +14,7 @@ def connect_to_omero():
     token = session.get(conf.OMERO_SESSION_TOKEN_KEY)
     host = session.get(conf.OMERO_SESSION_HOST_KEY)
     port = session.get(conf.OMERO_SESSION_PORT_KEY)
+    group = session.get(conf.OMERO_SESSION_GROUP_KEY)
 
     if not token or not host or not port:
         errStr = "No OMERO session token, host or port found in session. Please log in again."
@@ -20,7 +22,7 @@ def connect_to_omero():
         raise ConnectionError(errStr)
 
     if not hasattr(g,conf.OMERO_G_CONNECTION_KEY) or getattr(g,conf.OMERO_G_CONNECTION_KEY) is None:
-        connection = OmeroConnection(host,port,token)
+        connection = get_connection_pool().acquire(host,port,token,group)
         setattr(g,conf.OMERO_G_CONNECTION_KEY,connection)
             
 
@@ -29,7 +31,7 @@ def dissconnect_from_omero(response):
     
     if hasattr(g,conf.OMERO_G_CONNECTION_KEY) and getattr(g,conf.OMERO_G_CONNECTION_KEY) is not None:
         conn = getattr(g,conf.OMERO_G_CONNECTION_KEY)
-        del conn
+        get_connection_pool().release(conn)
         setattr(g, conf.OMERO_G_CONNECTION_KEY, None)
 
     return response
@@ -76,16 +78,15 @@ def get_existing_tags():
     logger.info("Fetching tags from OMERO.")
     try:
         conn: OmeroConnection = getattr(g, conf.OMERO_G_CONNECTION_KEY)
-        keys_and_values = {}
         
         # Fetch all keys from the OMERO server
-        all_keys = conf.USER_VARIABLES
-        for key in all_keys:
-            with OmeroGetterCtx(conn) as ogc:
-                values = ogc.get_tags_by_key(key)
-                keys_and_values[key] = values
+        with OmeroGetterCtx(conn) as ogc:
+            keys_and_values, etag = ogc.get_tag_index(conf.USER_VARIABLES)
         
-        return jsonify(keys_and_values)
+        response = jsonify(keys_and_values)
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "private, no-cache"  # browsers revalidate with If-None-Match
+        return response.make_conditional(request)
     except Exception as e:
         logger.error(f"Error fetching keys and tags: {str(e)}")
         return jsonify({"error": str(e)}), 500
@@ -127,6 +128,7 @@ def set_group():
         conn: OmeroConnection = getattr(g, conf.OMERO_G_CONNECTION_KEY)
         try:
             conn.set_group_name_for_session(group)
+            session[conf.OMERO_SESSION_GROUP_KEY] = group
         except Exception as e:
             logger.error("Error setting group in OMERO!")
             return jsonify({"error": str(e)}), 500  # Return error message
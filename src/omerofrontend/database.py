@@ -2,8 +2,10 @@ import os
 from threading import Lock
 import psycopg
 import sqlite3
+from typing import Optional
 from common import logger
 from common import conf
+from common.import_timings import PhaseTiming
 
 _db_mutex = Lock()
 
@@ -22,11 +24,15 @@ class DatabaseHandler:
     def initialize_database(self):
         pass
         
-    def insert_import_data(self, time, username, groupname, scope, file_count, total_file_size_mb, import_time_s):
+    def insert_import_data(self, time, username, groupname, scope, file_count, total_file_size_mb, import_time_s,
+                           phases: Optional[dict[str, PhaseTiming]] = None):
         pass
         
     def get_all_imports(self):
         pass
+
+    def get_import_phases(self, import_id):
+        pass
     
 class SqliteDatabaseHandler(DatabaseHandler):
 
@@ -53,11 +59,21 @@ class SqliteDatabaseHandler(DatabaseHandler):
                     import_time_s REAL NOT NULL
                 )
             ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS import_phases (
+                    import_id INTEGER NOT NULL REFERENCES imports(id),
+                    phase TEXT NOT NULL,
+                    seconds REAL NOT NULL,
+                    bytes INTEGER NOT NULL,
+                    PRIMARY KEY (import_id, phase)
+                )
+            ''')
             conn.commit()
             conn.close()
 
         
-    def insert_import_data(self, time, username, groupname, scope, file_count, total_file_size_mb, import_time_s):
+    def insert_import_data(self, time, username, groupname, scope, file_count, total_file_size_mb, import_time_s,
+                           phases: Optional[dict[str, PhaseTiming]] = None):
         with _db_mutex:
             conn = sqlite3.connect(self.SQL_DB_FILE)
             cursor = conn.cursor()
@@ -65,6 +81,12 @@ class SqliteDatabaseHandler(DatabaseHandler):
                 INSERT INTO imports (time, username, groupname, scope, file_count, total_file_size_mb, import_time_s)
                 VALUES (?, ?, ?, ?, ?, ?, ?)
             ''', (time, username, groupname, scope, file_count, total_file_size_mb, import_time_s))
+            if phases:
+                import_id = cursor.lastrowid
+                cursor.executemany('''
+                    INSERT INTO import_phases (import_id, phase, seconds, bytes)
+                    VALUES (?, ?, ?, ?)
+                ''', [(import_id, name, t.seconds, t.bytes) for name, t in phases.items()])
             conn.commit()
             conn.close()
         
@@ -77,6 +99,15 @@ class SqliteDatabaseHandler(DatabaseHandler):
             conn.close()
             return rows
 
+    def get_import_phases(self, import_id):#pyright: ignore[reportIncompatibleMethodOverride]
+        with _db_mutex:
+            conn = sqlite3.connect(self.SQL_DB_FILE)
+            cursor = conn.cursor()
+            cursor.execute('SELECT phase, seconds, bytes FROM import_phases WHERE import_id = ?', (import_id,))
+            rows = cursor.fetchall()
+            conn.close()
+            return rows
+
 
 
 class PostgresDatabaseHandler(DatabaseHandler):
@@ -99,18 +130,35 @@ class PostgresDatabaseHandler(DatabaseHandler):
                             import_time_s REAL NOT NULL
                         )
                     ''')
+                    cursor.execute('''
+                        CREATE TABLE IF NOT EXISTS import_phases (
+                            import_id INTEGER NOT NULL REFERENCES imports(id) ON DELETE CASCADE,
+                            phase TEXT NOT NULL,
+                            seconds REAL NOT NULL,
+                            bytes BIGINT NOT NULL,
+                            PRIMARY KEY (import_id, phase)
+                        )
+                    ''')
         except psycopg.Error as e:
             logger.error(f"Database error: {e}")
             raise
 
-    def insert_import_data(self,time, username, groupname, scope, file_count, total_file_size_mb, import_time_s):
+    def insert_import_data(self,time, username, groupname, scope, file_count, total_file_size_mb, import_time_s,
+                           phases: Optional[dict[str, PhaseTiming]] = None):
         try:
             with _db_mutex, _connect() as conn:
                 with conn.cursor() as cursor:
                     cursor.execute('''
                         INSERT INTO imports (time, username, groupname, scope, file_count, total_file_size_mb, import_time_s)
                         VALUES (%s, %s, %s, %s, %s, %s, %s)
+                        RETURNING id
                     ''', (time, username, groupname, scope, file_count, total_file_size_mb, import_time_s))
+                    row = cursor.fetchone()
+                    if phases and row is not None:
+                        cursor.executemany('''
+                            INSERT INTO import_phases (import_id, phase, seconds, bytes)
+                            VALUES (%s, %s, %s, %s)
+                        ''', [(row[0], name, t.seconds, t.bytes) for name, t in phases.items()])
         
         except psycopg.Error as e:
             logger.error(f"Database error: {e}")
@@ -126,4 +174,14 @@ class PostgresDatabaseHandler(DatabaseHandler):
         except psycopg.Error as e:
             logger.error(f"Database error: {e}")
             raise
+
+    def get_import_phases(self, import_id):#pyright: ignore[reportIncompatibleMethodOverride]
+        try:
+            with _db_mutex, _connect() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute('SELECT phase, seconds, bytes FROM import_phases WHERE import_id = %s', (import_id,))
+                    return cursor.fetchall()
+        except psycopg.Error as e:
+            logger.error(f"Database error: {e}")
+            raise
         
\ No newline at end of file
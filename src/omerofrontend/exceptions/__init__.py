@@ -7,6 +7,7 @@ from .exceptions import (
 	MetaDataError,
 	OmeroConnectionError,
 	OutOfDiskError,
+	UploadSessionError,
 )
 
 __all__ = [
@@ -18,4 +19,5 @@ __all__ = [
 	"AssertImportError",
 	"ImportError",
 	"OutOfDiskError",
+	"UploadSessionError",
 ]
@@ -50,6 +50,12 @@ class OutOfDiskError(OmeroFrontendException):
         super().__init__(filename, message)
         self.filepath : str = filepath
         
+class UploadSessionError(OmeroFrontendException):
+    """Exception raised when a chunked upload request does not match its upload session"""
+    def __init__(self, filename=None, message="Invalid upload request", status: int = 400):
+        super().__init__(filename, message)
+        self.status: int = status
+
 class OmeroObjectNotFoundError(OmeroFrontendException):
     """Exception raised when object is not found in omero"""
     def __init__(self, filename=None, filepath : str = "", message="Object not found on OMERO server"):
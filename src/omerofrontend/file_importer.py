@@ -1,15 +1,22 @@
 import os
 import datetime
+import functools
+from concurrent.futures import Future
 from typing import Tuple
 from dateutil import parser
 from common import conf
 from common import image_funcs
+from common import checksum
+from common import import_timings
 from common import logger
 from common.omero_connection import OmeroConnection
 from common.file_data import FileData
 from omerofrontend.exceptions import DuplicateFileExists
 from omerofrontend.file_uploader import RetryCallback, ProgressCallback, ImportStartedCallback, FileUploader
+from omerofrontend.batch_context import BatchContext
 from common.omero_getter_ctx import OmeroGetterCtx
+from common.dataset_image_index import IndexedImage
+from common.concurrency import gather, then
 
 class FileImporter:
 
@@ -17,10 +24,14 @@ class FileImporter:
         stem, ext = os.path.splitext(filename)
         return f"{stem}_{acquisition_date_time.strftime('%H-%M-%S')}{ext}"
     
-    def import_image_data(self, fileData: FileData, batchtags: dict[str,str], progress_cb: ProgressCallback, retry_cb: RetryCallback, import_cb: ImportStartedCallback, conn: OmeroConnection) -> tuple[list[str], list[int], str]:
+    def import_image_data(self, fileData: FileData, batch: BatchContext, progress_cb: ProgressCallback, retry_cb: RetryCallback, import_cb: ImportStartedCallback, conn: OmeroConnection) -> "Future[tuple[list[str], list[int], str]]":
+        """Send the files to OMERO, the returned future completes once OMERO has imported them"""
         filename = fileData.getMainFileName()
-        file_path, metadict = image_funcs.file_format_splitter(fileData) #file_path is a list of str
+        timings = fileData.getImportTimings()
+        with timings.measure(import_timings.CONVERSION, fileData.getTotalFileSize()):
+            file_path, metadict = image_funcs.file_format_splitter(fileData) #file_path is a list of str
 
+        filesets = self._group_fileset_paths(fileData, file_path)  # before the converted files count as temp files
         fileData.addTempFilePaths(file_path)
 
         #conn: OmeroConnection = OmeroConnection(hostname=conf.OMERO_HOST, port=conf.OMERO_PORT, token=token)
@@ -30,24 +41,40 @@ class FileImporter:
         dataset_id, proj_id = self._check_create_project_and_dataset_(scopes[0], date_str, conn)
 
         fu = FileUploader(conn)
-        omero_path_last = ""
-        image_ids_all: list[int] = []
-        for path in file_path:
-            #fileData.setUploadFilePaths([path])
-            fileData.setConvertedFileName(os.path.basename(path))
-            if self._check_duplicate_file_rename_if_needed(fileData, dataset_id, metadict, conn):
-                continue
-            
-            image_ids, omero_path = fu.upload_files(fileData, metadict, batchtags, dataset_id, proj_id, progress_cb, retry_cb, import_cb)
-
-            image_ids_all.extend(image_ids)
-            omero_path_last = omero_path
-
-        if not image_ids_all:
+        imports: list[Future] = []
+        try:
+            for paths in filesets:
+                fileData.setConvertedFileName(os.path.basename(paths[0]))
+                fileData.setCompanionFilePaths(paths[1:])
+                with timings.measure(import_timings.DEDUPE):
+                    if self._check_duplicate_file_rename_if_needed(fileData, dataset_id, metadict, batch, conn):
+                        continue
+                    if conf.PRE_UPLOAD_DEDUPE_ENABLED and self._check_duplicate_content(fileData, conn):
+                        continue
+
+                imported = fu.upload_files(fileData, metadict, batch, dataset_id, proj_id, progress_cb, retry_cb, import_cb)
+                imported.add_done_callback(functools.partial(
+                    self._index_imported_images, fileData.getConvertedFileName(), dataset_id, metadict, batch, conn))
+                imports.append(imported)
+        except BaseException as e:
+            if not imports:
+                raise
+            # the filesets already sent still use conn, fail once OMERO has finished them
+            logger.error(f"Import of {filename} failed after {len(imports)} fileset(s) were sent: {str(e)}")
+            failed: Future = Future()
+            failed.set_exception(e)
+            imports.append(failed)
+
+        if not imports:
             logger.info(f"All files were duplicates for file {filename}")
             raise DuplicateFileExists(filename)
 
-        return scopes, image_ids_all, omero_path_last
+        def combine(results: list[tuple[list[int], str]]) -> tuple[list[str], list[int], str]:
+            image_ids_all = [i for image_ids, _ in results for i in image_ids]
+            return scopes, image_ids_all, results[-1][1]
+
+        # the caller releases conn when this completes, so wait for every fileset even if one failed
+        return then(gather(imports, wait_all=True), combine)
 
     def _check_create_project_and_dataset_(self,proj_name: str, date_str: str, conn: OmeroConnection) -> Tuple[int,int]:
 
@@ -71,55 +98,106 @@ class FileImporter:
         
     def _set_folder_and_converted_name(self, fileData: FileData, metadict: dict[str,str], file_path: list[str]):
         first_path = file_path[0]
-        folder = os.path.basename(os.path.dirname(first_path)) or ''
+        # the folder the file was uploaded from, the user for single files (files are staged below a per-request id)
+        folder = os.path.basename(os.path.dirname(fileData.getMainFileName())) or fileData.getUserName() or ''
         converted_filename = os.path.basename(first_path)
         fileData.setConvertedFileName(converted_filename)
         if folder != '':
             metadict['UploadFolder'] = folder
 
-    def _check_duplicate_file_rename_if_needed(self, fileData: FileData, dataset_id: int, meta_dict: dict[str,str], conn: OmeroConnection):
+    def _group_fileset_paths(self, fileData: FileData, file_path: list[str]) -> list[list[str]]:
+        """
+        Split the files to import into filesets, the main file of each fileset first.
+
+        Converted files are independent images and get a fileset each. When the staged
+        originals are imported as is, the companion files belong to the main file and
+        are uploaded in the same fileset. The xml attachment is linked afterwards, not imported.
+
+        The multi-file formats accepted today (EMI+SER, MRC+XML atlas) are always converted
+        to OME-TIFF, so a fileset only gets several entries when file_format_splitter
+        produced no output and falls back to the staged originals.
+        """
+        staged = {os.path.normpath(p) for p in fileData.getTempFilePaths()}
+        if len(file_path) < 2 or not all(os.path.normpath(p) in staged for p in file_path):
+            return [[p] for p in file_path]
+
+        main = fileData.getMainFileTempPath() or file_path[0]
+        excluded = {os.path.normpath(main)}
+        attachment = fileData.getAttachmentFile()
+        if attachment:
+            excluded.add(os.path.normpath(attachment))
+        companions = [p for p in file_path if os.path.normpath(p) not in excluded]
+        return [[main] + companions]
+
+    def _check_duplicate_file_rename_if_needed(self, fileData: FileData, dataset_id: int, meta_dict: dict[str,str], batch: BatchContext, conn: OmeroConnection):
         acquisition_date_time = meta_dict.get('Acquisition date')
         parsed_acquisition_date: datetime.datetime | None = None
         if acquisition_date_time:
             parsed_acquisition_date = parser.parse(acquisition_date_time)
 
+        index = batch.get_dataset_index(conn, dataset_id)
+        dup = index.find_by_prefix(fileData.getConvertedFileName())
+
+        if dup is not None and parsed_acquisition_date is not None: #no value for date time. Should NOT happen though
+            if self._is_same_acquisition(dup, parsed_acquisition_date):
+                return True
+
+        # Backward compatibility: older imports may already exist with the time-suffixed name.
+        if parsed_acquisition_date is not None:
+            alternate_name = self._build_time_suffixed_name(fileData.getConvertedFileName(), parsed_acquisition_date)
+            dup_alt = index.find_by_prefix(alternate_name)
+            if dup_alt is not None and self._is_same_acquisition(dup_alt, parsed_acquisition_date):
+                return True
+
+        if dup is not None:
+            if parsed_acquisition_date is None: #security
+                parsed_acquisition_date = datetime.datetime.now()
+
+            new_name = self._build_time_suffixed_name(fileData.getConvertedFileName(), parsed_acquisition_date)
+            fileData.renameFile(new_name)
+
+        return False
+
+    def _check_duplicate_content(self, fileData: FileData, conn: OmeroConnection) -> bool:
+        """True if a file with the same checksum and size is already imported in the group, renamed copies included"""
+        path = fileData.getUploadFilePath()
+        file_hash = fileData.getFileHash(path)
+        if file_hash is None:
+            file_hash = checksum.file_checksum(path)
+            fileData.setFileHash(path, file_hash)
+
         with OmeroGetterCtx(conn) as ogc:
-            dup, childId = ogc.check_duplicate_file(fileData.getConvertedFileName(),dataset_id)
-
-            if dup and childId is not None:
-                if parsed_acquisition_date is not None: #no value for date time. Should NOT happen though
-                    sameTime = ogc.compare_image_acquisition_time(childId,parsed_acquisition_date)
-                    if sameTime:
-                        return True
-                    # Some OMERO backends normalize acquisition date/time differently;
-                    # use the stored map annotation as a secondary exact-date check.
-                    stored_acq_date = ogc.get_map_annotation_value(childId, 'Acquisition date')
-                    expected_acq_date = parsed_acquisition_date.strftime(conf.DATE_TIME_FMT)
-                    if stored_acq_date == expected_acq_date:
-                        return True
-
-            # Backward compatibility: older imports may already exist with the time-suffixed name.
-            if parsed_acquisition_date is not None:
-                alternate_name = self._build_time_suffixed_name(fileData.getConvertedFileName(), parsed_acquisition_date)
-                dup_alt, child_alt_id = ogc.check_duplicate_file(alternate_name, dataset_id)
-                if dup_alt and child_alt_id is not None:
-                    sameTimeAlt = ogc.compare_image_acquisition_time(child_alt_id, parsed_acquisition_date)
-                    if sameTimeAlt:
-                        return True
-                    stored_acq_date_alt = ogc.get_map_annotation_value(child_alt_id, 'Acquisition date')
-                    expected_acq_date = parsed_acquisition_date.strftime(conf.DATE_TIME_FMT)
-                    if stored_acq_date_alt == expected_acq_date:
-                        return True
-
-            if dup:
-                if parsed_acquisition_date is None: #security
-                    parsed_acquisition_date = datetime.datetime.now()
-
-                new_name = self._build_time_suffixed_name(fileData.getConvertedFileName(), parsed_acquisition_date)
-                fileData.renameFile(new_name)
+            file_id = ogc.get_imported_file_id(file_hash, os.path.getsize(path))
 
+        if file_id is not None:
+            logger.info(f"Content of {os.path.basename(path)} already imported as original file {file_id}, skipping upload")
+            return True
         return False
-        
+
+    def _is_same_acquisition(self, image: IndexedImage, acquisition_date: datetime.datetime) -> bool:
+        if image.acquired_at(acquisition_date):
+            return True
+        # Some OMERO backends normalize acquisition date/time differently;
+        # use the stored map annotation as a secondary exact-date check.
+        return image.acquisition_date_value == acquisition_date.strftime(conf.DATE_TIME_FMT)
+
+    def _index_imported_images(self, image_name: str, dataset_id: int, meta_dict: dict[str,str], batch: BatchContext, conn: OmeroConnection, imported: Future):
+        if imported.cancelled() or imported.exception() is not None:
+            return
+        image_ids, _ = imported.result()
+        try:
+            self._add_imported_images_to_index(image_name, dataset_id, meta_dict, image_ids, batch, conn)
+        except Exception as e:
+            logger.warning(f"Could not add imported images of {image_name} to the dataset index: {str(e)}")
+
+    def _add_imported_images_to_index(self, image_name: str, dataset_id: int, meta_dict: dict[str,str], image_ids: list[int], batch: BatchContext, conn: OmeroConnection):
+        acquisition_date_value = meta_dict.get('Acquisition date')
+        acquisition_date = parser.parse(acquisition_date_value) if acquisition_date_value else None
+        index = batch.get_dataset_index(conn, dataset_id)
+        for image_id in image_ids:
+            index.add(IndexedImage(image_id, image_name, acquisition_date,
+                                   str(acquisition_date_value) if acquisition_date_value else None))
+
     # def _importImages(self, fileData: FileData, dataset_id: int, batch_tag: dict[str,str], meta_dict: dict[str,str], conn: OmeroConnection):
         
     #     filename = fileData.getMainFileName()
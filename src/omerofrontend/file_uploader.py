@@ -1,114 +1,136 @@
-from pathlib import Path
 import platform
 import locale
 import omero
-import hashlib
 from threading import Lock
 import omero.model
 import omero.grid
 import traceback
 import os
+import time
+import Ice
+import functools
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import Callable, Optional
 from omero.rtypes import rstring, rbool
-from omero.model.enums import ChecksumAlgorithmSHA1160  # type: ignore
 from omero_version import omero_version
-from omero.callbacks import CmdCallbackI
 from common.file_data import FileData
 from common import conf
+from common import import_timings
 from common.omero_connection import OmeroConnection
 from omerofrontend.exceptions import (
     OmeroConnectionError,
-    AssertImportError,
     ImportError,
 )
 from common import logger
 from common.omero_getter_ctx import OmeroGetterCtx
+from omerofrontend.batch_context import BatchContext
+from omerofrontend.upload_pipeline import UploadPipeline
+from omerofrontend.import_watcher import get_import_watcher
 
 ProgressCallback = Optional[
     Callable[[int], None]
 ]  # Define a type for the progress callback
 RetryCallback = Optional[
-    Callable[[str, int], None]
-]  # Define a type for the retry callback
+    Callable[[int, int], None]
+]  # Define a type for the retry callback, called with (retry number, max retries)
 ImportStartedCallback = Optional[
     Callable[[], None]
 ]  # Define a type for the importing started callback
 
 
+class _ImportProcess:
+    """The import process proxy shared by the uploads of one fileset, replaced once per failure."""
+
+    def __init__(self, proc) -> None:
+        self.proc = proc
+        self._generation = 0
+        self._mtx = Lock()
+
+    def get(self):
+        with self._mtx:
+            return self.proc, self._generation
+
+    def recover(self, generation: int, reopen: Callable):
+        """Reopen the process, unless another upload already did since generation."""
+        with self._mtx:
+            if generation == self._generation:
+                self.proc = reopen(self.proc)
+                self._generation += 1
+            return self.proc
+
+
 class FileUploader:
     def __init__(self, conn: OmeroConnection) -> None:
         self._oConn = conn
-        self._mtx = Lock()
 
     def upload_files(
         self,
         filedata: FileData,
         meta_dict: dict[str, str],
-        tags: dict[str, str],
+        batch: BatchContext,
         dataset_id: int,
         project_id: int,
         progress_cb: ProgressCallback = None,
         retry_cb: RetryCallback = None,
         import_cb: ImportStartedCallback = None,
-    ) -> tuple[list[int], str]:
-        """Upload files to OMERO from local filesystem."""
-        with self._mtx:
-            # TODO: errorhandling in this function is not very good, should be improved
-            mrepo = self._get_managed_repo()
-            if not mrepo:
-                logger.error(
-                    f"Unable to get managed repo, {filedata.getMainFileName()}"
-                )
-                raise OmeroConnectionError(
-                    f"Managed repository not found. {filedata.getMainFileName()}"
-                )
-
-            fileset = self._create_fileset(filedata)
+    ) -> "Future[tuple[list[int], str]]":
+        """Upload files to OMERO from local filesystem.
 
-            annotations = self._create_annotation_objects(meta_dict, tags)
-            description = meta_dict.get("Description", "N/A")
-            settings = self._create_settings(dataset_id, description, annotations)
-            try:
-                proc = mrepo.importFileset(fileset, settings)
-            except Exception as ie:
-                logger.error(
-                    f"Import exception: {str(ie)}, traceback: {traceback.format_exc()}"
-                )
-                raise OmeroConnectionError(
-                    f"Failed to create import process: {str(ie)}"
-                )
+        Returns once the bytes are sent, the future completes with the image ids and the
+        omero path when OMERO has verified and imported the fileset.
+        """
+        # TODO: errorhandling in this function is not very good, should be improved
+        mrepo = self._get_managed_repo()
+        if not mrepo:
+            logger.error(
+                f"Unable to get managed repo, {filedata.getMainFileName()}"
+            )
+            raise OmeroConnectionError(
+                f"Managed repository not found. {filedata.getMainFileName()}"
+            )
 
-            if proc is None:
-                logger.error("Unable to create proc for importFileset")
-                raise OmeroConnectionError(
-                    f"Failed to create import process: {filedata.getMainFileName()}"
-                )
+        fileset = self._create_fileset(filedata)
 
-            # retry_cnt = 0
-            # done = False
-            response = None
-            #            while not done:
-            try:
-                hashes = self._upload_and_calculate_hash(proc, filedata, progress_cb)
-                if import_cb:
-                    import_cb()
-                response = self._assert_import(proc, hashes)
-                # done = True
-            except AssertImportError as aie:
-                logger.error(f"Import assertion error: {str(aie)}")
-                # proc.close()
-                # if retry_cb:
-                #     retry_cb(str(aie.filename), retry_cnt)
-                # retry_cnt += 1
-                # if retry_cnt >= conf.IMPORT_NR_OF_RETRIES:
-                #     logger.error(f"Maximum number of retries ({conf.IMPORT_NR_OF_RETRIES}) reached. Aborting import.")
-                # done = True
-                # proc.close()
-                #    raise ImportError(f"Import failed after {conf.IMPORT_NR_OF_RETRIES} retries: {str(aie)}")
+        with filedata.getImportTimings().measure(import_timings.ANNOTATIONS):
+            annotations = batch.get_annotations(self._oConn)
+            annotations.extend(self._create_annotation_objects(meta_dict, batch))
+        description = meta_dict.get("Description", "N/A")
+        settings = self._create_settings(dataset_id, description, annotations)
+        try:
+            proc = mrepo.importFileset(fileset, settings)
+        except Exception as ie:
+            logger.error(
+                f"Import exception: {str(ie)}, traceback: {traceback.format_exc()}"
+            )
+            raise OmeroConnectionError(
+                f"Failed to create import process: {str(ie)}"
+            )
 
-            finally:
-                proc.close()
+        if proc is None:
+            logger.error("Unable to create proc for importFileset")
+            raise OmeroConnectionError(
+                f"Failed to create import process: {filedata.getMainFileName()}"
+            )
 
+        import_proc = _ImportProcess(proc)
+        try:
+            hashes = self._upload_and_calculate_hash(import_proc, filedata, progress_cb, retry_cb)
+            if import_cb:
+                import_cb()
+            return self._verify_import(
+                import_proc.proc, hashes,
+                functools.partial(self._handle_import_response, filedata=filedata, dataset_id=dataset_id, project_id=project_id,
+                                  verify_start=time.monotonic()),
+            )
+        except BaseException:
+            import_proc.proc.close()
+            raise
+
+    def _handle_import_response(self, response, filedata: FileData, dataset_id: int, project_id: int, verify_start: Optional[float] = None) -> tuple[list[int], str]:
+        """Post import work once OMERO has finished, runs on the import watcher."""
+        timings = filedata.getImportTimings()
+        if verify_start is not None:
+            timings.add(import_timings.VERIFY, time.monotonic() - verify_start)
         if response is None:
             raise ImportError(
                 "No response received from the import process. Import may have failed."
@@ -138,8 +160,9 @@ class FileUploader:
             else:
                 logger.warning(f"Unexpected object type returned: {type(objs)}")
 
-        for i in image_ids:
-            self._check_and_create_attachment(filedata, i)
+        with timings.measure(import_timings.ANNOTATIONS):
+            for i in image_ids:
+                self._check_and_create_attachment(filedata, i)
 
         with OmeroGetterCtx(self._oConn) as ogc:
             proj_name = ogc.get_project_name(project_id)
@@ -168,38 +191,25 @@ class FileUploader:
             self._oConn.create_and_link_local_attachment(attachmentFile, imageid)
 
     def _create_annotation_objects(
-        self, meta_dict: dict[str, str], tags: dict[str, str]
+        self, meta_dict: dict[str, str], batch: BatchContext
     ):
+        """Annotations for the per file metadata, the batch level ones come from the batch context."""
         result_list = []
 
-        for k, v in meta_dict.items() | tags.items():
+        for k, v in meta_dict.items():
+            if batch.is_batch_pair(k, v):
+                continue
             if k == "Comment" and v is not None:
                 ca = omero.model.CommentAnnotationI()  # type: ignore
                 ca.setTextValue(rstring(v))
                 result_list.append(ca)
                 continue
-            with OmeroGetterCtx(self._oConn) as ogc:
-                map_ann = ogc.get_map_annotation(k, v)
-            if map_ann is not None:
-                id = map_ann.getId()
-                logger.debug(f"Using existing map annotation for {k}: {id}")
-                map_annotation = omero.model.MapAnnotationI(id)  # type: ignore
-            else:
-                map_annotation = omero.model.MapAnnotationI()  # type: ignore
             if type(v) is not str:
                 v = str(v)
-            value = omero.model.NamedValue(k, v)  # type: ignore
-            map_annotation.setMapValue([value])
-            result_list.append(map_annotation)
-
-        tags_list = []
-        for k, v in tags.items():
-            ti = omero.model.TagAnnotationI()  # type: ignore
-            ti.setTextValue(rstring(f"{k} {v}"))
-            tags_list.append(ti)
-
-        if len(tags_list) > 0:
-            result_list.extend(tags_list)
+            with OmeroGetterCtx(self._oConn) as ogc:
+                id = ogc.get_or_create_map_annotation_id(k, v)
+            logger.debug(f"Using map annotation for {k}: {id}")
+            result_list.append(omero.model.MapAnnotationI(id, False))  # type: ignore
 
         extra_tag_names = ["Microscope", "Lens Magnification", "Image type"]
         extra_tags = []
@@ -210,17 +220,13 @@ class FileUploader:
 
         with OmeroGetterCtx(self._oConn) as ogc:
             for tag_name in common_tags_unique:
-                tagvalue = meta_dict[tag_name]
+                tagvalue = str(meta_dict[tag_name])
                 if tag_name == "Lens Magnification":
                     tagvalue = (
                         str(tagvalue) + "X"
                     )  # Append 'x' to the lens magnification value
-                if ta := ogc.get_tag_annotation_id(tagvalue):
-                    ti = omero.model.TagAnnotationI(ta)  # type: ignore
-                else:
-                    ti = omero.model.TagAnnotationI()  # type: ignore
-                ti.setTextValue(rstring(tagvalue))
-                extra_tags.append(ti)
+                tag_id = ogc.get_or_create_tag_annotation_id(tagvalue)
+                extra_tags.append(omero.model.TagAnnotationI(tag_id, False))  # type: ignore
 
         if len(extra_tags) > 0:
             result_list.extend(extra_tags)
@@ -253,28 +259,13 @@ class FileUploader:
 
         return prx
 
-    def _sha1(self, file: Path) -> str:
-        """
-        Calculates the local sha1 for a file.
-        """
-        from hashlib import sha1
-
-        digest = sha1()
-        with open(file, "rb") as f:
-            for block in iter(lambda: f.read(1024), b""):
-                digest.update(block)
-
-        return digest.hexdigest()
-
     def _create_fileset(self, filedata: FileData) -> omero.model.FilesetI:  # type: ignore
         """Create a new Fileset from local files."""
         fileset = omero.model.FilesetI()  # type: ignore
-        # for f in filedata.getTempFilePaths():
-        #        for f in filedata.getUploadFilePaths():
-        f = filedata.getUploadFilePath()
-        entry = omero.model.FilesetEntryI()  # type: ignore
-        entry.setClientPath(rstring(f))
-        fileset.addFilesetEntry(entry)
+        for f in filedata.getUploadFilePaths():
+            entry = omero.model.FilesetEntryI()  # type: ignore
+            entry.setClientPath(rstring(f))
+            fileset.addFilesetEntry(entry)
         # Fill version info
         system, node, release, version, machine, processor = platform.uname()
         client_version_info = [
@@ -311,80 +302,143 @@ class FileUploader:
         settings.userSpecifiedAnnotationList = annotations
         settings.userSpecifiedPixels = None
         settings.checksumAlgorithm = omero.model.ChecksumAlgorithmI()  # type: ignore
-        s = rstring(ChecksumAlgorithmSHA1160)
+        s = rstring(conf.UPLOAD_CHECKSUM_ALGORITHM)
         settings.checksumAlgorithm.value = s
 
         return settings
 
     def _upload_and_calculate_hash(
-        self, proc, filedata: FileData, progress_cb: ProgressCallback = None
+        self, import_proc: "_ImportProcess", filedata: FileData, progress_cb: ProgressCallback = None, retry_cb: RetryCallback = None
     ) -> list[str]:
-        """Upload files to OMERO from local filesystem.
-        Returns the SHA1 hash of the file for verification.
+        """Upload the files of the fileset to OMERO, up to UPLOAD_FILESET_CONCURRENCY at a time.
+        Returns the checksum of each file, in fileset entry order, for verification.
         """
-        hashes = []
-        totSize: int = filedata.getTotalFileSize()
-        totRead: int = 0
-        tot_percentage: int = -1
-        fobj = filedata.getUploadFilePath()
-
-        if totSize <= 0:
+        paths = filedata.getUploadFilePaths()
+        sizes: list[int] = []
+        for p in paths:
             try:
-                totSize = os.path.getsize(fobj)
+                sizes.append(os.path.getsize(p))
             except OSError:
-                totSize = 0
-
-        #        for i, fobj in enumerate([filedata.getMainFileName()]):
-        # for i, fobj in enumerate(filedata.getTempFilePaths()):
-        # upload_path = filedata.getUploadFilePath()
-        fobj = filedata.getUploadFilePath()
-        #        for idx, fobj in enumerate(upload_path):
-        rfs = proc.getUploader(0)
-        digest = hashlib.sha1()  # Add 'import hashlib' at top
-
-        try:
-            with open(fobj, "rb") as f:  # file is already a Path
-                # Single-pass upload and hash calculation
-                offset = 0
-                while block := f.read(1_000_000):  # Walrus operator (Python 3.8+)
-                    rfs.write(block, offset, len(block))
-                    digest.update(block)
-                    read_size = len(block)
-                    totRead += read_size
-                    offset += len(block)
-                    if progress_cb:
-                        if totSize > 0:
-                            prog_percentage = int((totRead / totSize) * 100)
-                            if prog_percentage > tot_percentage:
-                                tot_percentage = prog_percentage
-                                progress_cb(tot_percentage)
-        except FileNotFoundError as fnf:
-            error_msg = f"File not found during upload: {fnf.filename}"
-            logger.error(error_msg)
-            raise OmeroConnectionError(error_msg)
-        finally:
-            rfs.close()  # Ensure cleanup even if errors occur
+                sizes.append(0)
+        totSize: int = sum(sizes)
+        sent: list[int] = [0] * len(paths)
+        tot_percentage: int = -1
+        progress_mtx = Lock()
+
+        def bytes_sent(idx: int, fileSent: int):
+            nonlocal tot_percentage
+            if not progress_cb or totSize <= 0:
+                return
+            with progress_mtx:  # one combined, monotonic progress stream for all files
+                sent[idx] = fileSent
+                prog_percentage = min(int((sum(sent) / totSize) * 100), 100)
+                if prog_percentage > tot_percentage:
+                    tot_percentage = prog_percentage
+                    progress_cb(tot_percentage)
+
+        def upload_one(idx: int) -> str:
+            fobj = paths[idx]
+            pipeline = UploadPipeline()
+            # an unconverted file still has the checksum computed while it was staged
+            known_checksum = filedata.getFileHash(fobj) if conf.UPLOAD_REUSE_STAGED_CHECKSUM else None
+            digest = self._upload_with_retries(import_proc, idx, fobj, pipeline, functools.partial(bytes_sent, idx), retry_cb,
+                                               known_checksum)
+
+            stats = pipeline.stats
+            filedata.addUploadStats(stats)
+            logger.info(
+                f"Uploaded {os.path.basename(fobj)}: {stats.bytes_written} bytes in {stats.seconds:.1f} s "
+                f"({stats.throughput / 1e6:.1f} MB/s), block size {stats.initial_block_size} -> {stats.final_block_size}"
+            )
+            return digest
+
+        transfer_start = time.monotonic()
+        if len(paths) == 1:
+            hashes = [upload_one(0)]
+        else:
+            workers = max(1, min(len(paths), conf.UPLOAD_FILESET_CONCURRENCY))
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fileset-upload") as ex:
+                futures = [ex.submit(upload_one, i) for i in range(len(paths))]
+                try:
+                    hashes = [f.result() for f in futures]
+                except BaseException:
+                    for f in futures:
+                        f.cancel()
+                    raise
+
+        filedata.getImportTimings().add(import_timings.TRANSFER, time.monotonic() - transfer_start, totSize)
 
         if progress_cb and tot_percentage < 100:
             progress_cb(100)
 
-        hashes.append(digest.hexdigest())
-
         return hashes
 
-    # TODO: add filedata or filename as parameter for better error messages
-    def _assert_import(self, proc, hashes):
-        """Wait and check that we imported an image correctly."""
+    def _upload_with_retries(
+        self, import_proc: "_ImportProcess", idx: int, fobj: str, pipeline: UploadPipeline,
+        bytes_sent_cb: Callable[[int], None], retry_cb: RetryCallback = None, known_checksum: Optional[str] = None
+    ) -> str:
+        """Upload one fileset entry, resuming at the last confirmed offset after transient Ice errors."""
+        retry_cnt = 0
+        while True:
+            proc, generation = import_proc.get()
+            rfs = None
+            try:
+                rfs = proc.getUploader(idx)
+                return pipeline.upload(rfs, fobj, bytes_sent_cb, resume=retry_cnt > 0, known_checksum=known_checksum)
+            except FileNotFoundError as fnf:
+                error_msg = f"File not found during upload: {fnf.filename}"
+                logger.error(error_msg)
+                raise OmeroConnectionError(error_msg)
+            except Ice.LocalException as le:  # type: ignore
+                retry_cnt += 1
+                if retry_cnt > conf.IMPORT_NR_OF_RETRIES:
+                    logger.error(f"Maximum number of retries ({conf.IMPORT_NR_OF_RETRIES}) reached. Aborting upload of {fobj}.")
+                    raise ImportError(os.path.basename(fobj), f"Upload failed after {conf.IMPORT_NR_OF_RETRIES} retries: {str(le)}")
+
+                delay = min(conf.UPLOAD_RETRY_BACKOFF_MAX_SEC, conf.UPLOAD_RETRY_BACKOFF_SEC * 2 ** (retry_cnt - 1))
+                logger.warning(
+                    f"Upload of {os.path.basename(fobj)} interrupted at byte {pipeline.confirmed_offset}: {str(le)}. "
+                    f"Retry {retry_cnt}/{conf.IMPORT_NR_OF_RETRIES} in {delay:.1f} s"
+                )
+                if retry_cb:
+                    retry_cb(retry_cnt, conf.IMPORT_NR_OF_RETRIES)
+                time.sleep(delay)
+                try:
+                    import_proc.recover(generation, self._reopen_import_process)
+                except Exception as e:
+                    logger.warning(f"Could not recover import process yet: {str(e)}")
+            finally:
+                if rfs is not None:
+                    try:
+                        rfs.close()  # Ensure cleanup even if errors occur
+                    except Exception as e:
+                        logger.debug(f"Ignoring error while closing uploader: {str(e)}")
+
+    def _reopen_import_process(self, proc):
+        """The same import process, through a new connection if the old one was lost."""
+        try:
+            proc.ice_ping()
+            return proc  # only the uploader failed, the process is reachable
+        except Ice.LocalException:  # type: ignore
+            pass
+
+        identity = proc.ice_getIdentity()
+        self._oConn.reconnect()
+        mrepo = self._get_managed_repo()
+        if not mrepo:
+            raise OmeroConnectionError("Managed repository not found after reconnecting.")
+        for candidate in mrepo.listImports():
+            if candidate.ice_getIdentity() == identity:
+                logger.info("Rejoined import process after reconnecting to OMERO")
+                return candidate
+        raise OmeroConnectionError("Import process not found after reconnecting.")
+
+    def _verify_import(self, proc, hashes, on_response) -> Future:
+        """Start the server side verification and import, the watcher completes the returned future."""
         if self._oConn.conn is None or self._oConn.conn.c is None:
             raise OmeroConnectionError(
                 "Could not assert file upload. No connection to OMERO server established."
             )
         handle = proc.verifyUpload(hashes)
-        cb = CmdCallbackI(self._oConn.conn.c, handle)
         # https://github.com/openmicroscopy/openmicroscopy/blob/v5.4.9/components/blitz/src/ome/formats/importer/ImportLibrary.java#L631
-        while not cb.block(2000):
-            logger.info("Waiting for import to finish...")
-        rsp = cb.getResponse()
-        if isinstance(rsp, omero.cmd.ERR):  # type: ignore
-            raise AssertImportError(message=str(rsp))
-        return rsp
+        return get_import_watcher().watch(self._oConn.conn.c, handle, on_response, proc.close)
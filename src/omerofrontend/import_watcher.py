@@ -0,0 +1,151 @@
+import functools
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Event, Lock, Thread
+from typing import Any, Callable, Optional
+import omero
+import omero.cmd
+from omero.callbacks import CmdCallbackI
+from common import conf
+from common import logger
+from omerofrontend.exceptions import AssertImportError, ImportError
+
+ResponseHandler = Callable[[Any], Any]  # called with the import response, its result completes the future
+
+
+class _ImportCallback(CmdCallbackI):
+    """CmdCallbackI that reports the server side finish of the command to the watcher"""
+
+    def __init__(self, client, handle, on_finished: Callable[["_ImportCallback"], None]):
+        self._on_finished = on_finished  # set first, CmdCallbackI may already poll in __init__
+        super().__init__(client, handle)
+
+    def onFinished(self, rsp, status, current):
+        super().onFinished(rsp, status, current)
+        self._on_finished(self)
+
+
+class _WatchedImport:
+    def __init__(self, future: Future, on_response: ResponseHandler, on_close: Optional[Callable[[], None]]):
+        self.future = future
+        self.on_response = on_response
+        self.on_close = on_close
+        self.callback: Any = None
+        self.poll_errors = 0
+
+
+class ImportWatcher:
+    """
+    Completion watcher for server side import verification.
+
+    After the bytes are sent an import only waits for OMERO to finish the verifyUpload
+    command. Instead of blocking an import thread per command, every handle gets a
+    callback that OMERO notifies when the command finishes, and a single watcher thread
+    polls all pending handles as a fallback for lost notifications. Finished imports are
+    handed to a small pool that runs the response handler (attachments, cleanup) and
+    completes the future returned by watch.
+    """
+
+    def __init__(self,
+                 poll_interval: float = conf.IMPORT_WATCH_POLL_SEC,
+                 finish_threads: int = conf.IMPORT_FINISH_THREADS,
+                 callback_factory: Callable[..., Any] = _ImportCallback):
+        self._poll_interval = poll_interval
+        self._callback_factory = callback_factory
+        self._finisher = ThreadPoolExecutor(max_workers=finish_threads, thread_name_prefix="import-finish")
+        self._pending: dict[int, _WatchedImport] = {}
+        self._mutex = Lock()
+        self._stop = Event()
+        self._thread: Optional[Thread] = None
+
+    def watch(self, client, handle, on_response: ResponseHandler, on_close: Optional[Callable[[], None]] = None) -> Future:
+        """Track the command handle, the returned future completes with on_response(response)"""
+        entry = _WatchedImport(Future(), on_response, on_close)
+        with self._mutex:
+            self._pending[id(entry)] = entry  # before the callback exists, it may finish right away
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = Thread(target=self._run, name="import-watcher", daemon=True)
+                self._thread.start()
+
+        try:
+            entry.callback = self._callback_factory(client, handle, functools.partial(self._finished, entry))
+        except BaseException as e:
+            self._fail(entry, e)
+        return entry.future
+
+    def pending_count(self) -> int:
+        with self._mutex:
+            return len(self._pending)
+
+    def stop(self):
+        self._stop.set()
+
+    def _finished(self, entry: _WatchedImport, callback):
+        with self._mutex:
+            if self._pending.pop(id(entry), None) is None:
+                return  # already handed over, by the notification or by a poll
+        entry.callback = callback
+        self._finisher.submit(self._finish, entry)
+
+    def _fail(self, entry: _WatchedImport, error: BaseException):
+        with self._mutex:
+            if self._pending.pop(id(entry), None) is None:
+                return
+        self._finisher.submit(self._finish, entry, error)
+
+    def _finish(self, entry: _WatchedImport, error: Optional[BaseException] = None):
+        try:
+            if error is not None:
+                raise error
+            rsp = entry.callback.getResponse()
+            if isinstance(rsp, omero.cmd.ERR):  # type: ignore
+                raise AssertImportError(message=str(rsp))
+            entry.future.set_result(entry.on_response(rsp))
+        except BaseException as e:
+            logger.error(f"Import verification failed: {str(e)}")
+            entry.future.set_exception(e)
+        finally:
+            self._close(entry)
+
+    @staticmethod
+    def _close(entry: _WatchedImport):
+        try:
+            if entry.callback is not None:
+                entry.callback.close(True)  # also closes the handle
+        except Exception as e:
+            logger.debug(f"Ignoring error while closing import callback: {str(e)}")
+        try:
+            if entry.on_close is not None:
+                entry.on_close()
+        except Exception as e:
+            logger.debug(f"Ignoring error while closing import process: {str(e)}")
+
+    def _run(self):
+        while not self._stop.wait(self._poll_interval):
+            with self._mutex:
+                entries = list(self._pending.values())
+            if entries:
+                logger.debug(f"Waiting for {len(entries)} imports to finish...")
+            for entry in entries:
+                if entry.callback is None:
+                    continue
+                try:
+                    entry.callback.poll()  # calls onFinished when the command is done
+                    entry.poll_errors = 0
+                except Exception as e:
+                    entry.poll_errors += 1
+                    logger.warning(f"Polling import handle failed ({entry.poll_errors}): {str(e)}")
+                    if entry.poll_errors > conf.IMPORT_NR_OF_RETRIES:
+                        self._fail(entry, ImportError(message=f"Lost track of the import: {str(e)}"))
+
+
+_watcher: Optional[ImportWatcher] = None
+_watcher_mutex = Lock()
+
+def get_import_watcher() -> ImportWatcher:
+    """Return the watcher of this process, created lazily so forked workers get their own"""
+    global _watcher
+    with _watcher_mutex:
+        if _watcher is None:
+            _watcher = ImportWatcher()
+        return _watcher
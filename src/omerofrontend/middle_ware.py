@@ -4,17 +4,24 @@ import time
 import functools
 from typing import Optional, Callable, List
 from threading import Lock
+from collections import deque
 from concurrent.futures import Future, ThreadPoolExecutor
 from werkzeug.datastructures import FileStorage
 
 from common import conf
+from common import import_timings
 from common import logger
 from omerofrontend.temp_file_handler import TempFileHandler
 from omerofrontend.file_importer import FileImporter
+from omerofrontend.batch_context import BatchContext
 from common.file_data import FileData
 from omerofrontend.server_event_manager import ServerEventManager
+from omerofrontend.progress_emitter import ProgressEmitter
 from omerofrontend.exceptions import ImageNotSupported, DuplicateFileExists, GeneralError, OmeroConnectionError, OutOfDiskError
 from common.omero_connection import OmeroConnection
+from common.omero_connection_pool import get_connection_pool
+from common.caching import TTLCache
+from common.concurrency import then
 from omerofrontend import database
 
 DoneCallback = Optional[Callable[[List[int],bool], None]]
@@ -27,10 +34,15 @@ class MiddleWare:
         self._file_importer = FileImporter()
         self._executor = ThreadPoolExecutor(max_workers=conf.FILE_IMPORT_THREADS)
         self._future_filedata_context = {}
-        self._store_tmp_file_mutex = Lock()
         self._future_filedata_mutex = Lock()
+        self._batch_contexts = TTLCache(conf.BATCH_CONTEXT_TTL_SEC)
+        self._batch_contexts_mutex = Lock()
         self._db = database_handler
         self._done_cb = None
+        # imports per session token holding an executor thread or an OMERO connection, and the ones waiting for a slot
+        self._token_imports: dict[str, int] = {}
+        self._token_waiting: dict[str, deque] = {}
+        self._token_mutex = Lock()
 
     def import_files(self, files: list[FileStorage], tags, username: str, groupname: str, token: Optional[str], done_callback: DoneCallback = None) -> tuple[bool, str]:
     #def import_files(self, files: list[FileStorage], tags, token: str, done_callback: DoneCallback = None) -> tuple[bool, str]:
@@ -39,31 +51,92 @@ class MiddleWare:
             logger.error("No valid session token provided for import.")
             return (False, "No valid session token provided for import.")
 
-        conn: OmeroConnection = OmeroConnection(hostname=conf.OMERO_HOST, port=conf.OMERO_PORT, token=token)
-        
         #TODO: error handling in this function
-        with self._store_tmp_file_mutex:
-            try:
-                for f in files:
-                    ServerEventManager.send_staging_event(f.filename)
-                logger.debug("in import files...")
-                logger.debug("storing tempfile...")
-                fileData = self._store_and_handle_temp_files(files, username)
-                logger.debug("done")
-            except OutOfDiskError as ode:
-                logger.error(f"Out of disk error while storing temp file {files[0].filename}: {str(ode)}")
-                self._temp_file_handler.remove_temp_file_by_path(ode.filepath)
-                ServerEventManager.send_error_event(files[0].filename,"Out of disk error while storing temp file")
-                
-                return (False, "Out of disk error while storing temp file")
+        try:
+            for f in files:
+                ServerEventManager.send_staging_event(f.filename)
+            logger.debug("in import files...")
+            logger.debug("storing tempfile...")
+            staging_start = time.monotonic()
+            fileData = self._store_and_handle_temp_files(files, username)
+            fileData.getImportTimings().add(import_timings.STAGING, time.monotonic() - staging_start, fileData.getTotalFileSize())
+            logger.debug("done")
+        except OutOfDiskError as ode:
+            logger.error(f"Out of disk error while storing temp file {files[0].filename}: {str(ode)}")
+            self._temp_file_handler.remove_staged_file(ode.filepath, username)
+            ServerEventManager.send_error_event(files[0].filename,"Out of disk error while storing temp file")
             
+            return (False, "Out of disk error while storing temp file")
+        
+        self._enqueue_import(fileData, tags, username, groupname, token, done_callback)
+        return (True, "")
+
+    def import_staged_files(self, fileData: FileData, tags, username: str, groupname: str, token: Optional[str], staging_seconds: float, done_callback: DoneCallback = None) -> tuple[bool, str]:
+        """Import files that are already in staging, e.g. assembled from a chunked upload"""
+        if not token:
+            logger.error("No valid session token provided for import.")
+            return (False, "No valid session token provided for import.")
+
+        fileData.getImportTimings().add(import_timings.STAGING, staging_seconds, fileData.getTotalFileSize())
+        self._enqueue_import(fileData, tags, username, groupname, token, done_callback)
+        return (True, "")
+
+    def _enqueue_import(self, fileData: FileData, tags, username: str, groupname: str, token: str, done_callback: DoneCallback):
+        batch = self._get_batch_context(token, groupname, tags)
         self._done_cb = done_callback
-        future = self._executor.submit(self._handle_image_imports, fileData, tags, username, groupname, conn)
+        submit = functools.partial(self._submit_import, fileData, batch, username, groupname, token, time.monotonic())
+        # a session runs at most OMERO_IMPORT_CONNECTIONS_PER_TOKEN imports, the rest wait here instead of
+        # blocking executor threads other users' imports could use
+        with self._token_mutex:
+            running = self._token_imports.get(token, 0)
+            if running >= conf.OMERO_IMPORT_CONNECTIONS_PER_TOKEN:
+                self._token_waiting.setdefault(token, deque()).append(submit)
+                logger.debug(f"Import of {fileData.getMainFileName()} waits for one of the {running} imports of its session")
+                return
+            self._token_imports[token] = running + 1
+        submit()
+
+    def _submit_import(self, fileData: FileData, batch: BatchContext, username: str, groupname: str, token: str, queued_at: float):
+        future = self._executor.submit(self._handle_image_imports, fileData, batch, username, groupname, token, queued_at)
         self._safe_add_future_filedata_context(future, fileData)
         future.add_done_callback(self._future_complete_callback)
+        future.add_done_callback(functools.partial(self._import_handled, token))
         logger.debug("Future added to executor")
-        return (True, "")
+
+    def _import_handled(self, token: str, future: Future):
+        """The slot of the session is free once OMERO has imported the files, or the import failed before that"""
+        if not future.cancelled() and future.exception() is None and isinstance(future.result(), Future):
+            future.result().add_done_callback(lambda _: self._release_import_slot(token))
+        else:
+            self._release_import_slot(token)
+
+    def _release_import_slot(self, token: str):
+        with self._token_mutex:
+            waiting = self._token_waiting.get(token)
+            if waiting:
+                submit = waiting.popleft()  # the slot goes straight to the next import of the session
+                if not waiting:
+                    del self._token_waiting[token]
+            else:
+                submit = None
+                running = self._token_imports.get(token, 0) - 1
+                if running > 0:
+                    self._token_imports[token] = running
+                else:
+                    self._token_imports.pop(token, None)
+        if submit is not None:
+            submit()
         
+    def _get_batch_context(self, token: str, groupname: str, tags: dict) -> BatchContext:
+        """The files of one batch arrive as separate requests, share one context between them"""
+        key = (token, groupname, frozenset((k, str(v)) for k, v in tags.items()))
+        with self._batch_contexts_mutex:
+            batch = self._batch_contexts.get(key)
+            if batch is None:
+                batch = BatchContext(tags)
+            self._batch_contexts.set(key, batch)  # refresh the ttl while the batch is active
+        return batch
+
     def _safe_add_future_filedata_context(self, future: Future, fileData: FileData):
         with self._future_filedata_mutex:
             self._future_filedata_context[future] = fileData
@@ -90,6 +163,14 @@ class MiddleWare:
             #signal error to UI!
             return
 
+        if future.exception() is None and isinstance(future.result(), Future):
+            # the files are sent and the executor thread is free, finish when OMERO has imported them
+            imported: Future = future.result()
+            if filedata is not None:
+                self._safe_add_future_filedata_context(imported, filedata)
+            imported.add_done_callback(self._future_complete_callback)
+            return
+
         image_ids = []
         result = False
         duplicate = False
@@ -146,29 +227,59 @@ class MiddleWare:
             self._remove_temp_files(filedata) if filedata else None
     
     
-    def _handle_image_imports(self, fileData: FileData, tags: dict, username: str, groupname: str, conn: OmeroConnection):
+    def _handle_image_imports(self, fileData: FileData, batch: BatchContext, username: str, groupname: str, token: str, queued_at: float) -> Future:
+        # every import gets its own joined session, so imports of one user do not share a gateway.
+        # _enqueue_import admits at most max_per_token imports per session, so this does not wait for a lease
+        conn = get_connection_pool().acquire(conf.OMERO_HOST, conf.OMERO_PORT, token, groupname,
+                                             max_per_token=conf.OMERO_IMPORT_CONNECTIONS_PER_TOKEN)
         import_time_start = time.time()
-        ServerEventManager.send_started_event(fileData.getMainFileName())
-        scopes, image_ids, omero_path = self._import_files_to_omero(fileData,tags,conn)
-        import_time = time.time() - import_time_start
-        self._register_in_database(scopes[0],username,groupname,import_time,fileData)
-        return image_ids, omero_path
+        fileData.getImportTimings().add(import_timings.QUEUE_WAIT, time.monotonic() - queued_at)
+        try:
+            ServerEventManager.send_started_event(fileData.getMainFileName())
+            imported = self._import_files_to_omero(fileData,batch,conn)
+        except BaseException as e:
+            self._release_import_connection(conn, e)
+            raise
+        imported.add_done_callback(lambda f: self._release_import_connection(conn, None if f.cancelled() else f.exception()))
+
+        def register(result):
+            scopes, image_ids, omero_path = result
+            import_time = time.time() - import_time_start
+            self._register_in_database(scopes[0],username,groupname,import_time,fileData)
+            return image_ids, omero_path
+
+        return then(imported, register)
+
+    @staticmethod
+    def _release_import_connection(conn: OmeroConnection, error: Optional[BaseException]):
+        """Back to the pool once OMERO has finished the import, unless the connection broke"""
+        if conn.dead or isinstance(error, (OmeroConnectionError, ConnectionError)):
+            get_connection_pool().discard(conn)
+        else:
+            get_connection_pool().release(conn)
 
     
     def _store_and_handle_temp_files(self, files: list[FileStorage], username: str) -> FileData:
+        sizes = {f.filename: TempFileHandler._get_file_size(f) for f in files}
+        emitters: dict[str, ProgressEmitter] = {}
+
         def temp_cb(filename: str, prg:int):
-            ServerEventManager.send_staging_event(filename,str(int(prg)) + "%")
+            emitter = emitters.get(filename)
+            if emitter is None:
+                send = lambda p, rate, eta: ServerEventManager.send_staging_event(filename, str(p) + "%", rate, eta)
+                emitter = emitters[filename] = ProgressEmitter(send, sizes.get(filename, 0))
+            emitter(prg)
         fileData = self._temp_file_handler.check_and_store_tempfiles(files, username, temp_cb)
         return fileData
     
-    def _import_files_to_omero(self, file: FileData, tags, conn: OmeroConnection):
+    def _import_files_to_omero(self, file: FileData, batch: BatchContext, conn: OmeroConnection):
         filename = file.getMainFileName()
         logger.info(f"Processing of {file.getTempFilePaths()}")
-        prog_fun = functools.partial(ServerEventManager.send_progress_event,filename)
+        prog_fun = ProgressEmitter(functools.partial(ServerEventManager.send_progress_event,filename), int(file.getTotalFileSize()))
         rt_fun = functools.partial(ServerEventManager.send_retry_event,filename)
         import_fun = functools.partial(ServerEventManager.send_importing_event,filename)
         
-        return self._file_importer.import_image_data(file, tags, prog_fun, rt_fun, import_fun, conn)
+        return self._file_importer.import_image_data(file, batch, prog_fun, rt_fun, import_fun, conn)
     
     def _remove_temp_files(self, file: FileData):
         self._temp_file_handler._remove_temp_files(file)
@@ -196,6 +307,8 @@ class MiddleWare:
         logger.info(f"    File total size (MB): {total_file_size /1024 / 1024}")
         logger.info(f"    Import time (s): {import_time}")
         logger.info("")
+        timings = fileData.getImportTimings()
+        logger.info(f"Import phases file={fileData.getMainFileName()} total_s={import_time:.3f} {timings.log_line()}")
         
         # Insert data into the database
         self._db.insert_import_data(
@@ -205,5 +318,6 @@ class MiddleWare:
             scope=scope,
             file_count=file_n,
             total_file_size_mb=total_file_size / 1024 / 1024,
-            import_time_s=import_time
+            import_time_s=import_time,
+            phases=timings.phases()
             )
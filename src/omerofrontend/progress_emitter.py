@@ -0,0 +1,126 @@
+import time
+from threading import Condition, Event, Lock, Thread
+from typing import Callable, Hashable, Optional
+from common import conf
+from common import logger
+
+ProgressSender = Callable[[int, Optional[float], Optional[float]], None]  # percent, bytes per second, eta in seconds
+
+
+class ProgressPublisher:
+    """
+    Background sender for progress events.
+
+    Sending an event is a Redis round trip, so upload threads only hand the newest update
+    per key to this thread. While an earlier send is in progress newer updates for the
+    same key replace the pending one instead of queueing up behind it.
+    """
+
+    def __init__(self):
+        self._pending: dict[Hashable, tuple[Callable[[], None], list[Event]]] = {}
+        self._cond = Condition()
+        self._thread: Optional[Thread] = None
+
+    def publish(self, key: Hashable, send: Callable[[], None], wait: bool = False):
+        """Send in the background, with wait block until this update (or a newer one) was sent"""
+        done = Event() if wait else None
+        with self._cond:
+            _, waiters = self._pending.get(key, (None, []))  # waiters of a replaced update wait for this one
+            if done is not None:
+                waiters.append(done)
+            self._pending[key] = (send, waiters)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = Thread(target=self._run, name="progress-publisher", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        if done is not None:
+            done.wait()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                items = list(self._pending.values())
+                self._pending.clear()
+            for send, waiters in items:
+                try:
+                    send()
+                except Exception as e:
+                    logger.warning(f"Sending progress event failed: {str(e)}")
+                finally:
+                    for done in waiters:
+                        done.set()
+
+
+class ProgressEmitter:
+    """
+    Throttled progress callback for one file.
+
+    Called with the progress in percent, forwards an update to send only when at least
+    min_interval seconds passed and the progress moved by at least min_delta percent since
+    the last one. 100% is always forwarded, and waited for, so it reaches the client
+    before the events that follow it. Progress below 100% after that starts a new run, e.g.
+    the next fileset of a file with several outputs. With total_bytes the transfer rate and
+    the remaining time are derived from the progress since the first update of the run.
+    """
+
+    def __init__(self,
+                 send: ProgressSender,
+                 total_bytes: int = 0,
+                 min_interval: float = conf.PROGRESS_MIN_INTERVAL_SEC,
+                 min_delta: int = conf.PROGRESS_MIN_DELTA_PERCENT,
+                 publisher: Optional[ProgressPublisher] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self._send = send
+        self._total_bytes = total_bytes
+        self._min_interval = min_interval
+        self._min_delta = min_delta
+        self._publisher = publisher if publisher is not None else get_progress_publisher()
+        self._clock = clock
+        self._mutex = Lock()
+        self._start: Optional[tuple[float, int]] = None  # time and percent of the first update of the run
+        self._last_sent: Optional[tuple[float, int]] = None
+        self._finished = False
+
+    def __call__(self, percent: float):
+        percent = max(0, min(100, int(percent)))
+        with self._mutex:
+            if self._finished:
+                if percent >= 100:
+                    return
+                self._start, self._last_sent, self._finished = None, None, False  # the next upload started
+            now = self._clock()
+            if self._start is None:
+                self._start = (now, percent)  # conversion and dedupe before the first update are not transfer time
+            final = percent >= 100
+            if not final and self._last_sent is not None:
+                last_time, last_percent = self._last_sent
+                if now - last_time < self._min_interval or percent - last_percent < self._min_delta:
+                    return
+            self._last_sent = (now, percent)
+            self._finished = final
+            rate, eta = self._rate_and_eta(percent, now)
+
+        send = self._send
+        self._publisher.publish(id(self), lambda: send(percent, rate, eta), wait=final)
+
+    def _rate_and_eta(self, percent: int, now: float) -> tuple[Optional[float], Optional[float]]:
+        start_time, start_percent = self._start  # type: ignore[misc]
+        elapsed = now - start_time
+        if self._total_bytes <= 0 or elapsed <= 0 or percent <= start_percent:
+            return None, None
+        rate = self._total_bytes * (percent - start_percent) / 100 / elapsed
+        return rate, self._total_bytes * (100 - percent) / 100 / rate
+
+
+_publisher: Optional[ProgressPublisher] = None
+_publisher_mutex = Lock()
+
+def get_progress_publisher() -> ProgressPublisher:
+    """Return the publisher of this process, created lazily so forked workers get their own"""
+    global _publisher
+    with _publisher_mutex:
+        if _publisher is None:
+            _publisher = ProgressPublisher()
+        return _publisher
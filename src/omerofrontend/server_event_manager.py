@@ -103,12 +103,12 @@ class ServerEventManager:
         cls._create_and_put_event(fileName,UNSUPPORTED_FORMAT,f" {msg}")
 
     @classmethod
-    def send_staging_event(cls,fileName, msg=""):
-        cls._create_and_put_event(fileName,STAGING,msg)
+    def send_staging_event(cls,fileName, msg="", rate=None, eta=None):
+        cls._create_and_put_event(fileName,STAGING,msg,rate=rate,eta=eta)
 
     @classmethod
-    def send_progress_event(cls,fileName,progress):
-        cls._create_and_put_event(fileName,PROGRESS,"Uploading to Omero: " + str(progress) + "%")
+    def send_progress_event(cls,fileName,progress, rate=None, eta=None):
+        cls._create_and_put_event(fileName,PROGRESS,"Uploading to Omero: " + str(progress) + "%",rate=rate,eta=eta)
 
     @classmethod
     def send_importing_event(cls,fileName):
@@ -137,8 +137,8 @@ class ServerEventManager:
     ###############################
     
     @classmethod
-    def _create_and_put_event(cls,fileName,status,message,result="", type="message"):
-        event = cls._generateEvent(fileName,status,message,result, type=type)
+    def _create_and_put_event(cls,fileName,status,message,result="", type="message", rate=None, eta=None):
+        event = cls._generateEvent(fileName,status,message,result, type=type, rate=rate, eta=eta)
         cls.putEvent(event)
     
     @classmethod
@@ -148,7 +148,7 @@ class ServerEventManager:
             return cls._id_cntr
     
     @classmethod
-    def _generateEvent(cls,fileName,status,message,result="", type="message"):
+    def _generateEvent(cls,fileName,status,message,result="", type="message", rate=None, eta=None):
         
         event_data = { 
             
@@ -162,6 +162,12 @@ class ServerEventManager:
             "id" : cls._get_next_id() 
             }
         
+        #transfer rate in bytes/s and estimated seconds left, only on progress updates
+        if rate is not None:
+            event_data["data"]["rate"] = round(rate)
+        if eta is not None:
+            event_data["data"]["eta"] = round(eta)
+        
         return event_data
     
     @classmethod
@@ -0,0 +1,29 @@
+from functools import cached_property
+from typing import IO, Optional
+from flask import Request
+from common import image_funcs
+from omerofrontend.temp_file_handler import TempFileHandler
+
+
+class StagingRequest(Request):
+    """
+    Request whose multipart file parts are written straight to their staging paths.
+
+    Werkzeug spools every file part to a temporary file that staging then copied once
+    more. When a view sets staging_username before it first touches request.form or
+    request.files, supported image files are instead parsed into StagedFile objects,
+    which hash and count the bytes as they arrive. Other parts keep the default spooling.
+    All files of the request share one staging directory.
+    """
+
+    staging_username: Optional[str] = None
+
+    @cached_property
+    def staging_id(self) -> str:
+        return TempFileHandler.new_staging_id()
+
+    def _get_file_stream(self, total_content_length: Optional[int], content_type: Optional[str],
+                         filename: Optional[str] = None, content_length: Optional[int] = None) -> IO[bytes]:
+        if self.staging_username and filename and image_funcs.is_supported_format(filename):
+            return TempFileHandler().open_staged_file(filename, self.staging_username, self.staging_id)  # type: ignore[return-value]
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
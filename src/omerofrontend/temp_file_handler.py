@@ -1,9 +1,12 @@
 import os
 import shutil
+import uuid
 from typing import Callable, Optional
 from werkzeug.datastructures import FileStorage
 from common import logger
 from common import conf
+from common.buffer_pool import get_buffer_pool, readinto
+from common.checksum import new_checksum
 from common.file_data import FileData
 from common import czi_pyramidizer
 from common import image_funcs
@@ -11,7 +14,90 @@ from omerofrontend.exceptions import GeneralError, ImageNotSupported, OutOfDiskE
 
 TempProgressCallback = Optional[Callable[[str, int], None]]  # Define a type for the progress callback
 
+
+class StagedFile:
+    """
+    Writable file for one uploaded file part, written by the form parser directly into
+    the staging directory of its request.
+
+    The data goes to a part file and is checksummed and counted while it is written,
+    commit moves it to its staging path. A part file that is never committed is removed
+    on close.
+    """
+
+    def __init__(self, final_path: str, algorithm: str = conf.UPLOAD_CHECKSUM_ALGORITHM):
+        self.final_path = final_path
+        self.part_path = f"{final_path}.part"
+        self.size = 0
+        self.committed = False
+        self._digest = new_checksum(algorithm)
+        self._file = open(self.part_path, "w+b")
+
+    def write(self, data) -> int:
+        n = self._file.write(data)
+        self._digest.update(data)
+        self.size += n
+        return n
+
+    def hexdigest(self) -> str:
+        return self._digest.hexdigest()
+
+    # the parser rewinds the container once the part is written, FileStorage may read it
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        return self._file.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self._file.tell()
+
+    def seekable(self) -> bool:
+        return True
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        return self._file.read(size)
+
+    def readinto(self, buf) -> int:
+        return self._file.readinto(buf)
+
+    def flush(self):
+        self._file.flush()
+
+    def commit(self):
+        self._file.close()
+        os.replace(self.part_path, self.final_path)
+        self.committed = True
+
+    def close(self):
+        self._file.close()
+        if not self.committed and os.path.exists(self.part_path):
+            os.remove(self.part_path)
+
+    @property
+    def closed(self) -> bool:
+        return self._file.closed
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
 class TempFileHandler:
+    """
+    Stores uploaded files for import.
+
+    The files of each upload request go to their own staging directory,
+    <UPLOAD_FOLDER>/<username>/<staging id>/<filename>, so a second upload of the same
+    file name never replaces a file an earlier import is still working on.
+    """
+
+    @staticmethod
+    def new_staging_id() -> str:
+        """Name of the staging directory of one upload request"""
+        return uuid.uuid4().hex
 
     @staticmethod
     def _get_file_size(file: FileStorage) -> int:
@@ -28,10 +114,13 @@ class TempFileHandler:
         stream.seek(current_pos)
         return int(size)
     
-    def check_and_store_tempfiles(self, files: list[FileStorage], username: str, temp_cb: TempProgressCallback) -> FileData:
+    def check_and_store_tempfiles(self, files: list[FileStorage], username: str, temp_cb: TempProgressCallback,
+                                  staging_id: Optional[str] = None) -> FileData:
+        staging_id = staging_id or self.new_staging_id()
         filePaths = []
         fileSizes = []
         fileNames = []
+        fileHashes: dict[str, str] = {}
         logger.info("in startImport")
         for file in files:
             if file.filename is None:
@@ -40,28 +129,72 @@ class TempFileHandler:
             if not image_funcs.is_supported_format(file.filename):
                 raise ImageNotSupported(file.filename) 
 
-            result, filepath, filesize = self._store_temp_file(file, file.filename, username, temp_cb)
+            result, filepath, filesize = self._store_temp_file(file, file.filename, username, temp_cb, staging_id)
             if not result:
                 raise GeneralError(None, "Unable to store temp file {file}")
             
             fileNames.append(file.filename)
             filePaths.append(filepath)
             fileSizes.append(filesize)
+            if isinstance(file.stream, StagedFile):
+                fileHashes[filepath] = file.stream.hexdigest()
+
+        fileData = self.create_file_data(fileNames, filePaths, fileSizes, username)
+        for path, file_hash in fileHashes.items():
+            fileData.setFileHash(path, file_hash)  # hashed while staging, no extra read pass before dedupe
+        
+        return fileData
 
+    def create_file_data(self, fileNames: list[str], filePaths: list[str], fileSizes: list[int], username: str) -> FileData:
         fileData = FileData(fileNames)
         fileData.setUserName(username)
         fileData.setFileSizes(fileSizes)
         fileData.setTempFilePaths(filePaths)
-        
         return fileData
+
+    def preallocate_part_file(self, filename: str, username: str, upload_id: str, size: int) -> tuple[str, str]:
+        """Reserve size bytes for a chunked upload of filename, returns the staging path and the part path"""
+        file_path = self._create_user_temp_dir(filename, username, upload_id)  # the upload id is the staging id
+        part_path = f"{file_path}.part"
+        try:
+            fd = os.open(part_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            try:
+                if size > 0 and hasattr(os, "posix_fallocate"):
+                    os.posix_fallocate(fd, 0, size)  # fail now instead of at the last chunk when the disk is full
+                else:
+                    os.ftruncate(fd, size)
+            finally:
+                os.close(fd)
+        except OSError as e:
+            logger.error(f"Error in preallocate_part_file:  {str(e)}")
+            self.remove_staged_file(part_path, username)
+            raise OutOfDiskError(filename, part_path, "Out Of Disk on temp storage!")
+        return file_path, part_path
+
+    def commit_part_file(self, filename: str, part_path: str, file_path: str):
+        """Move a completely written part file to its staging path"""
+        try:
+            os.replace(part_path, file_path)
+        except Exception as e:
+            logger.error(f"Error in commit_part_file:  {str(e)}")
+            raise OutOfDiskError(filename, part_path, "Out Of Disk on temp storage!")
     
     
-    def _store_temp_file(self, file: FileStorage, filename: str, username: str, temp_cb: TempProgressCallback):
+    def open_staged_file(self, filename: str, username: str, staging_id: str) -> StagedFile:
+        """File the form parser streams an uploaded part of filename into, see StagingRequest"""
+        return StagedFile(self._create_user_temp_dir(filename, username, staging_id))
+
+    def _store_temp_file(self, file: FileStorage, filename: str, username: str, temp_cb: TempProgressCallback,
+                         staging_id: Optional[str] = None):
         
         def call_if_not_none(cb, fname, data):
             return cb(fname, data) if cb is not None else None
         
-        file_path = self._create_user_temp_dir(filename, username)
+        if isinstance(file.stream, StagedFile):
+            return self._commit_staged_file(file.stream, filename, username, temp_cb)
+
+        file_path = self._create_user_temp_dir(filename, username, staging_id or self.new_staging_id())
+        part_path = f"{file_path}.part"  # renamed into place when complete
 
         stream = file.stream
         if stream.seekable():
@@ -75,31 +208,45 @@ class TempFileHandler:
             # Save file to temporary directory
             if file_size <= conf.MAX_SIZE_FULL_UPLOAD or not conf.USE_CHUNK_READ_ON_LARGE_FILES:
                 logger.debug(f"File {filename} is smaller than {conf.MAX_SIZE_FULL_UPLOAD / (1024 * 1024)} MB. Full upload will be used.")
-                file.save(file_path) #one go save
+                file.save(part_path) #one go save
                 call_if_not_none(temp_cb, filename, 100)
 
             else:        
                 logger.debug(f"File {filename} is larger than {conf.MAX_SIZE_FULL_UPLOAD / (1024 * 1024)} MB. Chunked upload will be used.")
                 tot = 0
-                with open(file_path, 'wb') as f:
-                    while chunk := file.stream.read(conf.CHUNK_SIZE):
-                        tot += len(chunk)
-                        f.write(chunk)
+                with open(part_path, 'wb') as f, get_buffer_pool().borrow(conf.CHUNK_SIZE) as buf:
+                    view = memoryview(buf)
+                    while n := readinto(file.stream, view):
+                        tot += n
+                        f.write(view[:n])
                         if file_size > 0:
                             call_if_not_none(temp_cb, filename, (tot / file_size) * 100)
                         #logger.debug(f"storing {tot} of {file_size} ")
                 if file_size <= 0:
                     call_if_not_none(temp_cb, filename, 100)
 
+            os.replace(part_path, file_path)
             # Some request streams do not expose a reliable content length.
             # Always trust on-disk size after save to avoid zero-size metadata.
             file_size = os.path.getsize(file_path)
         except Exception as e:
             logger.error(f"Error in _store_temp_file:  {str(e)}")
-            raise OutOfDiskError(filename, file_path, "Out Of Disk on temp storage!")
+            raise OutOfDiskError(filename, part_path, "Out Of Disk on temp storage!")
     
         return True, file_path, file_size
 
+    def _commit_staged_file(self, staged: StagedFile, filename: str, username: str, temp_cb: TempProgressCallback):
+        """The bytes were written while the request was parsed, only move them into place"""
+        try:
+            staged.commit()
+        except Exception as e:
+            logger.error(f"Error in _commit_staged_file:  {str(e)}")
+            raise OutOfDiskError(filename, staged.part_path, "Out Of Disk on temp storage!")
+
+        if temp_cb is not None:
+            temp_cb(filename, 100)
+        return True, staged.final_path, staged.size
+
     def _remove_temp_files(self,fileData : FileData):
         for f in fileData.getTempFilePaths():
             self.remove_temp_file_by_path(f)
@@ -109,6 +256,11 @@ class TempFileHandler:
         #     else:
         #         logger.info(f"Temporary file {f} does not exist, unable to remove")
 
+        self._remove_converted_files(fileData)
+        for f in fileData.getTempFilePaths():
+            self._remove_empty_staging_dirs(f, fileData.getUserName() or "")
+
+    def _remove_converted_files(self, fileData: FileData):
         if not fileData.hasConvertedFileName():
             return
         
@@ -134,11 +286,26 @@ class TempFileHandler:
         else:
             logger.info(f"Temporary file {filepath} does not exist, unable to remove")
 
-       
-    def _create_user_temp_dir(self, filename: str, username: str) -> str:
+
+    def remove_staged_file(self, filepath: str, username: str):
+        """Remove a staged or part file, and its staging directory once that is empty"""
+        self.remove_temp_file_by_path(filepath)
+        self._remove_empty_staging_dirs(filepath, username)
+
+    def _remove_empty_staging_dirs(self, filepath: str, username: str):
+        user_ul_folder = os.path.normpath(conf.UPLOAD_FOLDER + "/" + username)
+        folder = os.path.dirname(os.path.normpath(filepath))
+        while folder.startswith(user_ul_folder + os.sep):
+            try:
+                os.rmdir(folder)
+            except OSError:
+                return  # other files of the request are still there
+            folder = os.path.dirname(folder)
+
+    def _create_user_temp_dir(self, filename: str, username: str, staging_id: str) -> str:
           # Create subdirectories if needed
         user_ul_folder = conf.UPLOAD_FOLDER + "/" + username
-        file_path = os.path.join(user_ul_folder, *os.path.split(filename))
+        file_path = os.path.join(user_ul_folder, staging_id, *os.path.split(filename))
         os.makedirs(os.path.dirname(file_path), exist_ok=True)
         return file_path
     
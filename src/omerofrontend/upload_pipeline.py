@@ -0,0 +1,303 @@
+import queue
+import time
+from collections import deque
+from dataclasses import dataclass
+from threading import Event, Thread
+from typing import Any, Callable, Optional
+from common import conf
+from common import logger
+from common.checksum import new_checksum
+
+BytesSentCallback = Optional[Callable[[int], None]]  # total number of bytes confirmed written
+
+
+# Room left in an Ice message for the request header and the other write arguments
+ICE_MESSAGE_OVERHEAD = 64 * 1024
+
+
+@dataclass
+class UploadStats:
+    bytes_written: int = 0
+    seconds: float = 0.0
+    writes: int = 0
+    initial_block_size: int = 0
+    final_block_size: int = 0
+
+    @property
+    def throughput(self) -> float:
+        """Bytes per second"""
+        return self.bytes_written / self.seconds if self.seconds > 0 else 0.0
+
+
+class BlockSizeController:
+    """
+    Chooses the RawFileStore write size from measured write latency and throughput.
+
+    Every window of completed writes the throughput is compared with the previous
+    window: the block size keeps doubling or halving while that improves throughput
+    and turns around when it gets worse. Writes slower than the target latency always
+    shrink the block, so a slow link does not hold large blocks hostage. The size stays
+    within [min_size, max_size].
+    """
+
+    TOLERANCE = 0.05  # relative throughput change treated as noise
+
+    def __init__(self,
+                 initial_size: int = conf.UPLOAD_BLOCK_SIZE,
+                 min_size: int = conf.UPLOAD_BLOCK_SIZE_MIN,
+                 max_size: int = conf.UPLOAD_BLOCK_SIZE_MAX,
+                 window: int = conf.UPLOAD_BLOCK_ADAPT_WINDOW,
+                 target_latency: float = conf.UPLOAD_TARGET_WRITE_LATENCY_SEC):
+        self.min_size = min(min_size, max_size)
+        self.max_size = max_size
+        self._window = max(1, window)
+        self._target_latency = target_latency
+        self._size = self._clamp(initial_size)
+        self._direction = 1
+        self._prev_throughput: Optional[float] = None
+        self._reset_window(time.monotonic())
+
+    @property
+    def block_size(self) -> int:
+        return self._size
+
+    def limit(self, max_size: int):
+        """Lower the upper bound, e.g. to what fits in one Ice message"""
+        self.max_size = max(1, min(self.max_size, max_size))
+        self.min_size = min(self.min_size, self.max_size)
+        self._size = self._clamp(self._size)
+
+    def record(self, nbytes: int, latency: float, now: Optional[float] = None):
+        """Feed one completed write"""
+        now = time.monotonic() if now is None else now
+        self._bytes += nbytes
+        self._latency += latency
+        self._count += 1
+        if self._count < self._window:
+            return
+
+        elapsed = now - self._window_start
+        throughput = self._bytes / elapsed if elapsed > 0 else float("inf")
+        avg_latency = self._latency / self._count
+        if avg_latency > self._target_latency:
+            self._direction = -1
+            self._step()
+        elif self._prev_throughput is None or throughput > self._prev_throughput * (1 + self.TOLERANCE):
+            self._step()
+        elif throughput < self._prev_throughput * (1 - self.TOLERANCE):
+            self._direction = -self._direction
+            self._step()
+        self._prev_throughput = throughput
+        self._reset_window(now)
+
+    def _step(self):
+        size = self._size * 2 if self._direction > 0 else self._size // 2
+        self._size = self._clamp(size)
+
+    def _clamp(self, size: int) -> int:
+        return max(self.min_size, min(self.max_size, size))
+
+    def _reset_window(self, now: float):
+        self._window_start = now
+        self._bytes = 0
+        self._latency = 0.0
+        self._count = 0
+
+
+class _EndOfFile:
+    pass
+
+
+class _StageFailed:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class _Stopped(Exception):
+    pass
+
+
+class UploadPipeline:
+    """
+    Pipelined upload of one local file to an OMERO RawFileStore.
+
+    A reader thread reads blocks from disk, a hasher thread updates the checksum and the
+    calling thread writes the blocks with asynchronous begin_write calls, keeping up to
+    max_in_flight writes outstanding. The stages are connected by bounded queues, so disk
+    reads, hashing and network round trips overlap while memory stays bounded to the
+    blocks queued or in flight. Blocks are read as bytes, the type Ice marshals byte
+    sequences from, so they are sent without another copy. The size of each block read is taken from the
+    BlockSizeController, which is fed the latency of every completed write.
+
+    The pipeline tracks the offset and checksum state up to which every write has been
+    confirmed, an interrupted upload can be resumed from there with a new RawFileStore.
+    When the checksum of the file is already known, e.g. from staging, the hasher is left
+    out and the blocks go from the reader straight to the writer.
+    """
+
+    def __init__(self,
+                 block_size: int = conf.UPLOAD_BLOCK_SIZE,
+                 max_in_flight: int = conf.UPLOAD_WRITES_IN_FLIGHT,
+                 queue_depth: int = conf.UPLOAD_QUEUE_DEPTH,
+                 controller: Optional[BlockSizeController] = None,
+                 algorithm: str = conf.UPLOAD_CHECKSUM_ALGORITHM):
+        if controller is None:
+            controller = BlockSizeController(initial_size=block_size,
+                                             min_size=min(block_size, conf.UPLOAD_BLOCK_SIZE_MIN),
+                                             max_size=max(block_size, conf.UPLOAD_BLOCK_SIZE_MAX))
+        self._controller = controller
+        self._max_in_flight = max(1, max_in_flight)
+        self._queue_depth = max(1, queue_depth)
+        self._stop = Event()
+        self.stats = UploadStats()
+        self.confirmed_offset = 0
+        self._algorithm = algorithm
+        self.confirmed_digest: Any = new_checksum(algorithm)
+
+    @staticmethod
+    def _message_size_limit(rfs: Any) -> Optional[int]:
+        """Largest write payload accepted by the Ice communicator of the proxy, None if unknown"""
+        try:
+            props = rfs.ice_getCommunicator().getProperties()
+            max_kb = props.getPropertyAsIntWithDefault("Ice.MessageSizeMax", 1024)
+        except Exception:
+            return None
+        if max_kb <= 0:  # no limit
+            return None
+        return max_kb * 1024 - ICE_MESSAGE_OVERHEAD
+
+    def upload(self, rfs: Any, path: str, bytes_sent_cb: BytesSentCallback = None, resume: bool = False,
+               known_checksum: Optional[str] = None) -> str:
+        """
+        Write the file at path to rfs, returns the checksum hex digest of the whole file.
+
+        With resume the upload continues at confirmed_offset with the checksum state of the
+        previous attempt instead of reading and sending the file from the start. With
+        known_checksum the file is not hashed again and that checksum is returned.
+        """
+        self._stop.clear()
+        limit = self._message_size_limit(rfs)
+        if limit is not None:
+            self._controller.limit(limit)
+        if not resume:
+            self.confirmed_offset = 0
+            self.confirmed_digest = new_checksum(self._algorithm)
+            self.stats = UploadStats(initial_block_size=self._controller.block_size)
+        start = time.monotonic()
+        start_offset = self.confirmed_offset
+
+        to_hash: queue.Queue = queue.Queue(maxsize=self._queue_depth)
+        to_write: queue.Queue = queue.Queue(maxsize=self._queue_depth)
+        digest = self.confirmed_digest.copy()
+
+        if known_checksum is None:
+            stages = [
+                Thread(target=self._read, args=(path, start_offset, to_hash), name="upload-reader", daemon=True),
+                Thread(target=self._hash, args=(digest, to_hash, to_write), name="upload-hasher", daemon=True),
+            ]
+        else:
+            stages = [Thread(target=self._read, args=(path, start_offset, to_write), name="upload-reader", daemon=True)]
+        for t in stages:
+            t.start()
+
+        try:
+            self._write(rfs, to_write, bytes_sent_cb)
+        finally:
+            self._stop.set()
+            for t in stages:
+                t.join()
+            self.stats.seconds += time.monotonic() - start
+            self.stats.final_block_size = self._controller.block_size
+
+        return known_checksum if known_checksum is not None else digest.hexdigest()
+
+    def _put(self, q: queue.Queue, item):
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+        raise _Stopped()
+
+    def _get(self, q: queue.Queue):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        raise _Stopped()
+
+    def _read(self, path: str, offset: int, to_hash: queue.Queue):
+        try:
+            with open(path, "rb") as f:
+                f.seek(offset)
+                while True:
+                    data = f.read(self._controller.block_size)
+                    if not data:
+                        self._put(to_hash, _EndOfFile())
+                        return
+                    self._put(to_hash, (offset, data, len(data)))
+                    offset += len(data)
+        except _Stopped:
+            pass
+        except BaseException as e:
+            try:
+                self._put(to_hash, _StageFailed(e))
+            except _Stopped:
+                pass
+
+    def _hash(self, digest, to_hash: queue.Queue, to_write: queue.Queue):
+        try:
+            while True:
+                item = self._get(to_hash)
+                if isinstance(item, tuple):
+                    offset, buf, n = item
+                    digest.update(buf)
+                    item = (offset, buf, n, digest.copy())  # state to resume from once this block is confirmed
+                self._put(to_write, item)
+                if not isinstance(item, tuple):
+                    return
+        except _Stopped:
+            pass
+        except BaseException as e:
+            try:
+                self._put(to_write, _StageFailed(e))
+            except _Stopped:
+                pass
+
+    def _write(self, rfs: Any, to_write: queue.Queue, bytes_sent_cb: BytesSentCallback):
+        in_flight: deque = deque()
+        sent = self.confirmed_offset
+
+        def complete_oldest():
+            nonlocal sent
+            result, n, started, snapshot = in_flight.popleft()
+            rfs.end_write(result)
+            now = time.monotonic()
+            self._controller.record(n, now - started, now)
+            sent += n
+            self.confirmed_offset = sent
+            if snapshot is not None:  # None when the hasher is left out
+                self.confirmed_digest = snapshot
+            self.stats.bytes_written = sent
+            self.stats.writes += 1
+            if bytes_sent_cb:
+                bytes_sent_cb(sent)
+
+        while True:
+            item = self._get(to_write)
+            if isinstance(item, _StageFailed):
+                raise item.error
+            if isinstance(item, _EndOfFile):
+                break
+
+            offset, buf, n = item[:3]
+            snapshot = item[3] if len(item) > 3 else None
+            in_flight.append((rfs.begin_write(buf, offset, n), n, time.monotonic(), snapshot))
+            while len(in_flight) >= self._max_in_flight:
+                complete_oldest()
+
+        while in_flight:
+            complete_oldest()
+        logger.debug(f"Pipelined upload wrote {sent} bytes in {self.stats.writes} writes")
@@ -0,0 +1,147 @@
+// Resumable upload of one fileset (a file or a file pair) to the server in chunks.
+// The server keeps the session on disk, so after an interruption only the missing
+// chunks are sent again, also after a page reload (the upload id is kept in localStorage).
+// Chunks are sent in parallel through a TransferScheduler, which owns the 429 handling.
+
+import { TransferScheduler } from "./transfer_scheduler.js";
+
+const uploadsUrl = '/uploads';
+const MAX_CHUNK_RETRIES = 8;
+const RETRY_BASE_DELAY_MS = 1000;
+const RETRY_MAX_DELAY_MS = 30000;
+
+export class UploadError extends Error {
+    constructor(message, status, retryAfter = null) {
+        super(message);
+        this.status = status;
+        this.retryAfter = retryAfter; // seconds, from the Retry-After header
+    }
+}
+
+function sleep(ms) {
+    return new Promise(resolve => setTimeout(resolve, ms));
+}
+
+function resumeKey(files) {
+    return "chunked_upload:" + files.map(f => `${f.name}:${f.size}:${f.lastModified}`).join("|");
+}
+
+async function jsonOrThrow(response) {
+    let data = {};
+    try {
+        data = await response.json();
+    } catch (e) {
+        // empty or non json body
+    }
+    if (!response.ok) {
+        const retryAfter = parseInt(response.headers.get('Retry-After'), 10);
+        throw new UploadError(data.error || data.status || `Server returned ${response.status}`, response.status,
+            Number.isNaN(retryAfter) ? null : retryAfter);
+    }
+    return data;
+}
+
+async function createSession(files, keyValuePairs) {
+    const response = await fetch(uploadsUrl, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+            keyValuePairs: keyValuePairs,
+            files: files.map(f => ({ name: f.name, size: f.size })),
+        }),
+    });
+    return jsonOrThrow(response);
+}
+
+async function getStatus(uploadId) {
+    const response = await fetch(`${uploadsUrl}/${uploadId}`);
+    return jsonOrThrow(response);
+}
+
+async function putChunk(uploadId, fileIndex, chunkIndex, blob) {
+    for (let attempt = 0; ; attempt++) {
+        let response = null;
+        try {
+            response = await fetch(`${uploadsUrl}/${uploadId}/files/${fileIndex}/chunks/${chunkIndex}`, {
+                method: 'PUT',
+                headers: { 'Content-Type': 'application/octet-stream' },
+                body: blob,
+            });
+        } catch (error) {
+            // network error, e.g. a dropped connection
+            if (attempt >= MAX_CHUNK_RETRIES) {
+                throw error;
+            }
+            console.log(`Chunk ${chunkIndex} failed (${error}), retrying`);
+        }
+        if (response) {
+            if (response.ok) {
+                return;
+            }
+            const retryable = (response.status >= 500 && response.status !== 507) || response.status === 408;
+            if (!retryable || attempt >= MAX_CHUNK_RETRIES) {
+                await jsonOrThrow(response);
+            }
+        }
+        await sleep(Math.min(RETRY_BASE_DELAY_MS * 2 ** attempt, RETRY_MAX_DELAY_MS));
+    }
+}
+
+async function finalize(uploadId) {
+    const response = await fetch(`${uploadsUrl}/${uploadId}/finalize`, { method: 'POST' });
+    return jsonOrThrow(response);
+}
+
+// Upload files as one import. onProgress(fileName, percent) is called as chunks are confirmed.
+// Share one scheduler between concurrent filesets to bound the requests in flight.
+export async function uploadFileset(files, keyValuePairs, onProgress = null, scheduler = new TransferScheduler()) {
+    const key = resumeKey(files);
+    let uploadId = localStorage.getItem(key);
+    let status = null;
+
+    if (uploadId) {
+        try {
+            status = await getStatus(uploadId);
+            console.log(`Resuming upload ${uploadId}`);
+        } catch (error) {
+            if (!(error instanceof UploadError) || (error.status !== 404 && error.status !== 403)) {
+                throw error;
+            }
+            localStorage.removeItem(key); // expired or from another login, start over
+        }
+    }
+    if (!status) {
+        const created = await createSession(files, keyValuePairs);
+        uploadId = created.upload_id;
+        localStorage.setItem(key, uploadId);
+        status = await getStatus(uploadId);
+    }
+
+    const chunkSize = status.chunk_size;
+    const transfers = [];
+    for (const [fileIndex, file] of files.entries()) {
+        const entry = status.files[fileIndex];
+        let done = entry.chunks - entry.missing.length;
+        if (onProgress) {
+            onProgress(file.name, Math.floor(100 * done / entry.chunks));
+        }
+        for (const chunkIndex of entry.missing) {
+            const start = chunkIndex * chunkSize;
+            const blob = file.slice(start, Math.min(start + chunkSize, file.size));
+            transfers.push(scheduler.run(blob.size, () => putChunk(uploadId, fileIndex, chunkIndex, blob)).then(() => {
+                done++;
+                if (onProgress) {
+                    onProgress(file.name, Math.floor(100 * done / entry.chunks));
+                }
+            }));
+        }
+    }
+    const failed = (await Promise.allSettled(transfers)).find(r => r.status === 'rejected');
+    if (failed) {
+        throw failed.reason;
+    }
+
+    const result = await finalize(uploadId);
+    localStorage.removeItem(key);
+    return result;
+}
@@ -1,12 +1,16 @@
 import { fetchWrapper, showErrorPage } from "./utils.js";
 import { updateFileStatus, addFilesToList, getFileListForImport, nrFilesForUpload, clearFileList, setFileListChangeCB, updateRetryStatus, setAllPendingToError} from "./file_list.js";
 import { FileStatus } from "./file_list_component.js";
+import { uploadFileset, UploadError } from "./chunked_upload.js";
+import { TransferScheduler } from "./transfer_scheduler.js";
 
 document.addEventListener('DOMContentLoaded', () => {
     const keysEndpoint = '/get_existing_tags';
     const formatsEndPoint = '/supported_file_formats';
     const importImagesUrl = '/import_images';
     const importUpdateStream = '/sse/import_updates'
+    // Chunk requests in flight, adapted between min and max. Browsers open at most 6 HTTP/1.1 connections per host.
+    const transferWindow = { initialWindow: 2, minWindow: 1, maxWindow: 6 };
     const interactiveKeyDropdown = document.getElementById('interactive-key-dropdown');
     const interactiveNewInput = document.getElementById('interactive-new-input');
     const interactiveExistingDropdown = document.getElementById('interactive-existing-dropdown');
@@ -235,37 +239,40 @@ document.addEventListener('DOMContentLoaded', () => {
 
     async function uploadFiles(files) 
     {
-        try 
-        {
-            const keyValuePairs = JSON.parse(localStorage.getItem('keyValuePairs') || '[]');
-            for (const file of files) {
-                const formData = new FormData();
-                formData.append('keyValuePairs', JSON.stringify(keyValuePairs));
+        const keyValuePairs = JSON.parse(localStorage.getItem('keyValuePairs') || '[]');
+        const scheduler = new TransferScheduler(transferWindow);
+        const pending = [...files];
+        let cancelled = false;
+        files.forEach(file => file.forEach(f => updateFileStatus(f.name, FileStatus.QUEUED, "")));
+
+        // Several filesets at a time so that folders of small files fill the transfer window,
+        // the scheduler decides how many chunk requests actually run.
+        async function uploadWorker() {
+            while (!cancelled && pending.length > 0) {
+                const file = pending.shift();
                 const fileNames = file.map(fi => fi.name);
-                    file.forEach(f => {
-                        formData.append('files', f);
-                        updateFileStatus(f.name, FileStatus.QUEUED, "");
-                    });
+                try {
                     // Only this function "waits" here, not the whole UI
-                    const response = await fetch(importImagesUrl, {
-                        method: 'POST',
-                        body: formData,
-                    });
-                    if(response.status === 504){
-                        console.log("Gateway timeout from server, but we dont care...");
-                    }
-                    if(response.status === 507){
-                        const errorData = await response.json();
-                        console.log(`${errorData.status}`);
-                        updateFileStatus(fileNames[0],FileStatus.ERROR, errorData.status);
-                    }
-                    else if(!response.ok){
-                        console.log("Server returned error status: " + response.status);
-                    }
-                    else{
-                        const data = await response.json();
-                        console.log(`Files ${fileNames} sent to server. Response status: ${data.status}`);
+                    const data = await uploadFileset(file, keyValuePairs,
+                        (name, percent) => updateFileStatus(name, FileStatus.STAGING, percent + "%"), scheduler);
+                    console.log(`Files ${fileNames} sent to server. Response status: ${data.status}`);
+                } catch (error) {
+                    if (!(error instanceof UploadError)) {
+                        cancelled = true;
+                        throw error; // network gone for good, stop the whole import
                     }
+                    console.log(`Upload of ${fileNames} failed: ${error.message} (${error.status})`);
+                    updateFileStatus(fileNames[0], FileStatus.ERROR, error.message);
+                }
+            }
+        }
+
+        try 
+        {
+            const workers = Array.from({ length: Math.min(transferWindow.maxWindow, files.length) }, uploadWorker);
+            const failed = (await Promise.allSettled(workers)).find(r => r.status === 'rejected');
+            if (failed) {
+                throw failed.reason;
             }
         } catch(error) {
             console.log(error)
@@ -0,0 +1,98 @@
+// Runs upload requests concurrently within a window that adapts to the connection.
+// The window grows by one after every round of transfers that was not slower than the
+// previous round, shrinks by one when the throughput drops, and is halved when the
+// server answers 429 (too busy), after which new requests wait for its Retry-After.
+
+const MAX_THROTTLED_RETRIES = 20;
+const DEFAULT_RETRY_AFTER_MS = 1000;
+
+export class TransferScheduler {
+    constructor({ initialWindow = 2, minWindow = 1, maxWindow = 6 } = {}) {
+        this.minWindow = minWindow;
+        this.maxWindow = maxWindow;
+        this.window = Math.min(Math.max(initialWindow, minWindow), maxWindow);
+        this.queue = [];
+        this.active = 0;
+        this.pausedUntil = 0;
+        this.timer = null;
+        this.lastRate = 0;
+        this._startRound();
+    }
+
+    // Run task (returning a promise) once a slot in the window is free, bytes is what it transfers.
+    // A task rejected with status 429 is queued again, other errors are passed on.
+    run(bytes, task) {
+        return new Promise((resolve, reject) => {
+            this.queue.push({ bytes, task, resolve, reject, throttled: 0 });
+            this._pump();
+        });
+    }
+
+    _pump() {
+        const wait = this.pausedUntil - Date.now();
+        if (wait > 0) {
+            if (!this.timer) {
+                this.timer = setTimeout(() => {
+                    this.timer = null;
+                    this._pump();
+                }, wait);
+            }
+            return;
+        }
+        while (this.active < this.window && this.queue.length > 0) {
+            this._start(this.queue.shift());
+        }
+    }
+
+    async _start(job) {
+        this.active++;
+        try {
+            const result = await job.task();
+            this._completed(job.bytes);
+            job.resolve(result);
+        } catch (error) {
+            if (error && error.status === 429 && job.throttled++ < MAX_THROTTLED_RETRIES) {
+                this._throttled(error.retryAfter);
+                this.queue.unshift(job);
+            } else {
+                job.reject(error);
+            }
+        } finally {
+            this.active--;
+            this._pump();
+        }
+    }
+
+    _startRound() {
+        this.roundStart = performance.now();
+        this.roundBytes = 0;
+        this.roundDone = 0;
+    }
+
+    _completed(bytes) {
+        this.roundBytes += bytes;
+        this.roundDone++;
+        if (this.roundDone < this.window) {
+            return;
+        }
+        const seconds = Math.max((performance.now() - this.roundStart) / 1000, 0.001);
+        const rate = this.roundBytes / seconds;
+        if (rate < this.lastRate * 0.8) {
+            this.window = Math.max(this.window - 1, this.minWindow);
+        } else if (rate >= this.lastRate * 0.95) {
+            this.window = Math.min(this.window + 1, this.maxWindow);
+        }
+        console.log(`Transfer rate ${(rate / 1e6).toFixed(1)} MB/s, window ${this.window}`);
+        this.lastRate = rate;
+        this._startRound();
+    }
+
+    _throttled(retryAfterSec) {
+        this.window = Math.max(Math.floor(this.window / 2), this.minWindow);
+        const delay = retryAfterSec ? retryAfterSec * 1000 : DEFAULT_RETRY_AFTER_MS;
+        this.pausedUntil = Math.max(this.pausedUntil, Date.now() + delay);
+        this.lastRate = 0; // the next round sets a new baseline
+        this._startRound();
+        console.log(`Server busy, transfer window ${this.window}, pausing ${delay} ms`);
+    }
+}
@@ -0,0 +1,74 @@
+import io
+from common.buffer_pool import BufferPool, get_buffer_pool, readinto
+from common.logger import logging
+
+
+class _ReadOnlyStream:
+    """Stream without readinto, like some werkzeug wrappers"""
+
+    def __init__(self, data: bytes):
+        self._stream = io.BytesIO(data)
+
+    def read(self, size: int = -1) -> bytes:
+        return self._stream.read(size)
+
+
+class TestBufferPool:
+
+    @classmethod
+    def setup_class(cls):
+        logging.getLogger().info(f"Starting {cls.__name__}")
+
+    @classmethod
+    def teardown_class(cls):
+        logging.getLogger().info(f"Stopping {cls.__name__}")
+
+    def test_release_and_reuse(self):
+        pool = BufferPool()
+        buf = pool.acquire(1024)
+        assert len(buf) == 1024
+        pool.release(buf)
+        assert pool.idle_count(1024) == 1
+        assert pool.acquire(1024) is buf
+        assert pool.acquire(2048) is not buf
+
+    def test_max_idle_bytes(self):
+        pool = BufferPool(max_idle_bytes=40)
+        for buf in [pool.acquire(16) for _ in range(4)]:
+            pool.release(buf)
+        assert pool.idle_count(16) == 2
+        assert pool.idle_bytes() == 32
+        pool.release(bytearray(64))  # larger than the whole pool
+        assert pool.idle_count(64) == 0
+        assert pool.idle_count(16) == 2
+
+    def test_stale_sizes_are_dropped(self):
+        pool = BufferPool(max_idle_bytes=48)
+        pool.release(bytearray(16))
+        pool.release(bytearray(16))
+        pool.release(bytearray(32))
+        assert pool.idle_count(16) == 0
+        assert pool.idle_count(32) == 1
+        assert pool.idle_bytes() == 32
+
+    def test_borrow_releases_on_error(self):
+        pool = BufferPool()
+        try:
+            with pool.borrow(64):
+                raise RuntimeError("write failed")
+        except RuntimeError:
+            pass
+        assert pool.idle_count(64) == 1
+
+    def test_readinto(self):
+        data = bytes(range(200))
+        view = memoryview(bytearray(128))
+        for stream in (io.BytesIO(data), _ReadOnlyStream(data)):
+            assert readinto(stream, view) == 128
+            assert bytes(view) == data[:128]
+            assert readinto(stream, view) == 72
+            assert bytes(view[:72]) == data[128:]
+            assert readinto(stream, view) == 0
+
+    def test_process_pool_is_shared(self):
+        assert get_buffer_pool() is get_buffer_pool()
@@ -0,0 +1,51 @@
+import time
+from common.caching import TTLCache
+from common.logger import logging
+
+
+class TestTTLCache:
+
+    @classmethod
+    def setup_class(cls):
+        logging.getLogger().info(f"Starting {cls.__name__}")
+
+    @classmethod
+    def teardown_class(cls):
+        logging.getLogger().info(f"Stopping {cls.__name__}")
+
+    def test_get_set(self):
+        cache = TTLCache(ttl=60)
+        assert cache.get("a") is None
+        assert cache.get("a", 5) == 5
+        cache.set("a", 1)
+        assert cache.get("a") == 1
+        assert len(cache) == 1
+
+    def test_expiry(self):
+        cache = TTLCache(ttl=0.01)
+        cache.set("a", 1)
+        time.sleep(0.05)
+        assert cache.get("a") is None
+        assert len(cache) == 0
+
+    def test_lru_bound(self):
+        cache = TTLCache(ttl=None, maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")  # a is now most recently used
+        cache.set("c", 3)
+        assert cache.get("a") == 1
+        assert cache.get("b") is None
+        assert cache.get("c") == 3
+
+    def test_invalidate(self):
+        cache = TTLCache(ttl=60)
+        cache.set((1, "x"), 1)
+        cache.set((1, "y"), 2)
+        cache.set((2, "x"), 3)
+        cache.invalidate(lambda k: k[0] == 1)  # type: ignore
+        assert cache.get((1, "x")) is None
+        assert cache.get((1, "y")) is None
+        assert cache.get((2, "x")) == 3
+        assert cache.pop((2, "x")) == 3
+        assert len(cache) == 0
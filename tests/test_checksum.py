@@ -0,0 +1,52 @@
+import hashlib
+import time
+import pytest
+from common import checksum
+from common.logger import logging
+
+
+class TestChecksum:
+
+    @classmethod
+    def setup_class(cls):
+        logging.getLogger().info(f"Starting {cls.__name__}")
+
+    @classmethod
+    def teardown_class(cls):
+        logging.getLogger().info(f"Stopping {cls.__name__}")
+
+    def test_file_checksum_sha1(self, tmp_path):
+        data = b"omero" * 100_000
+        path = tmp_path / "image.czi"
+        path.write_bytes(data)
+        assert checksum.file_checksum(str(path), checksum.SHA1_160) == hashlib.sha1(data).hexdigest()
+        assert checksum.file_checksum(str(path), checksum.MD5_128) == hashlib.md5(data).hexdigest()
+
+    def test_32_bit_checksums_are_little_endian_hex(self):
+        crc = checksum.new_checksum(checksum.CRC_32)
+        crc.update(b"12345")
+        partial = crc.copy()
+        crc.update(b"6789")
+        assert crc.hexdigest() == "2639f4cb"  # crc32 0xCBF43926
+        partial.update(b"6789")
+        assert partial.hexdigest() == crc.hexdigest()
+
+        adler = checksum.new_checksum(checksum.ADLER_32)
+        adler.update(b"Wikipedia")
+        assert adler.hexdigest() == "9803e611"  # adler32 0x11E60398
+
+    def test_unsupported_algorithm(self):
+        with pytest.raises(ValueError):
+            checksum.new_checksum("xxHash-64")
+
+    @pytest.mark.manual
+    def test_benchmark_cpu_per_gb(self):
+        block = bytes(range(256)) * 4096  # 1 MiB
+        mib = 512
+        for algorithm in checksum.supported_algorithms():
+            digest = checksum.new_checksum(algorithm)
+            start = time.process_time()
+            for _ in range(mib):
+                digest.update(block)
+            cpu = time.process_time() - start
+            logging.getLogger().info(f"{algorithm:>9}: {cpu * 1024 / mib:.2f} CPU s/GiB")
@@ -0,0 +1,145 @@
+import io
+import os
+import pytest
+from omerofrontend.chunked_upload import ChunkedUploadStore
+from omerofrontend.exceptions import ImageNotSupported, UploadSessionError
+from common.logger import logging
+from common import conf
+
+CHUNK = 4
+TOKEN = "token-a"
+USER = "ragnar"
+
+
+class TestChunkedUploadStore:
+
+    @classmethod
+    def setup_class(cls):
+        logging.getLogger().info(f"Starting {cls.__name__}")
+
+    @classmethod
+    def teardown_class(cls):
+        logging.getLogger().info(f"Stopping {cls.__name__}")
+
+    @pytest.fixture(autouse=True)
+    def upload_folder(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(conf, "UPLOAD_FOLDER", str(tmp_path))
+        return tmp_path
+
+    def _put(self, store, upload_id, file_index, chunk_index, data, token=TOKEN):
+        return store.write_chunk(upload_id, token, file_index, chunk_index, io.BytesIO(data), len(data))
+
+    def test_out_of_order_chunks_are_assembled(self):
+        store = ChunkedUploadStore(chunk_size=CHUNK)
+        data = b"0123456789"
+        upload_id = store.create([{"name": "a.czi", "size": len(data)}], USER, TOKEN, [["k", "v"]])["upload_id"]
+
+        self._put(store, upload_id, 0, 2, data[8:])
+        self._put(store, upload_id, 0, 0, data[:4])
+        assert store.status(upload_id, TOKEN)["files"][0]["missing"] == [1]
+        assert self._put(store, upload_id, 0, 1, data[4:8]) == 3
+
+        fileData, pairs, _ = store.finalize(upload_id, TOKEN)
+        path = fileData.getTempFilePaths()[0]
+        with open(path, "rb") as f:
+            assert f.read() == data
+        assert fileData.getFileSizes() == [len(data)]
+        assert pairs == [["k", "v"]]
+        assert not [n for n in os.listdir(os.path.dirname(path)) if n.endswith(".part")]
+
+    def test_resend_chunk_is_idempotent(self):
+        store = ChunkedUploadStore(chunk_size=CHUNK)
+        upload_id = store.create([{"name": "a.czi", "size": 6}], USER, TOKEN, [])["upload_id"]
+        self._put(store, upload_id, 0, 0, b"abcd")
+        assert self._put(store, upload_id, 0, 0, b"abcd") == 1
+
+    def test_finalize_incomplete(self):
+        store = ChunkedUploadStore(chunk_size=CHUNK)
+        upload_id = store.create([{"name": "a.czi", "size": 6}], USER, TOKEN, [])["upload_id"]
+        self._put(store, upload_id, 0, 0, b"abcd")
+        with pytest.raises(UploadSessionError) as excinfo:
+            store.finalize(upload_id, TOKEN)
+        assert excinfo.value.status == 409
+
+    def test_wrong_chunk_size(self):
+        store = ChunkedUploadStore(chunk_size=CHUNK)
+        upload_id = store.create([{"name": "a.czi", "size": 6}], USER, TOKEN, [])["upload_id"]
+        with pytest.raises(UploadSessionError) as excinfo:
+            self._put(store, upload_id, 0, 1, b"abc")
+        assert excinfo.value.status == 400
+
+    def test_other_token_rejected(self):
+        store = ChunkedUploadStore(chunk_size=CHUNK)
+        upload_id = store.create([{"name": "a.czi", "size": 6}], USER, TOKEN, [])["upload_id"]
+        with pytest.raises(UploadSessionError) as excinfo:
+            store.status(upload_id, "token-b")
+        assert excinfo.value.status == 403
+
+    def test_unknown_upload(self):
+        store = ChunkedUploadStore(chunk_size=CHUNK)
+        with pytest.raises(UploadSessionError) as excinfo:
+            store.status("0123abcd", TOKEN)
+        assert excinfo.value.status == 404
+        with pytest.raises(UploadSessionError):
+            store.status("../etc", TOKEN)
+
+    def test_unsupported_format(self):
+        store = ChunkedUploadStore(chunk_size=CHUNK)
+        with pytest.raises(ImageNotSupported):
+            store.create([{"name": "a.jpg", "size": 6}], USER, TOKEN, [])
+
+    def test_abort_removes_parts(self, upload_folder):
+        store = ChunkedUploadStore(chunk_size=CHUNK)
+        upload_id = store.create([{"name": "a.czi", "size": 6}], USER, TOKEN, [])["upload_id"]
+        store.abort(upload_id, TOKEN)
+        with pytest.raises(UploadSessionError):
+            store.status(upload_id, TOKEN)
+        assert os.listdir(upload_folder / USER) == []  # part files and the staging directory are gone
+
+    def test_expired_sessions_are_purged(self):
+        store = ChunkedUploadStore(chunk_size=CHUNK, ttl=-1)
+        upload_id = store.create([{"name": "a.czi", "size": 6}], USER, TOKEN, [])["upload_id"]
+        store.purge_expired()
+        with pytest.raises(UploadSessionError) as excinfo:
+            store.status(upload_id, TOKEN)
+        assert excinfo.value.status == 404
+
+    def test_busy_store_refuses_chunks(self):
+        store = ChunkedUploadStore(chunk_size=CHUNK, max_concurrent_writes=1)
+        upload_id = store.create([{"name": "a.czi", "size": 6}], USER, TOKEN, [])["upload_id"]
+        store._write_slots.acquire()  # another request is writing
+        with pytest.raises(UploadSessionError) as excinfo:
+            self._put(store, upload_id, 0, 0, b"abcd")
+        assert excinfo.value.status == 429
+        store._write_slots.release()
+        assert self._put(store, upload_id, 0, 0, b"abcd") == 1
+
+    def test_file_size_limit(self):
+        store = ChunkedUploadStore(chunk_size=CHUNK, max_file_size=10)
+        with pytest.raises(UploadSessionError) as excinfo:
+            store.create([{"name": "a.czi", "size": 11}], USER, TOKEN, [])
+        assert excinfo.value.status == 413
+
+    def test_user_quota(self):
+        store = ChunkedUploadStore(chunk_size=CHUNK, max_user_bytes=10)
+        upload_id = store.create([{"name": "a.czi", "size": 6}], USER, TOKEN, [])["upload_id"]
+        with pytest.raises(UploadSessionError) as excinfo:
+            store.create([{"name": "b.czi", "size": 6}], USER, TOKEN, [])
+        assert excinfo.value.status == 507
+        store.create([{"name": "b.czi", "size": 6}], "other", "token-b", [])  # the quota is per user
+        store.abort(upload_id, TOKEN)
+        store.create([{"name": "b.czi", "size": 6}], USER, TOKEN, [])
+
+    def test_expiry_counts_from_last_chunk(self, monkeypatch):
+        store = ChunkedUploadStore(chunk_size=CHUNK, ttl=100, purge_interval=0)
+        clock = [1000.0]
+        monkeypatch.setattr("time.time", lambda: clock[0])
+        upload_id = store.create([{"name": "a.czi", "size": 6}], USER, TOKEN, [])["upload_id"]
+        clock[0] += 90
+        self._put(store, upload_id, 0, 0, b"abcd")
+        clock[0] += 90  # 180 s after creation, 90 s after the last chunk
+        assert store.status(upload_id, TOKEN)["files"][0]["missing"] == [1]
+        clock[0] += 20
+        with pytest.raises(UploadSessionError) as excinfo:
+            store.status(upload_id, TOKEN)  # purged by the request itself
+        assert excinfo.value.status == 404
@@ -0,0 +1,117 @@
+import threading
+import time
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import Future
+from common.concurrency import SingleFlight, gather, then
+from common.logger import logging
+
+
+class TestSingleFlight:
+
+    @classmethod
+    def setup_class(cls):
+        logging.getLogger().info(f"Starting {cls.__name__}")
+
+    @classmethod
+    def teardown_class(cls):
+        logging.getLogger().info(f"Stopping {cls.__name__}")
+
+    def test_concurrent_calls_share_one_execution(self):
+        sf = SingleFlight()
+        calls = []
+        started = threading.Event()
+
+        def create():
+            calls.append(1)
+            started.set()
+            time.sleep(0.1)
+            return 55
+
+        with ThreadPoolExecutor(max_workers=4) as ex:
+            first = ex.submit(sf.do, "project", create)
+            started.wait()
+            others = [ex.submit(sf.do, "project", create) for _ in range(3)]
+            results = [first.result()] + [f.result() for f in others]
+
+        assert results == [55, 55, 55, 55]
+        assert len(calls) == 1
+
+    def test_exception_is_shared_and_key_released(self):
+        sf = SingleFlight()
+
+        def fail():
+            raise ValueError("no project")
+
+        with pytest.raises(ValueError):
+            sf.do("project", fail)
+        assert sf.do("project", lambda: 1) == 1
+
+    def test_different_keys_run_independently(self):
+        sf = SingleFlight()
+        assert sf.do("a", lambda: 1) == 1
+        assert sf.do("b", lambda: 2) == 2
+
+
+class TestFutureHelpers:
+
+    @classmethod
+    def setup_class(cls):
+        logging.getLogger().info(f"Starting {cls.__name__}")
+
+    @classmethod
+    def teardown_class(cls):
+        logging.getLogger().info(f"Stopping {cls.__name__}")
+
+    def test_then_maps_result_when_done(self):
+        f: Future = Future()
+        chained = then(f, lambda ids: ids + [3])
+        assert not chained.done()
+        f.set_result([1, 2])
+        assert chained.result(timeout=1) == [1, 2, 3]
+
+    def test_then_propagates_errors(self):
+        f: Future = Future()
+        chained = then(f, lambda r: r)
+        f.set_exception(ValueError("import failed"))
+        with pytest.raises(ValueError):
+            chained.result(timeout=1)
+
+        f2: Future = Future()
+        failing = then(f2, lambda r: 1 / 0)
+        f2.set_result(1)
+        with pytest.raises(ZeroDivisionError):
+            failing.result(timeout=1)
+
+    def test_gather_keeps_order(self):
+        futures = [Future(), Future(), Future()]
+        gathered = gather(futures)
+        for i in (2, 0, 1):
+            assert not gathered.done()
+            futures[i].set_result(i)
+        assert gathered.result(timeout=1) == [0, 1, 2]
+        assert gather([]).result(timeout=1) == []
+
+    def test_gather_fails_with_first_error(self):
+        futures = [Future(), Future()]
+        gathered = gather(futures)
+        futures[1].set_exception(ValueError("second"))
+        with pytest.raises(ValueError):
+            gathered.result(timeout=1)
+        futures[0].set_result(0)
+
+    def test_gather_wait_all_fails_once_all_are_done(self):
+        futures = [Future(), Future(), Future()]
+        gathered = gather(futures, wait_all=True)
+        futures[1].set_exception(ValueError("second"))
+        futures[2].cancel()
+        assert not gathered.done()  # the first one is still running
+        futures[0].set_result(0)
+        with pytest.raises(ValueError):
+            gathered.result(timeout=1)
+
+        ok = [Future(), Future()]
+        gathered = gather(ok, wait_all=True)
+        ok[1].set_result(1)
+        ok[0].set_result(0)
+        assert gathered.result(timeout=1) == [0, 1]
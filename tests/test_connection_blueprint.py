@@ -0,0 +1,98 @@
+import threading
+from typing import Any, cast
+from unittest.mock import patch
+from flask import Flask
+from common.omero_connection import OmeroConnection
+from common.omero_getter_ctx import OmeroGetterCtx
+from common.omero_query import OmeroQuery
+from common.logger import logging
+from common import conf
+from omerofrontend.connection_blueprint import conn_bp
+
+
+class OmeroConnection_(OmeroConnection):
+    def __init__(self, user_id: int, group_id: int):
+        self.omero_token = None
+        self.conn = cast(Any, None)
+        self._mutex = threading.RLock()
+        self.user_id = user_id
+        self.group_id = group_id
+
+    def get_user_id(self):
+        return self.user_id
+
+    def get_group_id(self) -> int:
+        return self.group_id
+
+
+class ConnectionPool_:
+    """Hands out the connection of the session token"""
+    def __init__(self, connections: dict[str, OmeroConnection]):
+        self.connections = connections
+        self.released: list[OmeroConnection] = []
+
+    def acquire(self, host, port, token, group):
+        return self.connections[token]
+
+    def release(self, conn):
+        self.released.append(conn)
+
+
+class TestConnectionBlueprint:
+
+    @classmethod
+    def setup_class(cls):
+        cls.app = Flask(__name__)
+        cls.app.secret_key = "test"
+        cls.app.register_blueprint(conn_bp)
+        logging.getLogger().info(f"Starting {cls.__name__}")
+
+    @classmethod
+    def teardown_class(cls):
+        logging.getLogger().info(f"Stopping {cls.__name__}")
+
+    def setup_method(self):
+        OmeroGetterCtx._tag_indexes.clear()
+        self.pool = ConnectionPool_({"token-a": OmeroConnection_(1, 5), "token-b": OmeroConnection_(2, 5)})
+
+    def client(self, token: str):
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session[conf.OMERO_SESSION_TOKEN_KEY] = token
+            session[conf.OMERO_SESSION_HOST_KEY] = "localhost"
+            session[conf.OMERO_SESSION_PORT_KEY] = 4064
+        return client
+
+    def test_get_existing_tags_etag(self):
+        client = self.client("token-a")
+        with patch('omerofrontend.connection_blueprint.get_connection_pool', return_value=self.pool), \
+             patch.object(OmeroQuery, 'tag_texts', return_value=["Sample Mouse", "PI Anna"]):
+            response = client.get('/get_existing_tags')
+            assert response.status_code == 200
+            assert response.get_json()["Sample"] == [" Mouse"]
+            assert response.headers["Cache-Control"] == "private, no-cache"
+            etag = response.headers["ETag"]
+
+            # the browser revalidates with the etag and gets no body back
+            response = client.get('/get_existing_tags', headers={"If-None-Match": etag})
+            assert response.status_code == 304
+            assert response.data == b""
+
+            response = client.get('/get_existing_tags', headers={"If-None-Match": '"stale"'})
+            assert response.status_code == 200
+            assert response.headers["ETag"] == etag
+        assert len(self.pool.released) == 3
+
+    def test_get_existing_tags_per_user(self):
+        with patch('omerofrontend.connection_blueprint.get_connection_pool', return_value=self.pool):
+            with patch.object(OmeroQuery, 'tag_texts', return_value=["Sample Mouse"]):
+                response_a = self.client("token-a").get('/get_existing_tags')
+            with patch.object(OmeroQuery, 'tag_texts', return_value=["Sample Zebrafish"]):
+                response_b = self.client("token-b").get('/get_existing_tags')
+                # the etag of another user's index does not match
+                response = self.client("token-b").get('/get_existing_tags', headers={"If-None-Match": response_a.headers["ETag"]})
+
+        assert response_a.get_json()["Sample"] == [" Mouse"]
+        assert response_b.get_json()["Sample"] == [" Zebrafish"]
+        assert response.status_code == 200
+        assert response.get_json()["Sample"] == [" Zebrafish"]
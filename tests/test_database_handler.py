@@ -1,6 +1,7 @@
 import os
 from omerofrontend.database import SqliteDatabaseHandler
 from common import conf
+from common.import_timings import PhaseTiming
 from common.logger import logging 
 
 class TestDatabaseHandler:
@@ -45,6 +46,15 @@ class TestDatabaseHandler:
         assert imports[0][5] == file_count
         assert imports[0][6] == total_file_size_mb
         assert imports[0][7] == import_time_s
+
+
+    def test_insert_import_phases(self):
+        phases = {"transfer": PhaseTiming(12.5, 1024, 1), "verify": PhaseTiming(3.25, 0, 1)}
+        self.sqdbh.insert_import_data("2023-10-01 12:05:00", "testuser", "testgroup", "testscope", 1, 1.0, 16.0, phases=phases)
+
+        import_id = self.sqdbh.get_all_imports()[-1][0]
+        rows = sorted(self.sqdbh.get_import_phases(import_id))
+        assert rows == [("transfer", 12.5, 1024), ("verify", 3.25, 0)]
         
     # def test_get_all_imports(self):
     #     imports = self.sqdbh.get_all_imports()
@@ -2,15 +2,23 @@ from datetime import datetime
 from typing import Any, cast
 from dateutil import parser
 import os.path
+from concurrent.futures import Future
 from unittest.mock import patch
+import pytest
 from werkzeug.datastructures import FileStorage
 from common.file_data import FileData
 from common.omero_connection import OmeroConnection
 from common import image_funcs
 from omerofrontend.file_importer import FileImporter
+from omerofrontend.file_uploader import FileUploader
+from omerofrontend.exceptions import OmeroConnectionError
 from omerofrontend.temp_file_handler import TempFileHandler
 from common.logger import logging
 from common.omero_getter_ctx import OmeroGetterCtx
+from common.omero_query import OmeroQuery
+from common import conf
+from common import checksum
+from omerofrontend.batch_context import BatchContext
 
 class FakeImage:
     def __init__(self, acqt, name = "", id=666):
@@ -31,36 +39,17 @@ class FakeImage:
         return []
 
 
-class FakeDataset:
-    def __init__(self, value, name, children: list[FakeImage] = []):
-        self.value = value
-        self.name = name
-        self.children = children
-        
-    def getValue(self):
-        return self.value
-    
-    def getName(self):
-        return self.name
-    
-    def listChildren(self):
-        return self.children
+def images_in_dataset(*images: FakeImage):
+    """Stand-in for OmeroQuery.dataset_images over a fixed set of images"""
+    def dataset_images(dataset_id):
+        return [(i.getId(), i.getName(), int(i.getAcquisitionDate().timestamp() * 1000)) for i in images]
+    return dataset_images
 
 class OmeroGetterCtx_(OmeroGetterCtx):
     def __init__(self, omero_connection: OmeroConnection):
         super().__init__(omero_connection)
 
 
-class FakeProject:
-    def __init__(self,proj_name, ds_id, ds_name):
-        self._val = proj_name
-        self.ds_id = ds_id
-        self.ds_name = ds_name
-        
-    def listChildren(self):
-        return [FakeDataset(self.ds_id,self.ds_name)]
-
-
 class OmeroConnection_(OmeroConnection):
     def __init__(self, host, port, session_token):
         self.host = host
@@ -142,45 +131,132 @@ class TestFileImporter:
             self.do_file_imports(fileData, metadict, scopes)
             tfh._remove_temp_files(fileData)  # Clean up temp files after test
 
+    def test_group_fileset_paths(self):
+        fileData = FileData(["scan_01.ets", "scan_02.ets", "scan.vsi", "scan.xml"])
+        staged = ["/tmp/u/scan.vsi", "/tmp/u/scan_01.ets", "/tmp/u/scan_02.ets", "/tmp/u/scan.xml"]
+        fileData.setTempFilePaths(staged)
+
+        # staged originals imported as is: one fileset, main file first, xml attachment left out
+        groups = self.fi._group_fileset_paths(fileData, staged[::-1])
+        assert groups == [["/tmp/u/scan.vsi", "/tmp/u/scan_02.ets", "/tmp/u/scan_01.ets"]]
+
+        # converted files are independent images
+        converted = ["/tmp/u/scan_0.ome.tif", "/tmp/u/scan_1.ome.tif"]
+        assert self.fi._group_fileset_paths(fileData, converted) == [[converted[0]], [converted[1]]]
+
+        fileData.setConvertedFileName("scan.vsi")
+        fileData.setCompanionFilePaths(groups[0][1:])
+        assert fileData.getUploadFilePaths() == groups[0]
+
+    def test_converted_outputs_are_imported_apart(self):
+        fileData = FileData(["scan.emd"])
+        fileData.setTempFilePaths(["/tmp/u/scan.emd"])
+        converted = ["/tmp/u/scan_0.ome.tif", "/tmp/u/scan_1.ome.tif"]
+        conn = OmeroConnection_("localhost","5000","")
+        uploaded = []
+
+        def upload_files(fu, fd: FileData, *args):
+            uploaded.append(fd.getUploadFilePaths())
+            done: Future = Future()
+            done.set_result(([len(uploaded)], "gunnar/Undefined/2026-01-01"))
+            return done
+
+        with patch.object(image_funcs, 'file_format_splitter', return_value=(converted, {})), \
+             patch.object(FileImporter, '_check_create_project_and_dataset_', return_value=(66, 55)), \
+             patch.object(FileImporter, '_check_duplicate_file_rename_if_needed', return_value=False), \
+             patch.object(FileImporter, '_index_imported_images'), \
+             patch.object(conf, 'PRE_UPLOAD_DEDUPE_ENABLED', False), \
+             patch.object(FileUploader, 'upload_files', autospec=True, side_effect=upload_files):
+            _, image_ids, _ = self.fi.import_image_data(fileData, BatchContext({}), None, None, None, conn).result(timeout=1)
+
+        # the converted files are temp files now, they still are independent images
+        assert uploaded == [[converted[0]], [converted[1]]]
+        assert image_ids == [1, 2]
+
+    def test_failed_fileset_waits_for_the_others(self):
+        fileData = FileData(["scan.emd"])
+        fileData.setTempFilePaths(["/tmp/u/scan.emd"])
+        converted = ["/tmp/u/scan_0.ome.tif", "/tmp/u/scan_1.ome.tif"]
+        conn = OmeroConnection_("localhost","5000","")
+        first: Future = Future()
+        with patch.object(image_funcs, 'file_format_splitter', return_value=(converted, {})), \
+             patch.object(FileImporter, '_check_create_project_and_dataset_', return_value=(66, 55)), \
+             patch.object(FileImporter, '_check_duplicate_file_rename_if_needed', return_value=False), \
+             patch.object(FileImporter, '_index_imported_images'), \
+             patch.object(conf, 'PRE_UPLOAD_DEDUPE_ENABLED', False), \
+             patch.object(FileUploader, 'upload_files', side_effect=[first, OmeroConnectionError("connection lost")]):
+            imported = self.fi.import_image_data(fileData, BatchContext({}), None, None, None, conn)
+
+        # the first fileset is still imported through conn, the caller must not release it yet
+        assert not imported.done()
+        first.set_result(([12], "gunnar/Undefined/2026-01-01"))
+        with pytest.raises(OmeroConnectionError):
+            imported.result(timeout=1)
+
     def do_file_imports(self, fileData: FileData, metadict, scopes):
 
         conn = OmeroConnection_("localhost","5000","")
         dataset = None
         now = datetime.now() # current date and time
         date_time = now.strftime("%m/%d/%Y, %H:%M:%S")
-        with patch.object(conn,'_get_object', return_value=FakeProject(date_time,66,"66")), patch.object(conn,'get_user_id',return_value=22):
-            dataset, _ = self.fi._check_create_project_and_dataset_(scopes[0],date_time, conn)
+        with patch.object(OmeroQuery,'project_ids_by_name', return_value=[]), patch.object(OmeroQuery,'dataset_ids_by_name', return_value=[66]), patch.object(conn,'get_user_id',return_value=22), patch.object(conn,'get_group_id',return_value=3):
+            dataset, project = self.fi._check_create_project_and_dataset_(scopes[0],date_time, conn)
             assert(dataset == 66)
+            assert(project == 55)
             
         #conn2 = OmeroConnection_("localhost","5000","")
         fname = fileData.getConvertedFileName()
-        with patch.object(conn,'_get_object', return_value=FakeDataset(12,"12")):
-            isDup = self.fi._check_duplicate_file_rename_if_needed(fileData,dataset,metadict,conn)
+        with patch.object(OmeroQuery,'dataset_images', return_value=[]), patch.object(OmeroQuery,'dataset_image_map_values', return_value=[]):
+            isDup = self.fi._check_duplicate_file_rename_if_needed(fileData,dataset,metadict,BatchContext({}),conn)
             assert(not isDup)
             assert(fname == fileData.getConvertedFileName())
 
         acquisition_date_time = acquisition_date_time = parser.parse(metadict['Acquisition date'])
         dup_img = FakeImage(acquisition_date_time,fname,12)
-        with patch.object(conn,'get_image', return_value=dup_img), patch.object(conn,'get_dataset', return_value=FakeDataset(66,"66", [dup_img])):
-            isDup = self.fi._check_duplicate_file_rename_if_needed(fileData,dataset,metadict,conn)
+        with patch.object(OmeroQuery,'dataset_images', side_effect=images_in_dataset(dup_img)), patch.object(OmeroQuery,'dataset_image_map_values', return_value=[]):
+            isDup = self.fi._check_duplicate_file_rename_if_needed(fileData,dataset,metadict,BatchContext({}),conn)
             assert(isDup)
             assert(fname == fileData.getConvertedFileName())
 
         suffixed_name = self.fi._build_time_suffixed_name(fname, acquisition_date_time)
         dup_suffixed_img = FakeImage(acquisition_date_time,suffixed_name,13)
-        with patch.object(conn,'get_image', return_value=dup_suffixed_img), patch.object(conn,'get_dataset', return_value=FakeDataset(66,"66", [dup_suffixed_img])):
-            isDup = self.fi._check_duplicate_file_rename_if_needed(fileData,dataset,metadict,conn)
+        with patch.object(OmeroQuery,'dataset_images', side_effect=images_in_dataset(dup_suffixed_img)), patch.object(OmeroQuery,'dataset_image_map_values', return_value=[]):
+            isDup = self.fi._check_duplicate_file_rename_if_needed(fileData,dataset,metadict,BatchContext({}),conn)
+            assert(isDup)
+            assert(fname == fileData.getConvertedFileName())
+
+        # stored acquisition date differs but the 'Acquisition date' map value matches
+        other_time_img = FakeImage(now,fname,14)
+        stored_value = acquisition_date_time.strftime(conf.DATE_TIME_FMT)
+        with patch.object(OmeroQuery,'dataset_images', side_effect=images_in_dataset(other_time_img)), patch.object(OmeroQuery,'dataset_image_map_values', return_value=[(14, stored_value)]):
+            isDup = self.fi._check_duplicate_file_rename_if_needed(fileData,dataset,metadict,BatchContext({}),conn)
             assert(isDup)
             assert(fname == fileData.getConvertedFileName())
 
-            
         ndup_img = FakeImage(now,fname,12)
-        with patch.object(conn,'get_image', return_value=ndup_img),patch.object(conn,'get_dataset', return_value=FakeDataset(66,"66",[ndup_img])):
+        batch = BatchContext({})
+        with patch.object(OmeroQuery,'dataset_images', side_effect=images_in_dataset(ndup_img)) as dataset_images, patch.object(OmeroQuery,'dataset_image_map_values', return_value=[]):
             acquisition_date_time = parser.parse(metadict['Acquisition date'])
-            isDup = self.fi._check_duplicate_file_rename_if_needed(fileData,dataset,metadict,conn)
+            isDup = self.fi._check_duplicate_file_rename_if_needed(fileData,dataset,metadict,batch,conn)
             assert(not isDup)
             new_file_name = self.fi._build_time_suffixed_name(fname, acquisition_date_time)
             assert(new_file_name == fileData.getConvertedFileName())
             assert(fileData.getBasePath() + "/" + new_file_name == fileData.getConvertedFilePath())
             assert( os.path.isfile(fileData.getConvertedFilePath()))
-            
+
+            # the renamed file was imported, the batch index knows it without asking OMERO again
+            self.fi._add_imported_images_to_index(fileData.getConvertedFileName(),dataset,metadict,[15],batch,conn)
+            isDup = self.fi._check_duplicate_file_rename_if_needed(fileData,dataset,metadict,batch,conn)
+            assert(isDup)
+            assert(dataset_images.call_count == 1)
+
+        # identical content already imported under another name
+        upload_path = fileData.getUploadFilePath()
+        with patch.object(OmeroQuery,'imported_file_ids_by_hash', return_value=[]) as by_hash:
+            assert(not self.fi._check_duplicate_content(fileData,conn))
+            file_hash, size, algorithm = by_hash.call_args.args
+            assert(file_hash == checksum.file_checksum(upload_path))
+            assert(algorithm == conf.UPLOAD_CHECKSUM_ALGORITHM)
+            assert(size == os.path.getsize(upload_path))
+        with patch.object(OmeroQuery,'imported_file_ids_by_hash', return_value=[7]):
+            assert(self.fi._check_duplicate_content(fileData,conn))
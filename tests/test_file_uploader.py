@@ -0,0 +1,103 @@
+import os
+import time
+from unittest.mock import MagicMock, patch
+from common.file_data import FileData
+from common import checksum
+from common import conf
+from common import image_funcs
+from common.logger import logging
+from omerofrontend.file_importer import FileImporter
+from omerofrontend.file_uploader import FileUploader, _ImportProcess
+
+
+class FakeRawFileStore:
+    """Uploader of one fileset entry, slowed down by latency per write"""
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.data = bytearray()
+        self.closed = False
+
+    def begin_write(self, buf, offset, length):
+        if len(self.data) < offset + length:
+            self.data.extend(b"\0" * (offset + length - len(self.data)))
+        self.data[offset:offset + length] = buf
+        return offset
+
+    def end_write(self, result):
+        time.sleep(self.latency)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeImportProcess:
+    def __init__(self, latencies: list[float]):
+        self.uploaders: dict[int, FakeRawFileStore] = {}
+        self.latencies = latencies
+
+    def getUploader(self, idx: int):
+        self.uploaders[idx] = FakeRawFileStore(self.latencies[idx])
+        return self.uploaders[idx]
+
+
+class TestFileUploader:
+
+    @classmethod
+    def setup_class(cls):
+        logging.getLogger().info(f"Starting {cls.__name__}")
+
+    @classmethod
+    def teardown_class(cls):
+        logging.getLogger().info(f"Stopping {cls.__name__}")
+
+    def _fileset(self, tmp_path) -> tuple[FileData, list[str]]:
+        sizes = {"scan.emi": 3 * 1024 * 1024 + 17, "scan_1.ser": 512 * 1024, "scan_2.ser": 1536 * 1024 + 3}
+        paths = []
+        for i, (name, size) in enumerate(sizes.items()):
+            path = tmp_path / name
+            path.write_bytes(bytes((i + j) % 251 for j in range(size)))
+            paths.append(str(path))
+        fileData = FileData(list(sizes))
+        fileData.setTempFilePaths(paths)
+        fileData.setCompanionFilePaths(paths[1:])
+        return fileData, paths
+
+    def test_fileset_entries_follow_upload_paths(self, tmp_path):
+        fileData, paths = self._fileset(tmp_path)
+        fileset = FileUploader(MagicMock())._create_fileset(fileData)
+        assert [e.getClientPath().getValue() for e in fileset.copyFilesetEntries()] == paths
+
+    def test_multi_file_upload(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(conf, "UPLOAD_FILESET_CONCURRENCY", 3)
+        monkeypatch.setattr(conf, "UPLOAD_REUSE_STAGED_CHECKSUM", False)
+        fileData, paths = self._fileset(tmp_path)
+        proc = FakeImportProcess([0.02, 0.0, 0.0])  # the first entry finishes last
+        progress: list[int] = []
+
+        hashes = FileUploader(MagicMock())._upload_and_calculate_hash(_ImportProcess(proc), fileData, progress.append)
+
+        # uploader i gets entry i and the hashes are in entry order, not in completion order
+        for idx, path in enumerate(paths):
+            with open(path, "rb") as f:
+                assert bytes(proc.uploaders[idx].data) == f.read()
+            assert proc.uploaders[idx].closed
+        assert hashes == [checksum.file_checksum(p) for p in paths]
+        assert len(fileData.getUploadStats()) == len(paths)
+
+        # one combined stream over all files that only goes up and ends at 100
+        assert progress == sorted(set(progress))
+        assert progress[-1] == 100
+        assert len(progress) > 2
+
+    def test_fallback_to_staged_originals_is_one_fileset(self, tmp_path):
+        fileData, paths = self._fileset(tmp_path)
+        fileData.setCompanionFilePaths([])
+        # the conversion produced nothing, the staged emi and ser files are imported as is
+        with patch.object(image_funcs, 'convert_emi_to_ometiff', return_value=([], {})):
+            file_path, _ = image_funcs.file_format_splitter(fileData)
+        assert sorted(file_path) == sorted(paths)
+
+        groups = FileImporter()._group_fileset_paths(fileData, file_path[::-1])
+        assert len(groups) == 1
+        assert groups[0][0] == os.path.join(str(tmp_path), "scan.emi")
+        assert sorted(groups[0][1:]) == sorted(paths[1:])
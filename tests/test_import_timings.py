@@ -0,0 +1,42 @@
+import time
+import pytest
+from common import import_timings
+from common.import_timings import ImportTimings
+from common.logger import logging
+
+
+class TestImportTimings:
+
+    @classmethod
+    def setup_class(cls):
+        logging.getLogger().info(f"Starting {cls.__name__}")
+
+    @classmethod
+    def teardown_class(cls):
+        logging.getLogger().info(f"Stopping {cls.__name__}")
+
+    def test_phases_are_summed(self):
+        timings = ImportTimings()
+        timings.add(import_timings.TRANSFER, 1.5, 100)
+        timings.add(import_timings.TRANSFER, 0.5, 50)
+        timings.add(import_timings.VERIFY, 2.0)
+
+        phases = timings.phases()
+        assert phases[import_timings.TRANSFER].seconds == 2.0
+        assert phases[import_timings.TRANSFER].bytes == 150
+        assert phases[import_timings.TRANSFER].count == 2
+        assert phases[import_timings.VERIFY].bytes == 0
+
+    def test_measure_records_failed_phases(self):
+        timings = ImportTimings()
+        with pytest.raises(RuntimeError):
+            with timings.measure(import_timings.CONVERSION, 10):
+                time.sleep(0.01)
+                raise RuntimeError("conversion failed")
+        assert timings.phases()[import_timings.CONVERSION].seconds >= 0.01
+
+    def test_log_line(self):
+        timings = ImportTimings()
+        timings.add(import_timings.STAGING, 1.25, 2048)
+        timings.add(import_timings.QUEUE_WAIT, 0.5)
+        assert timings.log_line() == "staging_s=1.250 staging_bytes=2048 queue_wait_s=0.500"
@@ -0,0 +1,100 @@
+import pytest
+from omerofrontend.import_watcher import ImportWatcher
+from common.logger import logging
+
+
+class FakeResponse:
+    def __init__(self, ids):
+        self.objects = ids
+
+
+class FakeCallback:
+    """Stand-in for CmdCallbackI, finished by the test or on the next poll"""
+    instances: list["FakeCallback"] = []
+
+    def __init__(self, client, handle, on_finished):
+        self.handle = handle
+        self.on_finished = on_finished
+        self.response = None
+        self.finish_on_poll = False
+        self.closed = False
+        FakeCallback.instances.append(self)
+
+    def finish(self, response):
+        self.response = response
+        self.on_finished(self)
+
+    def poll(self):
+        if self.finish_on_poll:
+            self.finish(FakeResponse([self.handle]))
+
+    def getResponse(self):
+        return self.response
+
+    def close(self, close_handle):
+        self.closed = True
+
+
+class TestImportWatcher:
+
+    @classmethod
+    def setup_class(cls):
+        logging.getLogger().info(f"Starting {cls.__name__}")
+
+    @classmethod
+    def teardown_class(cls):
+        logging.getLogger().info(f"Stopping {cls.__name__}")
+
+    def setup_method(self):
+        FakeCallback.instances = []
+        self.watcher = ImportWatcher(poll_interval=0.01, finish_threads=2, callback_factory=FakeCallback)
+
+    def teardown_method(self):
+        self.watcher.stop()
+
+    def test_many_imports_finish_independently(self):
+        closed = []
+        futures = [self.watcher.watch(None, h, lambda rsp: rsp.objects, lambda h=h: closed.append(h)) for h in range(3)]
+        assert self.watcher.pending_count() == 3
+
+        FakeCallback.instances[2].finish(FakeResponse([22]))
+        assert futures[2].result(timeout=1) == [22]
+        assert not futures[0].done()
+
+        FakeCallback.instances[0].finish(FakeResponse([20]))
+        FakeCallback.instances[1].finish(FakeResponse([21]))
+        assert [f.result(timeout=1) for f in futures] == [[20], [21], [22]]
+        assert self.watcher.pending_count() == 0
+        assert all(cb.closed for cb in FakeCallback.instances)
+
+    def test_poll_fallback(self):
+        future = self.watcher.watch(None, 7, lambda rsp: rsp.objects)
+        FakeCallback.instances[0].finish_on_poll = True
+        assert future.result(timeout=1) == [7]
+
+    def test_finished_twice_is_handled_once(self):
+        calls = []
+        future = self.watcher.watch(None, 1, lambda rsp: calls.append(rsp) or len(calls))
+        cb = FakeCallback.instances[0]
+        cb.finish(FakeResponse([1]))
+        cb.finish(FakeResponse([1]))
+        assert future.result(timeout=1) == 1
+
+    def test_handler_error_fails_future(self):
+        def handler(rsp):
+            raise RuntimeError("attachment failed")
+        future = self.watcher.watch(None, 1, handler)
+        FakeCallback.instances[0].finish(FakeResponse([1]))
+        with pytest.raises(RuntimeError):
+            future.result(timeout=1)
+
+    def test_finish_during_callback_construction(self):
+        def finishing_factory(client, handle, on_finished):
+            cb = FakeCallback(client, handle, on_finished)
+            cb.finish(FakeResponse([handle]))  # CmdCallbackI may finish in its __init__
+            return cb
+        watcher = ImportWatcher(poll_interval=0.01, callback_factory=finishing_factory)
+        try:
+            assert watcher.watch(None, 5, lambda rsp: rsp.objects).result(timeout=1) == [5]
+        finally:
+            watcher.stop()
@@ -0,0 +1,72 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, cast
+from unittest.mock import MagicMock, patch
+from common.omero_connection import OmeroConnection
+from common.omero_getter_ctx import OmeroGetterCtx
+from common.omero_query import OmeroQuery
+from common.logger import logging
+from omerofrontend.batch_context import BatchContext
+from omerofrontend.middle_ware import MiddleWare
+
+
+class OmeroConnection_(OmeroConnection):
+    def __init__(self):
+        self.omero_token = None
+        self.conn = cast(Any, None)
+        self._mutex = threading.RLock()
+        self.comments: list[str] = []
+
+    def create_comment_annotation(self, comment: str) -> int:
+        self.comments.append(comment)
+        return 700 + len(self.comments)
+
+
+class TestBatchContext:
+
+    @classmethod
+    def setup_class(cls):
+        logging.getLogger().info(f"Starting {cls.__name__}")
+
+    @classmethod
+    def teardown_class(cls):
+        logging.getLogger().info(f"Stopping {cls.__name__}")
+
+    def test_annotations_are_resolved_once_per_batch(self):
+        conn = OmeroConnection_()
+        batch = BatchContext({"Sample": "Mouse", "Comment": "first try"})
+        with patch.object(OmeroGetterCtx, 'get_or_create_map_annotation_id', return_value=11) as map_ann, \
+             patch.object(OmeroGetterCtx, 'get_or_create_tag_annotation_id', side_effect=[21, 22]) as tag_ann:
+            # the files of the batch are imported concurrently
+            with ThreadPoolExecutor(max_workers=4) as ex:
+                results = list(ex.map(lambda _: batch.get_annotations(conn), range(8)))
+
+        assert map_ann.call_count == 1
+        assert map_ann.call_args.args == ("Sample", "Mouse")
+        assert [c.args[0] for c in tag_ann.call_args_list] == ["Sample Mouse", "Comment first try"]
+        assert conn.comments == ["first try"]
+
+        expected = [("MapAnnotationI", 11), ("CommentAnnotationI", 701), ("TagAnnotationI", 21), ("TagAnnotationI", 22)]
+        for annotations in results:
+            assert [(type(a).__name__, a.getId().getValue()) for a in annotations] == expected
+            assert not any(a.isLoaded() for a in annotations)
+        assert results[0][0] is not results[1][0]  # every import gets its own references
+
+    def test_dataset_index_is_loaded_once_per_dataset(self):
+        conn = OmeroConnection_()
+        batch = BatchContext({})
+        with patch.object(OmeroQuery, 'dataset_images', return_value=[]) as dataset_images, \
+             patch.object(OmeroQuery, 'dataset_image_map_values', return_value=[]):
+            index = batch.get_dataset_index(conn, 66)
+            assert batch.get_dataset_index(conn, 66) is index
+            assert batch.get_dataset_index(conn, 67) is not index
+        assert [c.args[0] for c in dataset_images.call_args_list] == [66, 67]
+
+    def test_requests_of_one_batch_share_the_context(self):
+        mw = MiddleWare(MagicMock())
+        batch = mw._get_batch_context("token-a", "group", {"Sample": "Mouse", "PI": 1})
+        assert mw._get_batch_context("token-a", "group", {"PI": "1", "Sample": "Mouse"}) is batch
+        assert mw._get_batch_context("token-a", "group", {"Sample": "Rat", "PI": 1}) is not batch
+        assert mw._get_batch_context("token-a", "other group", {"Sample": "Mouse", "PI": 1}) is not batch
+        assert mw._get_batch_context("token-b", "group", {"Sample": "Mouse", "PI": 1}) is not batch
+        mw._executor.shutdown()
@@ -0,0 +1,145 @@
+import time
+from threading import Thread
+from common.omero_connection_pool import OmeroConnectionPool
+from common.logger import logging
+
+
+class FakeConnection:
+    def __init__(self, host, port, token):
+        self.hostname = host
+        self.port = port
+        self.omero_token = token
+        self.group = None
+        self.alive = True
+        self.dead = False
+        self.closed = False
+        self.last_seen = 0.0
+
+    def set_group_name_for_session(self, group):
+        self.group = group
+
+    def is_alive(self):
+        self.dead = not self.alive
+        return self.alive
+
+    def close(self):
+        self.closed = True
+
+
+class TestOmeroConnectionPool:
+
+    @classmethod
+    def setup_class(cls):
+        logging.getLogger().info(f"Starting {cls.__name__}")
+
+    @classmethod
+    def teardown_class(cls):
+        logging.getLogger().info(f"Stopping {cls.__name__}")
+
+    def _pool(self, max_size=4, idle_timeout=60, health_check_after=0):
+        return OmeroConnectionPool(max_size, idle_timeout, health_check_after, connection_factory=FakeConnection)  # type: ignore
+
+    def test_reuse_same_key(self):
+        pool = self._pool()
+        c1 = pool.acquire("host", "4064", "token")
+        pool.release(c1)
+        c2 = pool.acquire("host", "4064", "token")
+        assert c1 is c2
+        assert pool.idle_count() == 0
+
+    def test_no_reuse_across_keys(self):
+        pool = self._pool()
+        c1 = pool.acquire("host", "4064", "token")
+        pool.release(c1)
+        c2 = pool.acquire("host", "4064", "other_token")
+        c3 = pool.acquire("host", "4064", "token", "group_b")
+        assert c2 is not c1
+        assert c3 is not c1
+        assert c3.group == "group_b"
+
+    def test_group_change_rekeys_on_release(self):
+        pool = self._pool()
+        c1 = pool.acquire("host", "4064", "token")
+        c1.set_group_name_for_session("group_b")
+        pool.release(c1)
+        assert pool.acquire("host", "4064", "token", "group_b") is c1
+
+    def test_dead_connection_is_not_handed_out(self):
+        pool = self._pool()
+        c1 = pool.acquire("host", "4064", "token")
+        pool.release(c1)
+        c1.alive = False
+        c2 = pool.acquire("host", "4064", "token")
+        assert c2 is not c1
+        assert c1.closed
+
+    def test_dead_connection_is_evicted_without_ping(self):
+        pool = self._pool(health_check_after=60)
+        c1 = pool.acquire("host", "4064", "token")
+        pool.release(c1)
+        c1.dead = True  # as marked by the keepalive
+        c2 = pool.acquire("host", "4064", "token")
+        assert c2 is not c1
+        assert c1.closed
+
+    def test_idle_eviction(self):
+        pool = self._pool(idle_timeout=0.01)
+        c1 = pool.acquire("host", "4064", "token")
+        pool.release(c1)
+        time.sleep(0.05)
+        c2 = pool.acquire("host", "4064", "token")
+        assert c2 is not c1
+        assert c1.closed
+
+    def test_max_size_closes_oldest(self):
+        pool = self._pool(max_size=2)
+        conns = [pool.acquire("host", "4064", f"token{i}") for i in range(3)]
+        for c in conns:
+            pool.release(c)
+        assert pool.idle_count() == 2
+        assert conns[0].closed
+        assert not conns[1].closed and not conns[2].closed
+
+    def test_discard_token(self):
+        pool = self._pool()
+        c1 = pool.acquire("host", "4064", "token")
+        c2 = pool.acquire("host", "4064", "token", "group_b")
+        c3 = pool.acquire("host", "4064", "other_token")
+        for c in (c1, c2, c3):
+            pool.release(c)
+        pool.discard_token("token")
+        assert c1.closed and c2.closed
+        assert not c3.closed
+        assert pool.idle_count() == 1
+
+    def test_max_per_token_waits_for_a_release(self):
+        pool = self._pool()
+        c1 = pool.acquire("host", "4064", "token", max_per_token=2)
+        c2 = pool.acquire("host", "4064", "token", max_per_token=2)
+        assert c1 is not c2
+        assert pool.leased_count("token") == 2
+
+        acquired = []
+        waiter = Thread(target=lambda: acquired.append(pool.acquire("host", "4064", "token", max_per_token=2)))
+        waiter.start()
+        waiter.join(0.2)
+        assert not acquired  # the token is at its width
+
+        other = pool.acquire("host", "4064", "other_token", max_per_token=2)
+        assert other.omero_token == "other_token"  # other sessions are not limited by it
+
+        pool.release(c1)
+        waiter.join(2)
+        assert acquired == [c1]
+        assert pool.leased_count("token") == 2
+
+    def test_discard_frees_the_slot(self):
+        pool = self._pool()
+        c1 = pool.acquire("host", "4064", "token", max_per_token=1)
+        pool.discard(c1)
+        assert c1.closed
+        assert pool.leased_count("token") == 0
+        c2 = pool.acquire("host", "4064", "token", max_per_token=1)
+        assert pool.leased_count("token") == 1
+        pool.release(c2)
+        assert pool.leased_count("token") == 0
@@ -0,0 +1,131 @@
+import threading
+from typing import Any, cast
+from unittest.mock import patch
+from omero.rtypes import unwrap
+from common.omero_connection import OmeroConnection
+from common.omero_getter_ctx import OmeroGetterCtx
+from common.omero_query import OmeroQuery
+from common.logger import logging
+
+
+class FakeTag:
+    def __init__(self, tag_id: int):
+        self.tag_id = tag_id
+
+    def getId(self):
+        return self.tag_id
+
+
+class OmeroConnection_(OmeroConnection):
+    """Session of user_id in group_id over a fixed set of annotations, (id, owner id, text)"""
+    def __init__(self, user_id: int, group_id: int, annotations: list[tuple[int, int, str]]):
+        self.omero_token = None
+        self.conn = cast(Any, None)
+        self._mutex = threading.RLock()
+        self.user_id = user_id
+        self.group_id = group_id
+        self.annotations = annotations
+        self.queries: list[str] = []
+        self.created: list[str] = []
+
+    def get_user_id(self):
+        return self.user_id
+
+    def get_group_id(self) -> int:
+        return self.group_id
+
+    def projection(self, query: str, params=None) -> list[list]:
+        self.queries.append(query)
+        values = {name: unwrap(value) for name, value in params.map.items()} if params is not None else {}
+        text = values.get("text", values.get("value"))
+        return [[a_id] for a_id, owner, a_text in self.annotations
+                if owner == values.get("owner", owner) and (text is None or a_text == text)]
+
+    def create_map_annotation(self, key, value, ns=None):
+        self.created.append(value)
+        return 900 + len(self.created)
+
+    def create_tag_annotation(self, tag_value):
+        self.created.append(tag_value)
+        return FakeTag(900 + len(self.created))
+
+
+class TestOmeroGetterCtx:
+
+    @classmethod
+    def setup_class(cls):
+        logging.getLogger().info(f"Starting {cls.__name__}")
+
+    @classmethod
+    def teardown_class(cls):
+        logging.getLogger().info(f"Stopping {cls.__name__}")
+
+    def setup_method(self):
+        OmeroGetterCtx._map_annotation_ids.clear()
+        OmeroGetterCtx._tag_ids.clear()
+        OmeroGetterCtx._tag_indexes.clear()
+
+    def test_map_annotations_are_resolved_per_owner(self):
+        annotations = [(11, 1, "LSM 980"), (12, 2, "LSM 980")]
+        conn_a = OmeroConnection_(1, 5, annotations)
+        conn_b = OmeroConnection_(2, 5, annotations)
+        conn_c = OmeroConnection_(3, 5, annotations)
+
+        # user 1 owns the older annotation, user 2 must not be given it
+        assert OmeroGetterCtx(conn_b).get_or_create_map_annotation_id("Microscope", "LSM 980") == 12
+        assert OmeroGetterCtx(conn_a).get_or_create_map_annotation_id("Microscope", "LSM 980") == 11
+        assert OmeroGetterCtx(conn_c).get_or_create_map_annotation_id("Microscope", "LSM 980") == 901
+        assert conn_c.created == ["LSM 980"]
+        assert all("a.details.owner.id = :owner" in q for q in conn_a.queries + conn_b.queries)
+
+        # cached per owner, no further queries
+        assert OmeroGetterCtx(conn_b).get_or_create_map_annotation_id("Microscope", "LSM 980") == 12
+        assert len(conn_b.queries) == 1
+
+    def test_tags_are_resolved_per_owner(self):
+        annotations = [(21, 1, "Microscope LSM 980"), (22, 2, "Microscope LSM 980")]
+        conn_a = OmeroConnection_(1, 5, annotations)
+        conn_b = OmeroConnection_(2, 5, annotations)
+        conn_c = OmeroConnection_(3, 5, annotations)
+
+        assert OmeroGetterCtx(conn_b).get_or_create_tag_annotation_id("Microscope LSM 980") == 22
+        assert OmeroGetterCtx(conn_a).get_or_create_tag_annotation_id("Microscope LSM 980") == 21
+        assert OmeroGetterCtx(conn_c).get_or_create_tag_annotation_id("Microscope LSM 980") == 901
+        assert conn_c.created == ["Microscope LSM 980"]
+        assert all("a.details.owner.id = :owner" in q for q in conn_a.queries + conn_b.queries)
+
+    def test_tag_index(self):
+        conn = OmeroConnection_(1, 5, [])
+        texts = ["Microscope Talos", "Lens 20x", "Microscope LSM 980", "Other", "Lensless"]
+        with patch.object(OmeroQuery, 'tag_texts', return_value=texts) as tag_texts:
+            index, etag = OmeroGetterCtx(conn).get_tag_index(["Microscope", "Lens"])
+            assert index == {"Microscope": [" LSM 980", " Talos"], "Lens": [" 20x"]}
+
+            # served from the cache until a tag is created in the group
+            assert OmeroGetterCtx(conn).get_tag_index(["Microscope", "Lens"]) == (index, etag)
+            assert tag_texts.call_count == 1
+
+        with patch.object(OmeroQuery, 'tag_texts', return_value=texts + ["Lens 63x"]):
+            OmeroGetterCtx(conn).get_or_create_tag_annotation_id("Lens 63x")
+            index2, etag2 = OmeroGetterCtx(conn).get_tag_index(["Microscope", "Lens"])
+            assert index2["Lens"] == [" 20x", " 63x"]
+            assert etag2 != etag
+
+    def test_tag_index_is_per_user(self):
+        conn_a = OmeroConnection_(1, 5, [])
+        conn_b = OmeroConnection_(2, 5, [])
+        conn_c = OmeroConnection_(3, 6, [])
+        # in a private group each user only sees their own tags
+        with patch.object(OmeroQuery, 'tag_texts', return_value=["Microscope LSM 980"]):
+            index_a, etag_a = OmeroGetterCtx(conn_a).get_tag_index(["Microscope"])
+            OmeroGetterCtx(conn_c).get_tag_index(["Microscope"])
+        with patch.object(OmeroQuery, 'tag_texts', return_value=["Microscope Talos"]) as tag_texts:
+            index_b, etag_b = OmeroGetterCtx(conn_b).get_tag_index(["Microscope"])
+            assert tag_texts.call_count == 1
+        assert index_a == {"Microscope": [" LSM 980"]}
+        assert index_b == {"Microscope": [" Talos"]}
+        assert etag_a != etag_b
+
+        # a new tag drops the index of every member of the group, not of other groups
+        OmeroGetterCtx(conn_b).invalidate_tag_index()
+        assert len(OmeroGetterCtx._tag_indexes) == 1
@@ -0,0 +1,66 @@
+import time
+from common.omero_keepalive import OmeroKeepAlive
+from common.logger import logging
+
+
+class FakeConnection:
+    def __init__(self, alive=True):
+        self.omero_token = "token"
+        self.alive = alive
+        self.closed = False
+        self.dead = False
+        self.last_seen = 0.0
+        self.pings = 0
+
+    def is_alive(self):
+        self.pings += 1
+        if self.alive:
+            self.last_seen = time.monotonic()
+        self.dead = not self.alive
+        return self.alive
+
+
+class TestOmeroKeepAlive:
+
+    @classmethod
+    def setup_class(cls):
+        logging.getLogger().info(f"Starting {cls.__name__}")
+
+    @classmethod
+    def teardown_class(cls):
+        logging.getLogger().info(f"Stopping {cls.__name__}")
+
+    def test_ping_all_records_last_seen_and_dead(self):
+        ka = OmeroKeepAlive(interval=3600)
+        good = FakeConnection()
+        bad = FakeConnection(alive=False)
+        ka.register(good)  # type: ignore
+        ka.register(bad)  # type: ignore
+        assert ka.ping_all() == 1
+        assert good.last_seen > 0 and not good.dead
+        assert bad.dead
+
+        # dead sessions are not pinged again
+        ka.ping_all()
+        assert good.pings == 2
+        assert bad.pings == 1
+        ka.stop()
+
+    def test_closed_connections_are_dropped(self):
+        ka = OmeroKeepAlive(interval=3600)
+        conn = FakeConnection()
+        ka.register(conn)  # type: ignore
+        conn.closed = True
+        ka.ping_all()
+        assert conn.pings == 0
+        ka.stop()
+
+    def test_background_thread_pings(self):
+        ka = OmeroKeepAlive(interval=0.01)
+        conn = FakeConnection()
+        ka.register(conn)  # type: ignore
+        deadline = time.monotonic() + 2
+        while conn.pings < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        ka.stop()
+        assert conn.pings >= 2
@@ -0,0 +1,70 @@
+import threading
+import pytest
+from typing import Any, cast
+from unittest.mock import MagicMock
+from omero.rtypes import rlong, rstring, unwrap
+from common.omero_connection import OmeroConnection
+from common.omero_query import OmeroQuery
+from common.logger import logging
+
+
+class OmeroConnection_(OmeroConnection):
+    """Connection whose query service is a mock returning rows"""
+    def __init__(self, rows: list[list]):
+        self.omero_token = None
+        self._mutex = threading.RLock()
+        self.query_service = MagicMock()
+        self.query_service.projection.return_value = rows
+        self.conn = cast(Any, MagicMock())
+        self.conn.getQueryService.return_value = self.query_service
+
+    def last_query(self) -> tuple[str, dict[str, Any]]:
+        query, params, _ = self.query_service.projection.call_args.args
+        return query, {name: unwrap(value) for name, value in params.map.items()}
+
+
+class TestOmeroQuery:
+
+    @classmethod
+    def setup_class(cls):
+        logging.getLogger().info(f"Starting {cls.__name__}")
+
+    @classmethod
+    def teardown_class(cls):
+        logging.getLogger().info(f"Stopping {cls.__name__}")
+
+    def test_map_annotation_ids(self):
+        conn = OmeroConnection_([[rlong(4)], [rlong(9)]])
+        assert OmeroQuery(conn).map_annotation_ids("Microscope", "LSM 980", 22) == [4, 9]
+        query, params = conn.last_query()
+        assert params == {"key": "Microscope", "value": "LSM 980", "owner": 22}
+        assert "a.ns is null" in query
+        assert "a.details.owner.id = :owner" in query
+
+        OmeroQuery(conn).map_annotation_ids("Microscope", "LSM 980", 22, ns="openmicroscopy.org/omero/client/mapAnnotation")
+        query, params = conn.last_query()
+        assert params["ns"] == "openmicroscopy.org/omero/client/mapAnnotation"
+        assert "a.ns = :ns" in query
+
+    def test_tag_ids_by_text(self):
+        conn = OmeroConnection_([[rlong(7)]])
+        assert OmeroQuery(conn).tag_ids_by_text("Microscope LSM 980", 22) == [7]
+        query, params = conn.last_query()
+        assert params == {"text": "Microscope LSM 980", "owner": 22}
+        assert query.startswith("select a.id from TagAnnotation a ")
+
+    def test_imported_file_ids_by_hash(self):
+        conn = OmeroConnection_([[rlong(31)], [rlong(32)]])
+        assert OmeroQuery(conn).imported_file_ids_by_hash("ab12", 1024, "xxh3_64") == [31, 32]
+        query, params = conn.last_query()
+        assert params == {"hash": "ab12", "size": 1024, "hasher": "xxh3_64"}
+        assert "from FilesetEntry fe" in query
+
+    def test_rows_are_unpacked(self):
+        conn = OmeroConnection_([[rlong(1), rstring("a.czi"), None], [rlong(2), rstring("b.czi"), rlong(1700000000000)]])
+        assert OmeroQuery(conn).dataset_images(66) == [(1, "a.czi", None), (2, "b.czi", 1700000000000)]
+        assert conn.last_query()[1] == {"did": 66}
+
+    def test_unsupported_parameter(self):
+        with pytest.raises(ValueError):
+            OmeroQuery._params(ids=[1, 2])
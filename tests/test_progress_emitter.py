@@ -0,0 +1,112 @@
+import time
+from threading import Event
+from omerofrontend.progress_emitter import ProgressEmitter, ProgressPublisher
+from common.logger import logging
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class InlinePublisher(ProgressPublisher):
+    """Sends on the calling thread, so every update that passes the throttle is recorded"""
+
+    def publish(self, key, send, wait=False):
+        send()
+
+
+class TestProgressEmitter:
+
+    @classmethod
+    def setup_class(cls):
+        logging.getLogger().info(f"Starting {cls.__name__}")
+
+    @classmethod
+    def teardown_class(cls):
+        logging.getLogger().info(f"Stopping {cls.__name__}")
+
+    def _emitter(self, sent, clock, **kwargs):
+        return ProgressEmitter(lambda p, rate, eta: sent.append((p, rate, eta)), publisher=InlinePublisher(),
+                               min_interval=1.0, min_delta=5, clock=clock, **kwargs)
+
+    def test_throttles_by_interval_and_delta(self):
+        sent, clock = [], FakeClock()
+        emitter = self._emitter(sent, clock)
+        emitter(1)
+        for p in range(2, 100):
+            clock.now += 0.1
+            emitter(p)
+        emitter(100)
+
+        percents = [p for p, _, _ in sent]
+        assert percents[0] == 1 and percents[-1] == 100
+        assert len(percents) < 15
+        assert all(b - a >= 5 for a, b in zip(percents, percents[1:-1]))
+
+    def test_final_update_is_always_sent_once(self):
+        sent, clock = [], FakeClock()
+        emitter = self._emitter(sent, clock)
+        emitter(50)
+        emitter(100)  # no time passed, still sent
+        emitter(100)
+        assert [p for p, _, _ in sent] == [50, 100]
+
+    def test_rate_and_eta(self):
+        sent, clock = [], FakeClock()
+        emitter = self._emitter(sent, clock, total_bytes=1000)
+        clock.now += 30.0  # conversion before the upload started is not transfer time
+        emitter(0)
+        clock.now += 1.0
+        emitter(50)
+        assert sent[-1] == (50, 500, 1.0)
+        clock.now += 1.0
+        emitter(100)
+        _, rate, eta = sent[-1]
+        assert rate == 500
+        assert eta == 0
+
+        sent, clock = [], FakeClock()
+        emitter = self._emitter(sent, clock)
+        emitter(0)
+        clock.now += 2.0
+        emitter(100)
+        assert sent[-1] == (100, None, None)
+
+    def test_next_upload_starts_a_new_run(self):
+        sent, clock = [], FakeClock()
+        emitter = self._emitter(sent, clock, total_bytes=1000)
+        emitter(0)
+        clock.now += 2.0
+        emitter(100)
+        clock.now += 60.0  # the next fileset is converted and checked for duplicates
+        emitter(0)
+        clock.now += 1.0
+        emitter(40)
+        clock.now += 1.0
+        emitter(100)
+        emitter(100)
+        assert [p for p, _, _ in sent] == [0, 100, 0, 40, 100]
+        assert sent[3][1] == 400
+        assert sent[4][1] == 500
+
+    def test_slow_sender_does_not_block_updates(self):
+        release = Event()
+        sent = []
+
+        def slow_send(p, rate, eta):
+            release.wait(5)
+            sent.append(p)
+
+        emitter = ProgressEmitter(slow_send, min_interval=0, min_delta=1, publisher=ProgressPublisher())
+        start = time.monotonic()
+        for p in range(1, 100):
+            emitter(p)
+        assert time.monotonic() - start < 1.0  # never waited for the sender
+        release.set()
+        emitter(100)
+        assert sent[-1] == 100
+        assert len(sent) < 99  # pending updates were coalesced
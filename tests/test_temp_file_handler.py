@@ -1,6 +1,9 @@
+import hashlib
+import io
 import os
 import pytest
-from omerofrontend.temp_file_handler import TempFileHandler
+from concurrent.futures import ThreadPoolExecutor
+from omerofrontend.temp_file_handler import TempFileHandler, StagedFile
 from common.logger import logging
 from common import conf
 from omerofrontend.exceptions import ImageNotSupported, GeneralError
@@ -35,7 +38,9 @@ class TestTempFileHandler:
             fsize = os.path.getsize(czi_path)
             assert(fd.getFileSizes()[0] == fsize)
             assert(fd.getTotalFileSize() == fsize)
-            file_path = os.path.join(conf.UPLOAD_FOLDER + "/" + username, *os.path.split(czi_path))
+            file_path = fd.getTempFilePaths()[0]
+            staging_dir = os.path.relpath(file_path, conf.UPLOAD_FOLDER + "/" + username).split(os.sep)[0]
+            assert(file_path == self.get_temp_ul_path(username, czi_path, staging_dir))
             assert(fd.getBasePath() == os.path.dirname(file_path))
             assert(os.path.exists(file_path))
 
@@ -74,16 +79,16 @@ class TestTempFileHandler:
     def testf_create_user_temp_dir(self):
         czi_path = 'tests/data/test_image.czi'
         username = "ragnar"
-        file_path = self.get_temp_ul_path(username,czi_path)
+        file_path = self.tfh._create_user_temp_dir(czi_path, username, "0123abcd")
         
         user_ul_folder = conf.UPLOAD_FOLDER + "/" + username
-        fp = os.path.join(user_ul_folder, *os.path.split(czi_path))
+        fp = os.path.join(user_ul_folder, "0123abcd", *os.path.split(czi_path))
         
         assert(file_path == fp)
         assert(os.path.isdir(os.path.dirname(file_path)))
  
-    def get_temp_ul_path(self,username: str, file: str):
-        return os.path.join(conf.UPLOAD_FOLDER + "/" + username, *os.path.split(file))
+    def get_temp_ul_path(self,username: str, file: str, staging_id: str):
+        return os.path.join(conf.UPLOAD_FOLDER + "/" + username, staging_id, *os.path.split(file))
     
     def test_remove_temp_files(self):
         czi_path = 'tests/data/test_image.czi'
@@ -96,7 +101,57 @@ class TestTempFileHandler:
             content_type='application/octet-stream')
             fd: FileData = self.tfh.check_and_store_tempfiles([czi_filestorage], username, None)
         
+            file_path = fd.getTempFilePaths()[0]
             self.tfh._remove_temp_files(fd)
      
-            file_path = self.get_temp_ul_path(username,czi_path)
             assert(not os.path.exists(file_path))
+            assert(os.path.isdir(conf.UPLOAD_FOLDER + "/" + username))
+            assert(not os.path.exists(os.path.dirname(file_path)))  # the empty staging directory went with it
+
+    def test_concurrent_uploads_of_same_name_are_staged_apart(self):
+        username: str = "ragnar"
+        payloads = [bytes([i]) * (64 * 1024 + i) for i in range(4)]
+
+        def store(data: bytes):
+            fs = FileStorage(stream=io.BytesIO(data), filename="concurrent.czi", content_type='application/octet-stream')
+            return self.tfh.check_and_store_tempfiles([fs], username, None)
+
+        with ThreadPoolExecutor(max_workers=4) as ex:
+            results = list(ex.map(store, payloads))
+
+        paths = [fd.getTempFilePaths()[0] for fd in results]
+        assert len(set(paths)) == len(payloads)  # a later upload never replaces the file of an earlier import
+        for path, data in zip(paths, payloads):
+            with open(path, 'rb') as f:
+                assert f.read() == data
+            assert not [n for n in os.listdir(os.path.dirname(path)) if n.endswith(".part")]
+        for fd in results:
+            self.tfh._remove_temp_files(fd)
+
+    def test_staged_file_is_committed_with_its_hash(self):
+        username: str = "ragnar"
+        data = os.urandom(3 * 1024 * 1024 + 17)
+        staged = self.tfh.open_staged_file("streamed.czi", username, "5eed")
+        for i in range(0, len(data), 64 * 1024):  # as the form parser writes the part
+            staged.write(data[i:i + 64 * 1024])
+        staged.seek(0)
+        fs = FileStorage(stream=staged, filename="streamed.czi", content_type='application/octet-stream')
+
+        fd: FileData = self.tfh.check_and_store_tempfiles([fs], username, None)
+
+        file_path = self.get_temp_ul_path(username, "streamed.czi", "5eed")
+        assert fd.getTempFilePaths() == [file_path]
+        assert fd.getFileSizes() == [len(data)]
+        assert fd.getFileHash(file_path) == hashlib.sha1(data).hexdigest()
+        assert not os.path.exists(staged.part_path)
+        fs.close()  # closing after the commit keeps the staged file
+        assert os.path.exists(file_path)
+        os.remove(file_path)
+
+    def test_uncommitted_staged_file_is_removed_on_close(self):
+        staged: StagedFile = self.tfh.open_staged_file("aborted.czi", "ragnar", "ab047ed")
+        staged.write(b"partial upload")
+        staged.close()
+        assert not os.path.exists(staged.part_path)
+        assert not os.path.exists(staged.final_path)
+
@@ -0,0 +1,193 @@
+import hashlib
+import time
+import pytest
+from omerofrontend.upload_pipeline import UploadPipeline, BlockSizeController
+from common import checksum
+from common.logger import logging
+
+
+class FakeAsyncResult:
+    def __init__(self, offset, length):
+        self.offset = offset
+        self.length = length
+
+
+class FakeRawFileStore:
+    """Records begin_write/end_write calls like an Ice RawFileStore proxy"""
+    def __init__(self, latency=0.0, fail_at_offset=None):
+        self.latency = latency
+        self.fail_at_offset = fail_at_offset
+        self.data = bytearray()
+        self.outstanding = 0
+        self.max_outstanding = 0
+
+    def begin_write(self, buf, offset, length):
+        assert isinstance(buf, bytes)
+        assert len(buf) == length
+        if offset == self.fail_at_offset:
+            raise ConnectionError("connection lost")
+        if len(self.data) < offset + length:
+            self.data.extend(b"\0" * (offset + length - len(self.data)))
+        self.data[offset:offset + length] = buf
+        self.outstanding += 1
+        self.max_outstanding = max(self.max_outstanding, self.outstanding)
+        return FakeAsyncResult(offset, length)
+
+    def end_write(self, result):
+        time.sleep(self.latency)
+        self.outstanding -= 1
+
+
+class TestUploadPipeline:
+
+    @classmethod
+    def setup_class(cls):
+        logging.getLogger().info(f"Starting {cls.__name__}")
+
+    @classmethod
+    def teardown_class(cls):
+        logging.getLogger().info(f"Stopping {cls.__name__}")
+
+    def _file(self, tmp_path, size):
+        data = bytes(i % 251 for i in range(size))
+        path = tmp_path / "image.czi"
+        path.write_bytes(data)
+        return str(path), data
+
+    def test_upload_writes_all_bytes_and_hashes(self, tmp_path):
+        path, data = self._file(tmp_path, 10 * 1000 + 123)
+        rfs = FakeRawFileStore(latency=0.001)
+        sent = []
+        digest = UploadPipeline(block_size=1000, max_in_flight=3, queue_depth=2).upload(rfs, path, sent.append)
+
+        assert digest == hashlib.sha1(data).hexdigest()
+        assert bytes(rfs.data) == data
+        assert sent[-1] == len(data)
+        assert sent == sorted(sent)
+        assert rfs.max_outstanding == 3
+
+    def test_configured_checksum_algorithm(self, tmp_path):
+        path, data = self._file(tmp_path, 5 * 1000 + 1)
+        digest = UploadPipeline(block_size=1000, algorithm=checksum.CRC_32).upload(FakeRawFileStore(), path)
+        assert digest == checksum.file_checksum(path, checksum.CRC_32)
+
+    def test_empty_file(self, tmp_path):
+        path, data = self._file(tmp_path, 0)
+        rfs = FakeRawFileStore()
+        assert UploadPipeline(block_size=1000).upload(rfs, path) == hashlib.sha1(b"").hexdigest()
+        assert rfs.data == bytearray()
+
+    def test_write_error_stops_pipeline(self, tmp_path):
+        path, _ = self._file(tmp_path, 50 * 1000)
+        rfs = FakeRawFileStore(fail_at_offset=5000)
+        with pytest.raises(ConnectionError):
+            UploadPipeline(block_size=1000, queue_depth=2).upload(rfs, path)
+
+    def test_resume_from_confirmed_offset(self, tmp_path):
+        path, data = self._file(tmp_path, 20 * 1000)
+        rfs = FakeRawFileStore(fail_at_offset=12000)
+        pipeline = UploadPipeline(block_size=1000, max_in_flight=2, queue_depth=2)
+        with pytest.raises(ConnectionError):
+            pipeline.upload(rfs, path)
+        confirmed = pipeline.confirmed_offset
+        assert 0 < confirmed <= 12000
+        assert pipeline.confirmed_digest.hexdigest() == hashlib.sha1(data[:confirmed]).hexdigest()
+
+        resumed = FakeRawFileStore()
+        resumed.data = bytearray(rfs.data[:confirmed])
+        sent = []
+        digest = pipeline.upload(resumed, path, sent.append, resume=True)
+
+        assert digest == hashlib.sha1(data).hexdigest()
+        assert bytes(resumed.data) == data
+        assert sent[0] > confirmed  # nothing before the confirmed offset was sent again
+        assert pipeline.stats.bytes_written == len(data)
+
+    def test_known_checksum_skips_hashing(self, tmp_path, monkeypatch):
+        path, data = self._file(tmp_path, 10 * 1000 + 5)
+        pipeline = UploadPipeline(block_size=1000, queue_depth=2)
+        monkeypatch.setattr(pipeline, "_hash", lambda *args: pytest.fail("file hashed again"))
+        rfs = FakeRawFileStore()
+        assert pipeline.upload(rfs, path, known_checksum="staged") == "staged"
+        assert bytes(rfs.data) == data
+
+    def test_resume_with_known_checksum(self, tmp_path):
+        path, data = self._file(tmp_path, 20 * 1000)
+        rfs = FakeRawFileStore(fail_at_offset=12000)
+        pipeline = UploadPipeline(block_size=1000, max_in_flight=2, queue_depth=2)
+        with pytest.raises(ConnectionError):
+            pipeline.upload(rfs, path, known_checksum="staged")
+        confirmed = pipeline.confirmed_offset
+        assert 0 < confirmed <= 12000
+
+        resumed = FakeRawFileStore()
+        resumed.data = bytearray(rfs.data[:confirmed])
+        assert pipeline.upload(resumed, path, resume=True, known_checksum="staged") == "staged"
+        assert bytes(resumed.data) == data
+
+    def test_missing_file_raises(self, tmp_path):
+        with pytest.raises(FileNotFoundError):
+            UploadPipeline().upload(FakeRawFileStore(), str(tmp_path / "missing.czi"))
+
+
+class TestBlockSizeController:
+
+    @classmethod
+    def setup_class(cls):
+        logging.getLogger().info(f"Starting {cls.__name__}")
+
+    @classmethod
+    def teardown_class(cls):
+        logging.getLogger().info(f"Stopping {cls.__name__}")
+
+    def _window(self, ctrl, now, seconds, latency=0.01, nbytes=None):
+        """Feed one window of writes finishing at now + seconds"""
+        nbytes = ctrl.block_size if nbytes is None else nbytes
+        for _ in range(4):
+            ctrl.record(nbytes, latency, now + seconds)
+        return now + seconds
+
+    def test_grows_while_throughput_improves(self):
+        ctrl = BlockSizeController(initial_size=1000, min_size=500, max_size=8000, window=4, target_latency=1.0)
+        now = self._window(ctrl, time.monotonic(), 1.0)
+        assert ctrl.block_size == 2000
+        now = self._window(ctrl, now, 1.0)  # twice the bytes in the same time
+        assert ctrl.block_size == 4000
+        now = self._window(ctrl, now, 1.0)
+        now = self._window(ctrl, now, 1.0)
+        assert ctrl.block_size == 8000  # clamped to max
+
+    def test_turns_around_when_throughput_drops(self):
+        ctrl = BlockSizeController(initial_size=1000, min_size=500, max_size=8000, window=4, target_latency=1.0)
+        now = self._window(ctrl, time.monotonic(), 1.0)
+        assert ctrl.block_size == 2000
+        self._window(ctrl, now, 4.0)  # bigger blocks made it slower
+        assert ctrl.block_size == 1000
+
+    def test_shrinks_on_slow_writes(self):
+        ctrl = BlockSizeController(initial_size=4000, min_size=500, max_size=8000, window=4, target_latency=1.0)
+        now = self._window(ctrl, time.monotonic(), 1.0, latency=3.0)
+        assert ctrl.block_size == 2000
+        self._window(ctrl, now, 1.0, latency=3.0)
+        assert ctrl.block_size == 1000
+
+    def test_limit_caps_block_size(self):
+        ctrl = BlockSizeController(initial_size=4000, min_size=500, max_size=8000)
+        ctrl.limit(3000)
+        assert ctrl.block_size == 3000
+        assert ctrl.max_size == 3000
+
+    def test_pipeline_with_adapting_block_size(self, tmp_path):
+        data = bytes(i % 251 for i in range(200 * 1000 + 7))
+        path = tmp_path / "image.czi"
+        path.write_bytes(data)
+        ctrl = BlockSizeController(initial_size=1000, min_size=500, max_size=16000, window=2, target_latency=1.0)
+        rfs = FakeRawFileStore()
+        pipeline = UploadPipeline(controller=ctrl, queue_depth=2)
+        digest = pipeline.upload(rfs, str(path))
+
+        assert digest == hashlib.sha1(data).hexdigest()
+        assert bytes(rfs.data) == data
+        assert pipeline.stats.bytes_written == len(data)
+        assert pipeline.stats.initial_block_size == 1000
+        assert pipeline.stats.final_block_size == ctrl.block_size